@@ -1,15 +1,38 @@
 import os
+import sys
 import typing
+from collections.abc import Iterable, Sequence
 
 from .datapack_generator import datapack_generator as dg
+from .optimizer.common_subexpressions import eliminate_common_subexpressions
+from .optimizer.constant_folding import partial_evaluation
+from .optimizer.rewriting import Rewriter, RuleSet, rewrite_all
 from .parser.multistage_parser import parse as parse
+from .parser.name_resolver import resolve_names
+from .parser.parse_tracing import TextTracer
+from .parser.term_graph import ProgramTerm
 from .tokenizer import Tokenizer as tokenizer
+from .tokenizer.token import Token
 
 
-def partial_compile(src_file_path: str, do_prints: bool = True) -> dg.DataPack:
+def partial_compile(
+    src_file_path: str,
+    do_prints: bool = True,
+    trace_parse: bool = False,
+    rule_sets: Sequence[RuleSet] = (),
+    evaluate_constants: bool = False,
+    hoist_common_calls: bool = False,
+    resolve: bool = False,
+) -> dg.DataPack:
     """
     This compiles everything and returns the resulting data pack
     without writing it to the file system
+
+    trace_parse prints the parse stack after every step. The parsed
+    program then has its constant calls evaluated if evaluate_constants,
+    is rewritten by each of rule_sets in turn, has its repeated pure
+    calls hoisted if hoist_common_calls, and has its names resolved to
+    slots if resolve
     """
     PRINT_SEPARATOR: typing.Final = "\n### ### ###\n"
     source_file_name: typing.Final = os.path.splitext(os.path.basename(src_file_path))[
@@ -17,24 +40,58 @@ def partial_compile(src_file_path: str, do_prints: bool = True) -> dg.DataPack:
     ]
 
     with open(src_file_path) as file:
-        src = file.read()
+        tokens: Iterable[Token]
 
-    if do_prints:
-        print(PRINT_SEPARATOR)
-        print(src)
-        print(PRINT_SEPARATOR)
+        if do_prints:
+            src = file.read()
 
-    tokens = tokenizer.tokenize(src)
+            print(PRINT_SEPARATOR)
+            print(src)
+            print(PRINT_SEPARATOR)
 
-    if do_prints:
-        print("\n".join(str(token) for token in tokens))
-        print(PRINT_SEPARATOR)
-    ast = parse(tokens)
+            tokens = tokenizer.tokenize(src)
+
+            print("\n".join(str(token) for token in tokens))
+            print(PRINT_SEPARATOR)
+        else:
+            # Nothing needs the whole source, so let the parser
+            # pull tokens straight off the file
+            tokens = tokenizer.tokenize_stream(file)
+
+        ast = parse(tokens, observers=(TextTracer(),) if trace_parse else ())
 
     if do_prints:
-        print(ast)
+        ast.write_tree(sys.stdout)
         print(PRINT_SEPARATOR)
 
+    if evaluate_constants:
+        # parse always gives a program
+        rule_sets = (partial_evaluation(typing.cast(ProgramTerm, ast)), *rule_sets)
+
+    if rule_sets:
+        rewriters = [Rewriter(rule_set) for rule_set in rule_sets]
+        ast = rewrite_all(ast, rewriters)
+
+        if do_prints:
+            for rewriter in rewriters:
+                print(rewriter.stats_report())
+            ast.write_tree(sys.stdout)
+            print(PRINT_SEPARATOR)
+
+    if hoist_common_calls:
+        ast, report = eliminate_common_subexpressions(typing.cast(ProgramTerm, ast))
+
+        if do_prints:
+            print(
+                f"Hoisted {report.hoisted} calls, saving"
+                f" {report.calls_saved} of {report.calls_before}"
+            )
+            ast.write_tree(sys.stdout)
+            print(PRINT_SEPARATOR)
+
+    if resolve:
+        ast = resolve_names(typing.cast(ProgramTerm, ast))
+
     directory_rep = dg.generate_datapack(ast, source_file_name)
     return directory_rep
 
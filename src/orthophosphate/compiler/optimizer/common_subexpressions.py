@@ -0,0 +1,211 @@
+import itertools
+import typing
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+
+from ..parser.language import BUILTINS, DEFINE, binding_counts, reference_name
+from ..parser.term_graph import (
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    StrTerm,
+    Term,
+)
+from .rewriting import substitute_all
+
+PURE_FUNCTIONS: typing.Final = BUILTINS
+"""
+Functions whose calls depend only on their arguments and do nothing
+else, so that one call can stand in for many
+"""
+
+TEMPORARY_PREFIX: typing.Final = "opo4:cse_"
+
+
+@dataclass(frozen=True)
+class CseReport:
+    hoisted: int
+    calls_before: int
+    calls_after: int
+
+    @property
+    def calls_saved(self) -> int:
+        return self.calls_before - self.calls_after
+
+
+def eliminate_common_subexpressions(
+    program: ProgramTerm, pure_functions: frozenset[str] = PURE_FUNCTIONS
+) -> tuple[ProgramTerm, CseReport]:
+    """
+    The program with each pure call that it makes more than once
+    defined once, as a temporary at the start, and referred to
+    by name everywhere else
+
+    A call is pure if it is to one of pure_functions with ints,
+    strings and pure calls as arguments. References are not, since
+    which binding a name refers to depends on where it is, and nor
+    are calls to functions the program binds itself, which shadow
+    the builtins. Temporaries are named so as not to clash with any
+    name the program uses.
+
+    A call is only hoisted if that saves calls. One made k times,
+    with c calls in its tree each time, is made k * c times before,
+    and c + 1 times after, counting its definition. Calls are decided
+    on callers first, so that a call inside a hoisted one counts the
+    definition as one occurrence, however many times it is used.
+    """
+
+    exprs = program.top_level_exprs
+    pure_functions = pure_functions - binding_counts(program).keys()
+    # The tables below are keyed by id(term), which is as good as the
+    # term while it is alive, as terms are interned, and much quicker
+    # to hash. The terms are kept alive by program.
+    order = _postorder(exprs, _subterms)
+    pure = _pure_terms(order, pure_functions)
+    calls_in: dict[int, int] = {}
+    for term in order:
+        calls_in[id(term)] = (type(term) is FunctionCallTerm) + sum(
+            calls_in[id(t)] for t in term.subterms()
+        )
+
+    counts: dict[int, int] = {}
+    for expr in exprs:
+        counts[id(expr)] = counts.get(id(expr), 0) + 1
+    hoisted: list[Term] = []
+    for term in reversed(order):
+        count = counts[id(term)]
+        if (
+            type(term) is FunctionCallTerm
+            and id(term) in pure
+            and (count - 1) * calls_in[id(term)] > 1
+        ):
+            hoisted.append(term)
+            count = 1  # Once, in its definition
+        for child in term.subterms():
+            counts[id(child)] = counts.get(id(child), 0) + count
+
+    calls_before = _call_count(program)
+    if not hoisted:
+        return program, CseReport(0, calls_before, calls_before)
+
+    hoisted.reverse()  # Numbered in the order they are defined
+    names = _fresh_names(order)
+    temporaries = {term: ReferenceTerm(next(names)) for term in hoisted}
+    # A hoisted call is kept in its definition, with its subterms replaced
+    hoisted_subterms = [term.subterms() for term in hoisted]
+    replaced = iter(
+        substitute_all(
+            (*exprs, *(t for subterms in hoisted_subterms for t in subterms)),
+            temporaries,
+        )
+    )
+    exprs = tuple(next(replaced) for _ in exprs)
+    bodies = {
+        temporaries[term]: term.with_subterms(tuple(next(replaced) for _ in subterms))
+        for term, subterms in zip(hoisted, hoisted_subterms)
+    }
+
+    # Each temporary defined after the ones its definition refers to
+    definitions = tuple(
+        FunctionCallTerm(DEFINE, (term, bodies[term]))
+        for term in _postorder(
+            bodies,
+            lambda term: (bodies[term],) if term in bodies else term.subterms(),
+        )
+        if term in bodies
+    )
+    result = ProgramTerm((*definitions, *exprs))
+    return result, CseReport(len(hoisted), calls_before, _call_count(result))
+
+
+def _subterms(term: Term) -> tuple[Term, ...]:
+    return term.subterms()
+
+
+def _postorder(
+    roots: Iterable[Term], children: Callable[[Term], tuple[Term, ...]]
+) -> list[Term]:
+    """
+    Every term reachable from roots once, after all of its children,
+    off an explicit stack
+    """
+
+    order: list[Term] = []
+    seen: set[int] = set()
+    stack = [(root, False) for root in reversed(list(roots))]
+    while stack:
+        term, children_done = stack.pop()
+        if children_done:
+            order.append(term)
+        elif id(term) not in seen:
+            seen.add(id(term))
+            stack.append((term, True))
+            stack.extend(
+                (child, False)
+                for child in reversed(children(term))
+                if id(child) not in seen
+            )
+    return order
+
+
+def _fresh_names(order: Iterable[Term]) -> Iterator[str]:
+    """
+    Names for temporaries, TEMPORARY_PREFIX and a number, leaving
+    out any name used among the terms
+    """
+
+    used = {
+        typing.cast(ReferenceTerm, term).name
+        for term in order
+        if type(term) is ReferenceTerm
+    }
+    return (
+        name
+        for name in (f"{TEMPORARY_PREFIX}{i}" for i in itertools.count())
+        if name not in used
+    )
+
+
+def _pure_terms(order: list[Term], pure_functions: frozenset[str]) -> set[int]:
+    pure: set[int] = set()
+    for term in order:
+        kind = type(term)
+        if kind is IntTerm or kind is StrTerm:
+            pure.add(id(term))
+        elif kind is FunctionCallTerm:
+            call = typing.cast(FunctionCallTerm, term)
+            if reference_name(call.head) in pure_functions and all(
+                id(arg) in pure for arg in call.args
+            ):
+                pure.add(id(term))
+    return pure
+
+
+def _call_count(program: ProgramTerm) -> int:
+    """
+    How many calls the program makes, counted once per occurrence
+    """
+
+    order = _postorder(program.top_level_exprs, _subterms)
+    occurrences = _occurrences(program.top_level_exprs, reversed(order))
+    return sum(
+        occurrences[id(term)] for term in order if type(term) is FunctionCallTerm
+    )
+
+
+def _occurrences(
+    roots: Iterable[Term], parents_first: Iterable[Term]
+) -> dict[int, int]:
+    """
+    How many times each term appears in the trees the roots stand for
+    """
+
+    counts: dict[int, int] = {}
+    for root in roots:
+        counts[id(root)] = counts.get(id(root), 0) + 1
+    for term in parents_first:
+        count = counts[id(term)]
+        for child in term.subterms():
+            counts[id(child)] = counts.get(id(child), 0) + count
+    return counts
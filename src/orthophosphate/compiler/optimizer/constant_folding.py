@@ -0,0 +1,360 @@
+import typing
+from collections.abc import Callable, Collection
+
+from ..parser.language import (
+    BUILTINS,
+    LIST,
+    binding_counts,
+    list_items,
+    reference_name,
+)
+from ..parser.term_graph import (
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    StrTerm,
+    Term,
+)
+from .rewriting import Rewriter, Rule, RuleSet, substitute
+
+type Folder = Callable[[FunctionCallTerm], Term | None]
+"""
+Gives what a call to a builtin evaluates to, as far as that can
+be known before the pack runs, or None if none of it can
+"""
+
+MAX_CALL_DEPTH: typing.Final = 64
+"""
+How deeply calls to user functions are evaluated inside each other;
+calls nested deeper are left for the pack to make
+"""
+
+_TRUE: typing.Final = IntTerm(1)
+_FALSE: typing.Final = IntTerm(0)
+
+
+def wrap_int(value: int) -> int:
+    """
+    The value as a scoreboard holds it: a signed 32-bit int,
+    wrapped around on overflow
+    """
+    return (value + (1 << 31)) % (1 << 32) - (1 << 31)
+
+
+def is_constant(term: Term) -> bool:
+    """
+    Whether the term is an int, a string, or a list of constants
+    """
+
+    stack = [term]
+    while stack:
+        current = stack.pop()
+        kind = type(current)
+        if kind is IntTerm or kind is StrTerm:
+            continue
+        items = list_items(current)
+        if items is None:
+            return False
+        stack.extend(items)
+    return True
+
+
+def _int_values(args: tuple[Term, ...]) -> list[int] | None:
+    values: list[int] = []
+    for arg in args:
+        if type(arg) is not IntTerm:
+            return None
+        values.append(typing.cast(IntTerm, arg).value)
+    return values
+
+
+def _associative(op: Callable[[int, int], int]) -> Folder:
+    """
+    Folds a call that combines any number of ints in any order: all
+    of them if they are all constant, else just the constant ones,
+    into one last argument
+    """
+
+    def fold(call: FunctionCallTerm) -> Term | None:
+        args = call.args
+        constants = [
+            typing.cast(IntTerm, arg).value for arg in args if type(arg) is IntTerm
+        ]
+        if not constants:
+            return None
+        value = wrap_int(constants[0])
+        for constant in constants[1:]:
+            value = wrap_int(op(value, constant))
+        if len(constants) == len(args):
+            return IntTerm(value)
+        if len(constants) == 1 and type(args[-1]) is IntTerm and value == constants[0]:
+            return None  # Already folded as far as it goes
+        rest = tuple(arg for arg in args if type(arg) is not IntTerm)
+        return FunctionCallTerm(call.head, (*rest, IntTerm(value)))
+
+    return fold
+
+
+def _binary(op: Callable[[int, int], int | None]) -> Folder:
+    def fold(call: FunctionCallTerm) -> Term | None:
+        values = _int_values(call.args)
+        if values is None or len(values) != 2:
+            return None
+        result = op(*values)
+        return None if result is None else IntTerm(wrap_int(result))
+
+    return fold
+
+
+def _floor_quotient(a: int, b: int) -> int | None:
+    # Division by zero is left for the pack, which leaves the score as it is
+    return None if b == 0 else a // b
+
+
+def _floor_remainder(a: int, b: int) -> int | None:
+    return None if b == 0 else a % b
+
+
+def _comparison(op: Callable[[typing.Any, typing.Any], bool], strings: bool) -> Folder:
+    """
+    Folds a comparison of two ints, or of two strings if strings,
+    to 1 or 0
+    """
+
+    def fold(call: FunctionCallTerm) -> Term | None:
+        if len(call.args) != 2:
+            return None
+        a, b = call.args
+        if type(a) is IntTerm and type(b) is IntTerm:
+            values = (typing.cast(IntTerm, a).value, typing.cast(IntTerm, b).value)
+        elif strings and type(a) is StrTerm and type(b) is StrTerm:
+            values = (typing.cast(StrTerm, a).value, typing.cast(StrTerm, b).value)
+        else:
+            return None
+        return _TRUE if op(*values) else _FALSE
+
+    return fold
+
+
+def _length(call: FunctionCallTerm) -> Term | None:
+    args = call.args
+    if len(args) != 1:
+        return None
+    items = list_items(args[0])
+    return None if items is None else IntTerm(len(items))
+
+
+def _concat(call: FunctionCallTerm) -> Term | None:
+    items: list[Term] = []
+    for arg in call.args:
+        arg_items = list_items(arg)
+        if arg_items is None:
+            return None
+        items.extend(arg_items)
+    return FunctionCallTerm(LIST, tuple(items))
+
+
+def _item(call: FunctionCallTerm) -> Term | None:
+    args = call.args
+    if len(args) != 2 or type(args[1]) is not IntTerm:
+        return None
+    items = list_items(args[0])
+    index = typing.cast(IntTerm, args[1]).value
+    if items is None or not 0 <= index < len(items):
+        return None
+    return items[index]
+
+
+ARITHMETIC: typing.Final[dict[str, Folder]] = {
+    "sum": _associative(lambda a, b: a + b),
+    "product": _associative(lambda a, b: a * b),
+    "min": _associative(min),
+    "max": _associative(max),
+    "difference": _binary(lambda a, b: a - b),
+    "quotient": _binary(_floor_quotient),
+    "remainder": _binary(_floor_remainder),
+}
+"""
+Scoreboard arithmetic, which works on 32-bit ints and rounds
+quotients down, as scoreboard operations do
+"""
+
+COMPARISONS: typing.Final[dict[str, Folder]] = {
+    "eq": _comparison(lambda a, b: a == b, strings=True),
+    "ne": _comparison(lambda a, b: a != b, strings=True),
+    "lt": _comparison(lambda a, b: a < b, strings=False),
+    "le": _comparison(lambda a, b: a <= b, strings=False),
+    "gt": _comparison(lambda a, b: a > b, strings=False),
+    "ge": _comparison(lambda a, b: a >= b, strings=False),
+}
+
+LIST_OPERATIONS: typing.Final[dict[str, Folder]] = {
+    "length": _length,
+    "concat": _concat,
+    "item": _item,
+}
+
+
+def _folding_rule(name: str, folders: dict[str, Folder]) -> Rule:
+    def apply(term: Term) -> Term | None:
+        call = typing.cast(FunctionCallTerm, term)
+        head_name = reference_name(call.head)
+        folder = None if head_name is None else folders.get(head_name)
+        return None if folder is None else folder(call)
+
+    return Rule(name, apply, (FunctionCallTerm,))
+
+
+def constant_folding(shadowed: Collection[str] = ()) -> RuleSet:
+    """
+    Rules that evaluate calls to builtins where their arguments are
+    constant, except for the builtins named in shadowed
+    """
+
+    def known(folders: dict[str, Folder]) -> dict[str, Folder]:
+        return {name: f for name, f in folders.items() if name not in shadowed}
+
+    return RuleSet(
+        "constant_folding",
+        (
+            _folding_rule("arithmetic", known(ARITHMETIC)),
+            _folding_rule("comparisons", known(COMPARISONS)),
+            _folding_rule("lists", known(LIST_OPERATIONS)),
+        ),
+    )
+
+
+CONSTANT_FOLDING: typing.Final = constant_folding()
+"""
+For programs that bind none of the BUILTINS names themselves
+"""
+
+
+def partial_evaluation(program: ProgramTerm) -> RuleSet:
+    """
+    Constant folding, plus rules that evaluate calls to the program's
+    pure functions where all the arguments are constant and so is
+    what the call gives
+
+    A pure function is one defined at the top level as
+    "def NAME fn([PARAMS] BODY)", once, whose body only calls
+    builtins and other pure functions on its parameters and constants.
+    Names the program binds anywhere are never folded as builtins,
+    nor taken as pure functions if they are bound twice.
+    """
+
+    counts = binding_counts(program)
+    shadowed = {name for name in counts if name in BUILTINS}
+    functions = _pure_functions(program, counts)
+    folding = constant_folding(shadowed)
+    depth = 0
+
+    def evaluate_call(term: Term) -> Term | None:
+        nonlocal depth
+        call = typing.cast(FunctionCallTerm, term)
+        name = reference_name(call.head)
+        function = None if name is None else functions.get(name)
+        if function is None or depth == MAX_CALL_DEPTH:
+            return None
+        params, body = function
+        if len(params) != len(call.args) or not all(map(is_constant, call.args)):
+            return None
+
+        depth += 1
+        try:
+            result = evaluator.rewrite(substitute(body, dict(zip(params, call.args))))
+        finally:
+            depth -= 1
+        return result if is_constant(result) else None
+
+    rule_set = RuleSet(
+        "partial_evaluation",
+        (*folding.rules, Rule("user_functions", evaluate_call, (FunctionCallTerm,))),
+    )
+    # Bodies are evaluated with a Rewriter of their own, so that
+    # each call with the same arguments is evaluated once
+    evaluator = Rewriter(rule_set)
+    return rule_set
+
+
+def _pure_functions(
+    program: ProgramTerm, counts: dict[str, int]
+) -> dict[str, tuple[tuple[ReferenceTerm, ...], Term]]:
+    """
+    The pure functions of the program, by name, with their
+    parameters and bodies
+    """
+
+    candidates: dict[str, tuple[tuple[ReferenceTerm, ...], Term]] = {}
+    for expr in program.top_level_exprs:
+        match expr:
+            case FunctionCallTerm(
+                ReferenceTerm("def"),
+                (
+                    ReferenceTerm(name),
+                    FunctionCallTerm(ReferenceTerm("fn"), (params, body)),
+                ),
+            ):
+                items = list_items(params)
+                if (
+                    items is not None
+                    and counts.get(name) == 1
+                    and name not in BUILTINS
+                    and all(type(item) is ReferenceTerm for item in items)
+                    and len(set(items)) == len(items)
+                ):
+                    candidates[name] = (
+                        typing.cast(tuple[ReferenceTerm, ...], items),
+                        body,
+                    )
+
+    # Drop functions whose bodies use anything else, until none do
+    changed = True
+    while changed:
+        changed = False
+        for name, (params, body) in list(candidates.items()):
+            if not _only_uses(body, set(params), candidates.keys()):
+                del candidates[name]
+                changed = True
+    return candidates
+
+
+def _only_uses(
+    body: Term, params: set[ReferenceTerm], functions: Collection[str]
+) -> bool:
+    """
+    Whether the body is made of constants and of calls to builtins
+    and functions on its parameters, without any parameter being
+    named like a builtin or function it calls
+    """
+
+    if any(param.name in BUILTINS or param.name in functions for param in params):
+        return False
+
+    seen: set[Term] = set()
+    stack = [body]
+    while stack:
+        term = stack.pop()
+        if term in seen:
+            continue
+        seen.add(term)
+
+        kind = type(term)
+        if kind is IntTerm or kind is StrTerm:
+            continue
+        if kind is ReferenceTerm:
+            if term not in params:
+                return False
+            continue
+        if kind is not FunctionCallTerm:
+            return False
+        call = typing.cast(FunctionCallTerm, term)
+        head = call.head
+        if type(head) is not ReferenceTerm:
+            return False
+        name = typing.cast(ReferenceTerm, head).name
+        if name not in BUILTINS and name not in functions:
+            return False
+        stack.extend(call.args)
+    return True
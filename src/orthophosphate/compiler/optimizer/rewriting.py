@@ -0,0 +1,209 @@
+import time
+import typing
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from dataclasses import dataclass
+
+from ..parser.term_graph import Term
+
+_VISIT: typing.Final = 0
+_REBUILD: typing.Final = 1
+_ALIAS: typing.Final = 2
+
+
+class RewriteError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    A rewrite of a term into an equivalent one
+
+    apply gives the replacement, or None where the rule does not
+    apply. It is only tried on terms of the given kinds, or on every
+    term if kinds is empty, and only once the term's subterms have
+    been rewritten.
+    """
+
+    name: str
+    apply: Callable[[Term], Term | None]
+    kinds: tuple[type[Term], ...] = ()
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    name: str
+    rules: tuple[Rule, ...]
+
+    def rules_for(self, kind: type[Term]) -> tuple[Rule, ...]:
+        return tuple(
+            rule
+            for rule in self.rules
+            if not rule.kinds or issubclass(kind, rule.kinds)
+        )
+
+
+@dataclass
+class RuleStats:
+    tries: int = 0
+    hits: int = 0
+    seconds: float = 0.0
+
+
+class Rewriter:
+    """
+    Rewrites terms with a rule set, bottom-up, until no rule
+    applies anywhere in them
+
+    What each term rewrites to is kept for the life of the
+    Rewriter, so a subterm shared across the graph, or across
+    calls, is only rewritten once.
+    """
+
+    def __init__(self, rule_set: RuleSet) -> None:
+        self.rule_set = rule_set
+        self.stats = {rule.name: RuleStats() for rule in rule_set.rules}
+        self._memo: dict[Term, Term] = {}
+        self._rules_by_kind: dict[type[Term], tuple[tuple[Rule, RuleStats], ...]] = {}
+
+    def rewrite(self, term: Term) -> Term:
+        """
+        The term with its subterms rewritten, then with the first rule
+        that applies to it applied, over and over until none do
+
+        Works off an explicit stack, so nesting depth is not limited by
+        the recursion limit. Raises RewriteError if the rules would
+        rewrite a term into one containing itself, so would never stop.
+        """
+
+        memo = self._memo
+        # Terms whose rewriting has started but not finished
+        active: set[Term] = set()
+        stack: list[tuple[int, Term, Term]] = [(_VISIT, term, term)]
+        while stack:
+            stage, current, replacement = stack.pop()
+            if stage == _ALIAS:
+                # current rewrites to whatever replacement does
+                memo[current] = memo[replacement]
+                active.discard(current)
+                continue
+            if current in memo:
+                continue
+
+            subterms = current.subterms()
+            if stage == _VISIT:
+                if current in active:
+                    raise RewriteError(
+                        f"Rules in {self.rule_set.name} do not terminate on "
+                        f"{current.display_node_inline()}"
+                    )
+                active.add(current)
+                pending = [t for t in dict.fromkeys(subterms) if t not in memo]
+                if pending:
+                    stack.append((_REBUILD, current, current))
+                    stack.extend((_VISIT, t, t) for t in reversed(pending))
+                    continue
+
+            rebuilt = (
+                current.with_subterms(tuple(memo[t] for t in subterms))
+                if subterms
+                else current
+            )
+            result = self._apply(rebuilt)
+            if result is None:
+                result = rebuilt
+            elif result not in memo:
+                stack.append((_ALIAS, current, result))
+                if rebuilt is not current:
+                    stack.append((_ALIAS, rebuilt, result))
+                stack.append((_VISIT, result, result))
+                continue
+            else:
+                result = memo[result]
+
+            memo[current] = memo[rebuilt] = result
+            active.discard(current)
+
+        return memo[term]
+
+    def _apply(self, term: Term) -> Term | None:
+        kind = type(term)
+        rules = self._rules_by_kind.get(kind)
+        if rules is None:
+            rules = self._rules_by_kind[kind] = tuple(
+                (rule, self.stats[rule.name]) for rule in self.rule_set.rules_for(kind)
+            )
+
+        for rule, stats in rules:
+            start = time.perf_counter()
+            replacement = rule.apply(term)
+            stats.seconds += time.perf_counter() - start
+            stats.tries += 1
+            if replacement is not None and replacement is not term:
+                stats.hits += 1
+                return replacement
+        return None
+
+    def clear(self) -> None:
+        self._memo.clear()
+
+    def stats_report(self) -> str:
+        return "\n".join(
+            f"{self.rule_set.name}/{name:<24} {stats.hits:>8} hits"
+            f" {stats.tries:>8} tries {stats.seconds * 1000:8.1f} ms"
+            for name, stats in self.stats.items()
+        )
+
+
+def rewrite_all(term: Term, rewriters: Sequence[Rewriter]) -> Term:
+    """
+    The term rewritten by each rewriter in turn
+    """
+    for rewriter in rewriters:
+        term = rewriter.rewrite(term)
+    return term
+
+
+def substitute(term: Term, replacements: Mapping[Term, Term]) -> Term:
+    """
+    The term with the outermost occurrences of each key of
+    replacements replaced
+    """
+    return substitute_all((term,), replacements)[0]
+
+
+def substitute_all(
+    terms: Iterable[Term], replacements: Mapping[Term, Term]
+) -> tuple[Term, ...]:
+    """
+    substitute for each of the terms, rebuilding the subterms
+    they share once, off an explicit stack
+    """
+
+    # Keyed by id(term), which is as good as the term while it is
+    # alive, as terms are interned, and much quicker to hash
+    by_id = {id(key): value for key, value in replacements.items()}
+    memo: dict[int, Term] = {}
+    terms = tuple(terms)
+    stack: list[tuple[Term, bool]] = [(term, False) for term in reversed(terms)]
+    while stack:
+        current, children_done = stack.pop()
+        if id(current) in memo:
+            continue
+        replacement = by_id.get(id(current))
+        if replacement is not None:
+            memo[id(current)] = replacement
+            continue
+
+        subterms = current.subterms()
+        pending = [t for t in subterms if id(t) not in memo]
+        if pending and not children_done:
+            stack.append((current, True))
+            stack.extend((t, False) for t in reversed(pending))
+            continue
+        memo[id(current)] = (
+            current.with_subterms(tuple(memo[id(t)] for t in subterms))
+            if subterms
+            else current
+        )
+    return tuple(memo[id(term)] for term in terms)
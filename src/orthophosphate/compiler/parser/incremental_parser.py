@@ -0,0 +1,248 @@
+import hashlib
+import typing
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass, field
+from itertools import accumulate, chain
+
+from ..tokenizer.incremental import TokenEdit
+from ..tokenizer.token import IndentType, Token, TokenType
+from ..tokenizer.token_buffer import (
+    DEDENT_KIND,
+    INDENT_KIND,
+    NEWLINE_KIND,
+    PUNC_KINDS,
+    TokenBuffer,
+)
+from .multistage_parser import parse_tree
+from .parse_tree2 import AnyMultilineExpr, Program
+from .term_graph import ProgramTerm, Term
+
+_FILE_START: typing.Final = Token(TokenType.PUNC, "file_start")
+_EOF: typing.Final = Token(TokenType.PUNC, "EOF")
+
+_OPENERS: typing.Final = frozenset({"(", "["})
+_CLOSERS: typing.Final = frozenset({")", "]"})
+_OPENER_KINDS: typing.Final = frozenset(PUNC_KINDS[p] for p in _OPENERS)
+_CLOSER_KINDS: typing.Final = frozenset(PUNC_KINDS[p] for p in _CLOSERS)
+
+
+@dataclass(frozen=True)
+class TopLevelRun:
+    """
+    A run of tokens between two column-zero line starts, and the
+    top-level blocks (usually one) it parses to
+
+    Runs do not know where they are, so that they can be
+    reused as they are when an edit before them moves them.
+    """
+
+    length: int
+    fingerprint: bytes
+    nodes: tuple[AnyMultilineExpr, ...]
+    terms: tuple[Term, ...]
+
+
+@dataclass(frozen=True)
+class BlockParse:
+    """
+    A parse kept as the top-level runs of its tokens
+
+    reparsed is how many runs had to be parsed to make this one;
+    the rest came from the cache of runs by fingerprint, which is
+    shared by a parse and every reparse made from it.
+    """
+
+    runs: tuple[TopLevelRun, ...]
+    reparsed: int
+    _cache: dict[bytes, TopLevelRun] = field(repr=False, compare=False)
+
+    def program(self) -> Program:
+        return Program(tuple(chain.from_iterable(run.nodes for run in self.runs)))
+
+    def term(self) -> Term:
+        return ProgramTerm(tuple(chain.from_iterable(run.terms for run in self.runs)))
+
+
+def parse_blocks(
+    tokens: Sequence[Token], cache: dict[bytes, TopLevelRun] | None = None
+) -> BlockParse:
+    """
+    Parses the tokens (as tokenize gives them, with file_start and EOF)
+    one top-level run at a time, reusing cached runs with the same
+    fingerprint
+    """
+
+    cache = {} if cache is None else cache
+    runs: list[TopLevelRun] = []
+    reparsed = 0
+    start = 1  # After file_start
+    for end in run_ends(tokens, start):
+        run, was_parsed = _run_of(tokens, start, end, cache)
+        runs.append(run)
+        reparsed += was_parsed
+        start = end
+    return _finished(runs, reparsed, cache)
+
+
+def reparse(
+    old: BlockParse, tokens: Sequence[Token], edit: TokenEdit | None = None
+) -> BlockParse:
+    """
+    Parses the new tokens, reparsing only the runs that changed
+
+    Without an edit every run is fingerprinted again. With the TokenEdit
+    that turned the old tokens into these (see tokenizer.incremental.relex)
+    only the runs around the edit are looked at: splitting restarts at the
+    run before the edit and stops at the first old run boundary after it,
+    and the runs on either side are kept as they are.
+    """
+
+    if edit is None:
+        return parse_blocks(tokens, old._cache)
+
+    old_runs = old.runs
+    # Token index each old run starts at (file_start comes first)
+    old_starts = list(accumulate((run.length for run in old_runs), initial=1))
+
+    # The run ending right at the edit is redone too, since whether it
+    # ended there depended on the first token of the edit
+    first = max(bisect_left(old_starts, edit.start) - 1, 0)
+    shift = len(edit.tokens) - (edit.stop - edit.start)
+    edit_end = edit.start + len(edit.tokens)
+
+    runs = list(old_runs[:first])
+    reparsed = 0
+    start = old_starts[first]
+    for end in run_ends(tokens, start):
+        run, was_parsed = _run_of(tokens, start, end, old._cache)
+        runs.append(run)
+        reparsed += was_parsed
+        start = end
+
+        if end >= edit_end:
+            resync = bisect_left(old_starts, end - shift)
+            if resync < len(old_runs) and old_starts[resync] == end - shift:
+                # Back on an old boundary, past the edit
+                runs.extend(old_runs[resync:])
+                break
+
+    return _finished(runs, reparsed, old._cache)
+
+
+def _finished(
+    runs: list[TopLevelRun], reparsed: int, cache: dict[bytes, TopLevelRun]
+) -> BlockParse:
+    if len(cache) > 2 * len(runs) + 64:
+        # Forget runs that are long gone
+        live = {run.fingerprint: run for run in runs}
+        cache.clear()
+        cache.update(live)
+    return BlockParse(tuple(runs), reparsed, cache)
+
+
+def _run_of(
+    tokens: Sequence[Token], start: int, end: int, cache: dict[bytes, TopLevelRun]
+) -> tuple[TopLevelRun, bool]:
+    """
+    The run for tokens[start:end], and whether it had to be parsed
+    """
+
+    run_tokens = tokens[start:end]
+    fingerprint = _fingerprint(run_tokens)
+    cached = cache.get(fingerprint)
+    if cached is not None:
+        return cached, False
+
+    nodes = tuple(parse_tree((_FILE_START, *run_tokens, _EOF)).content)
+    run = TopLevelRun(
+        end - start, fingerprint, nodes, tuple(node.to_term() for node in nodes)
+    )
+    cache[fingerprint] = run
+    return run, True
+
+
+def _fingerprint(run_tokens: Sequence[Token]) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for t in run_tokens:
+        digest.update(f"{t.type.value}:{t.value}\0".encode())
+    return digest.digest()
+
+
+def run_ends(tokens: Sequence[Token], start: int) -> Iterator[int]:
+    """
+    Where the top-level runs from start (a run boundary) end, up to EOF
+
+    A run ends after a NEWLINE or DEDENT that leaves no indentation and
+    no open bracket, unless an INDENT follows (the line has a body).
+    """
+
+    if isinstance(tokens, TokenBuffer):
+        yield from _buffer_run_ends(tokens, start)
+        return
+
+    eof = len(tokens) - 1
+    last = start
+    depth = 0
+    brackets = 0
+    for i in range(start, eof):
+        t = tokens[i]
+        match t.type:
+            case TokenType.NEWLINE:
+                pass
+            case TokenType.INDENT_DEDENT:
+                depth += 1 if t.value == IndentType.INDENT else -1
+                if t.value == IndentType.INDENT:
+                    continue
+            case TokenType.PUNC if t.value in _OPENERS:
+                brackets += 1
+                continue
+            case TokenType.PUNC if t.value in _CLOSERS:
+                brackets -= 1
+                continue
+            case _:
+                continue
+
+        if depth == 0 and brackets == 0 and not tokens[i + 1].matches(
+            TokenType.INDENT_DEDENT, IndentType.INDENT
+        ):
+            last = i + 1
+            yield last
+
+    if last < eof:
+        # Whatever is left, even though it cannot be a complete block
+        yield eof
+
+
+def _buffer_run_ends(tokens: TokenBuffer, start: int) -> Iterator[int]:
+    """
+    run_ends reading only the kinds, without making a Token for each
+    """
+
+    kinds = tokens.kinds
+    eof = len(kinds) - 1
+    last = start
+    depth = 0
+    brackets = 0
+    for i in range(start, eof):
+        kind = kinds[i]
+        if kind == INDENT_KIND:
+            depth += 1
+            continue
+        if kind == DEDENT_KIND:
+            depth -= 1
+        elif kind in _OPENER_KINDS:
+            brackets += 1
+            continue
+        elif kind in _CLOSER_KINDS:
+            brackets -= 1
+            continue
+        elif kind != NEWLINE_KIND:
+            continue
+
+        if depth == 0 and brackets == 0 and kinds[i + 1] != INDENT_KIND:
+            last = i + 1
+            yield last
+
+    if last < eof:
+        yield eof
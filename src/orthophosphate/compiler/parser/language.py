@@ -0,0 +1,96 @@
+import typing
+
+from .term_graph import FunctionCallTerm, ProgramTerm, ReferenceTerm, Term
+
+DEFINE: typing.Final = ReferenceTerm("def")
+FUNCTION: typing.Final = ReferenceTerm("fn")
+LIST: typing.Final = ReferenceTerm("opo4:list")
+
+LIST_CONSTRUCTORS: typing.Final = frozenset((LIST.name, "list"))
+
+BUILTINS: typing.Final = frozenset(
+    (
+        *("sum", "product", "min", "max", "difference", "quotient", "remainder"),
+        *("eq", "ne", "lt", "le", "gt", "ge"),
+        *("length", "concat", "item"),
+        *LIST_CONSTRUCTORS,
+    )
+)
+"""
+Every builtin function: scoreboard arithmetic, comparisons and list
+operations, all of them pure. def and fn are special forms, not
+functions, so are not among them.
+"""
+
+# The checks below are on exact types, since isinstance against a
+# term class goes through Protocol, which is many times slower
+
+
+def reference_name(term: Term) -> str | None:
+    """
+    The name, if the term is a plain reference to one
+    """
+    if type(term) is ReferenceTerm:
+        return typing.cast(ReferenceTerm, term).name
+    return None
+
+
+def list_items(term: Term) -> tuple[Term, ...] | None:
+    """
+    The items, if the term is a list literal
+    """
+    if type(term) is not FunctionCallTerm:
+        return None
+    call = typing.cast(FunctionCallTerm, term)
+    if reference_name(call.head) in LIST_CONSTRUCTORS:
+        return call.args
+    return None
+
+
+def line_content(term: Term) -> Term:
+    """
+    What a line on its own, which is a call without arguments to
+    what is on it, has on it
+    """
+    if type(term) is FunctionCallTerm:
+        call = typing.cast(FunctionCallTerm, term)
+        if not call.args:
+            return call.head
+    return term
+
+
+def binding_counts(program: ProgramTerm) -> dict[str, int]:
+    """
+    How many distinct places each name is bound, by def or as
+    a parameter of fn
+    """
+
+    counts: dict[str, int] = {}
+    seen: set[Term] = set()
+    stack: list[Term] = [program]
+    while stack:
+        term = stack.pop()
+        if term in seen:
+            continue
+        seen.add(term)
+        stack.extend(term.subterms())
+
+        for name in _bound_names(term):
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _bound_names(term: Term) -> tuple[str, ...]:
+    if type(term) is not FunctionCallTerm:
+        return ()
+    call = typing.cast(FunctionCallTerm, term)
+    if call.head is DEFINE and call.args and type(call.args[0]) is ReferenceTerm:
+        return (typing.cast(ReferenceTerm, call.args[0]).name,)
+    if call.head is FUNCTION and call.args:
+        items = list_items(call.args[0]) or ()
+        return tuple(
+            typing.cast(ReferenceTerm, item).name
+            for item in items
+            if type(item) is ReferenceTerm
+        )
+    return ()
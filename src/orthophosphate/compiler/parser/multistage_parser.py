@@ -1,7 +1,7 @@
 from abc import abstractmethod
 from collections.abc import Iterable, Iterator, Sequence
-from dataclasses import dataclass
-from typing import Protocol, Self, override
+from dataclasses import dataclass, field
+from typing import ClassVar, Protocol, Self, override
 
 from ..tokenizer.token import IndentType, Token, TokenType
 from .parse_tree2 import (
@@ -22,6 +22,13 @@ from .term_graph import Term
 
 type IntermediaryParseResult = Token | ParseTreeNode
 
+type DispatchKey = tuple[TokenType, str | None] | type
+"""
+What RuleDispatch looks up rules by: (type, value) for
+punctuation and indents, (type, None) for other tokens,
+and the class for nodes
+"""
+
 
 @dataclass(frozen=True)
 class PrependList[T]:
@@ -36,10 +43,54 @@ class PrependList[T]:
             current = current.next
 
 
+class AnyParseStack(Protocol):
+    """
+    What the reduction rules need from a parse stack
+
+    push and replace_top return the stack to carry on with: a new one
+    for ParseStack, the same one (changed) for ListParseStack. Rules
+    must not call them unless they are going to reduce.
+    """
+
+    @property
+    def item(self) -> IntermediaryParseResult:
+        """
+        The top of the stack
+        """
+        ...
+
+    def push(self, result: IntermediaryParseResult) -> Self: ...
+
+    def replace_top(self, count: int, result: IntermediaryParseResult) -> Self:
+        """
+        Pops count items and pushes result in their place
+        """
+        ...
+
+    def from_top(self) -> Iterator[IntermediaryParseResult]: ...
+
+    def __iter__(self) -> Iterator[IntermediaryParseResult]: ...
+
+    def __len__(self) -> int: ...
+
+
 @dataclass(frozen=True)
 class ParseStack:
+    """
+    A persistent stack: pushing and reducing leave the old stack as it was
+    """
+
     previous: Self | None
     item: IntermediaryParseResult
+    size: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        size = 1 if self.previous is None else self.previous.size + 1
+        object.__setattr__(self, "size", size)
+
+    @classmethod
+    def of(cls, result: IntermediaryParseResult) -> Self:
+        return cls(None, result)
 
     def pop(self) -> tuple[IntermediaryParseResult, Self | None]:
         return self.item, self.previous
@@ -49,28 +100,115 @@ class ParseStack:
 
     shift = push
 
-    def __iter__(self) -> Iterator[IntermediaryParseResult]:
-        def reverse_iterator() -> Iterator[IntermediaryParseResult]:
-            current = self
-            while current is not None:
-                yield current.item
-                current = current.previous
-
-        return reversed(tuple(reverse_iterator()))
+    def replace_top(self, count: int, result: IntermediaryParseResult) -> Self:
+        below = self.previous
+        for _ in range(count - 1):
+            assert below is not None, "Popped past the bottom of the stack"
+            below = below.previous
+        return type(self)(below, result)
 
-    def __len__(self) -> int:
-        l = 0
+    def from_top(self) -> Iterator[IntermediaryParseResult]:
         current = self
         while current is not None:
-            l += 1
+            yield current.item
             current = current.previous
-        return l
+
+    def __iter__(self) -> Iterator[IntermediaryParseResult]:
+        return reversed(tuple(self.from_top()))
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class ListParseStack:
+    """
+    A stack that is changed in place, kept in a list
+
+    For the times the old stack is still needed, checkpoint marks
+    the current state and rollback goes back to it. Every change
+    pushes exactly one item, so undoing one means dropping the top
+    item and putting back what it replaced; that is only logged
+    while a checkpoint is held.
+    """
+
+    __slots__ = ("items", "_undo", "_held")
+
+    def __init__(self, items: Iterable[IntermediaryParseResult] = ()) -> None:
+        self.items = list(items)
+        self._undo: list[tuple[IntermediaryParseResult, ...]] | None = None
+        self._held = 0
+
+    @classmethod
+    def of(cls, result: IntermediaryParseResult) -> Self:
+        return cls((result,))
+
+    @property
+    def item(self) -> IntermediaryParseResult:
+        return self.items[-1]
+
+    def push(self, result: IntermediaryParseResult) -> Self:
+        self.items.append(result)
+        if self._undo is not None:
+            self._undo.append(())
+        return self
+
+    shift = push
+
+    def replace_top(self, count: int, result: IntermediaryParseResult) -> Self:
+        items = self.items
+        assert count <= len(items), "Popped past the bottom of the stack"
+        if self._undo is not None:
+            self._undo.append(tuple(items[-count:]))
+        del items[-count:]
+        items.append(result)
+        return self
+
+    def checkpoint(self) -> int:
+        if self._undo is None:
+            self._undo = []
+        self._held += 1
+        return len(self._undo)
+
+    def rollback(self, mark: int) -> None:
+        """
+        Undoes every change since checkpoint gave mark
+        """
+        assert self._undo is not None, "No checkpoint to roll back to"
+        items = self.items
+        while len(self._undo) > mark:
+            del items[-1]
+            items.extend(self._undo.pop())
+
+    def release(self, mark: int) -> None:
+        """
+        Gives up the checkpoint; changes stop being logged
+        once every checkpoint is released
+        """
+        assert self._held > 0, "No checkpoint to release"
+        self._held -= 1
+        if not self._held:
+            self._undo = None
+
+    def from_top(self) -> Iterator[IntermediaryParseResult]:
+        return reversed(self.items)
+
+    def __iter__(self) -> Iterator[IntermediaryParseResult]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
 
 
 class ReductionRule(Protocol):
+    triggers: ClassVar[tuple[DispatchKey, ...]]
+    """
+    Keys of the stack tops this rule can reduce; it
+    must return None for every other top
+    """
+
     @staticmethod
     @abstractmethod
-    def apply(stack: ParseStack) -> ParseStack | None:
+    def apply[S: AnyParseStack](stack: S) -> S | None:
         raise NotImplementedError
 
 
@@ -80,7 +218,7 @@ def chain_2_rules(
     class ChainedRule(ReductionRule):
         @staticmethod
         @override
-        def apply(stack: ParseStack) -> ParseStack | None:
+        def apply[S: AnyParseStack](stack: S) -> S | None:
             r1 = first.apply(stack)
             if r1 is None:
                 return second.apply(stack)
@@ -100,10 +238,12 @@ def chain_rules(*rules: type[ReductionRule]) -> type[ReductionRule]:
 
 
 class ReduceLiterals(ReductionRule):
+    triggers = ((TokenType.INT, None), (TokenType.STR, None), (TokenType.NAME, None))
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, chopped_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        last = stack.item
         new_last: SimpleLiteralOrVarNode
 
         if isinstance(last, Token):
@@ -115,28 +255,25 @@ class ReduceLiterals(ReductionRule):
                 new_last = Name(last.value)
             else:
                 return None
-            return ParseStack(chopped_stack, new_last)
+            return stack.replace_top(1, new_last)
 
         return None
 
 
 class ReduceListLiteral(ReductionRule):
+    triggers = ((TokenType.PUNC, "]"),)
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.matches(TokenType.PUNC, "]")
-            and current_stack is not None
-        ):
+        if isinstance(last, Token) and last.matches(TokenType.PUNC, "]"):
             items: PrependList[AnyMultilineExpr] | None = None
-            while True:
-                if current_stack is None:
-                    return None
-                current_item, current_stack = current_stack.pop()
-
+            count = 1
+            for current_item in below:
+                count += 1
                 if isinstance(current_item, Token) and current_item.matches(
                     TokenType.PUNC, "["
                 ):
@@ -145,30 +282,30 @@ class ReduceListLiteral(ReductionRule):
                     items = PrependList(current_item, items)
                 else:
                     return None
+            else:
+                return None
 
-            return ParseStack(
-                current_stack,
+            return stack.replace_top(
+                count,
                 ListLiteral(tuple(items) if items is not None else ()),
             )
         return None
 
 
 class ReduceInlineListLiteral(ReductionRule):
+    triggers = ((TokenType.PUNC, "]"),)
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.matches(TokenType.PUNC, "]")
-            and current_stack is not None
-        ):
+        if isinstance(last, Token) and last.matches(TokenType.PUNC, "]"):
             items: PrependList[AnyInlineExpr] | None = None
-            while True:
-                if current_stack is None:
-                    return None
-                current_item, current_stack = current_stack.pop()
+            count = 1
+            for current_item in below:
+                count += 1
                 if isinstance(current_item, Token) and current_item.matches(
                     TokenType.PUNC, "["
                 ):
@@ -177,30 +314,30 @@ class ReduceInlineListLiteral(ReductionRule):
                     items = PrependList(current_item, items)
                 else:
                     return None
+            else:
+                return None
 
-            return ParseStack(
-                current_stack,
+            return stack.replace_top(
+                count,
                 InlineListLiteral(tuple(items) if items is not None else ()),
             )
         return None
 
 
 class ReduceInlineExpr(ReductionRule):
+    triggers = ((TokenType.PUNC, ")"),)
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.matches(TokenType.PUNC, ")")
-            and current_stack is not None
-        ):
+        if isinstance(last, Token) and last.matches(TokenType.PUNC, ")"):
             items: PrependList[AnyInlineExpr] | None = None
-            while True:
-                if current_stack is None:
-                    return None
-                current_item, current_stack = current_stack.pop()
+            count = 1
+            for current_item in below:
+                count += 1
                 if isinstance(current_item, Token) and current_item.matches(
                     TokenType.PUNC, "("
                 ):
@@ -209,67 +346,62 @@ class ReduceInlineExpr(ReductionRule):
                     items = PrependList(current_item, items)
                 else:
                     return None
-            if current_stack is None:
+            else:
                 return None
-            head, current_stack = current_stack.pop()
+            head = next(below, None)
             if isinstance(head, AnyInlineExpr):
-                return ParseStack(
-                    current_stack,
+                return stack.replace_top(
+                    count + 1,
                     InlineExpr(head, tuple(items) if items is not None else ()),
                 )
         return None
 
 
 class ReduceSimpleExpr(ReductionRule):
+    triggers = ((TokenType.NEWLINE, None),)
 
     @override
     @staticmethod
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.type is TokenType.NEWLINE
-            and current_stack is not None
-        ):
+        if isinstance(last, Token) and last.type is TokenType.NEWLINE:
             items: PrependList[AnyInlineExpr] | None = None
-            inner_current_stack = current_stack
-            while True:
-                if inner_current_stack is None:
-                    break
-                current_item, inner_current_stack = inner_current_stack.pop()
+            count = 1
+            for current_item in below:
                 if isinstance(current_item, AnyInlineExpr):
                     items = PrependList(current_item, items)
-                    current_stack = inner_current_stack
+                    count += 1
                 else:
                     break
 
             if items is None:
                 return None
 
-            return ParseStack(
-                current_stack,
+            return stack.replace_top(
+                count,
                 MultilineExpr(tuple(items), ()),
             )
         return None
 
 
 class ReduceMultilineExpr(ReductionRule):
+    triggers = ((TokenType.INDENT_DEDENT, IndentType.DEDENT),)
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.matches(TokenType.INDENT_DEDENT, IndentType.DEDENT)
-            and current_stack is not None
+        if isinstance(last, Token) and last.matches(
+            TokenType.INDENT_DEDENT, IndentType.DEDENT
         ):
             items: PrependList[AnyMultilineExpr] | None = None
-            while True:
-                if current_stack is None:
-                    return None
-                current_item, current_stack = current_stack.pop()
+            count = 1
+            for current_item in below:
+                count += 1
                 if isinstance(current_item, Token) and current_item.matches(
                     TokenType.INDENT_DEDENT, IndentType.INDENT
                 ):
@@ -278,14 +410,13 @@ class ReduceMultilineExpr(ReductionRule):
                     items = PrependList(current_item, items)
                 else:
                     return None
-
-            if current_stack is None:
+            else:
                 return None
 
-            head, current_stack = current_stack.pop()
+            head = next(below, None)
             if isinstance(head, MultilineExpr) and len(head.args) == 0:
-                return ParseStack(
-                    current_stack,
+                return stack.replace_top(
+                    count + 1,
                     (
                         MultilineExpr(head.inline_args, tuple(items))
                         if items is not None
@@ -296,21 +427,19 @@ class ReduceMultilineExpr(ReductionRule):
 
 
 class ReduceProgram(ReductionRule):
+    triggers = ((TokenType.PUNC, "EOF"),)
+
     @staticmethod
     @override
-    def apply(stack: ParseStack) -> ParseStack | None:
-        last, current_stack = stack.pop()
+    def apply[S: AnyParseStack](stack: S) -> S | None:
+        below = stack.from_top()
+        last = next(below)
 
-        if (
-            isinstance(last, Token)
-            and last.matches(TokenType.PUNC, "EOF")
-            and current_stack is not None
-        ):
+        if isinstance(last, Token) and last.matches(TokenType.PUNC, "EOF"):
             items: PrependList[AnyMultilineExpr] | None = None
-            while True:
-                if current_stack is None:
-                    return None
-                current_item, current_stack = current_stack.pop()
+            count = 1
+            for current_item in below:
+                count += 1
                 if isinstance(current_item, Token) and current_item.matches(
                     TokenType.PUNC, "file_start"
                 ):
@@ -319,15 +448,17 @@ class ReduceProgram(ReductionRule):
                     items = PrependList(current_item, items)
                 else:
                     return None
+            else:
+                return None
 
-            return ParseStack(
-                current_stack,
+            return stack.replace_top(
+                count,
                 Program(tuple(items) if items is not None else ()),
             )
         return None
 
 
-reductions = chain_rules(
+REDUCTION_RULES: tuple[type[ReductionRule], ...] = (
     ReduceLiterals,
     ReduceInlineExpr,
     ReduceInlineListLiteral,
@@ -336,6 +467,96 @@ reductions = chain_rules(
     ReduceListLiteral,
     ReduceProgram,
 )
+"""
+All the rules, in the order they are tried
+"""
+
+reductions = chain_rules(*REDUCTION_RULES)
+
+
+def dispatch_key(item: IntermediaryParseResult) -> DispatchKey:
+    if isinstance(item, Token):
+        if item.type is TokenType.PUNC or item.type is TokenType.INDENT_DEDENT:
+            return (item.type, item.value)
+        return (item.type, None)
+    return type(item)
+
+
+@dataclass
+class RuleStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class RuleDispatch:
+    """
+    Applies the first rule that reduces the stack, like chain_rules,
+    but only tries the rules triggered by the top of the stack
+
+    Counts how often each rule is tried and how often it succeeds, to
+    help with ordering the rules. With indexed=False every rule is tried,
+    as chain_rules does, which makes the counts comparable.
+    """
+
+    def __init__(self, *rules: type[ReductionRule], indexed: bool = True) -> None:
+        self.rules = rules
+        self.indexed = indexed
+        self.stats = {rule: RuleStats() for rule in rules}
+
+        table: dict[DispatchKey, list[type[ReductionRule]]] = {}
+        for rule in rules:
+            for key in rule.triggers:
+                table.setdefault(key, []).append(rule)
+        self._table = {key: tuple(keyed) for key, keyed in table.items()}
+
+    def rules_for(
+        self, item: IntermediaryParseResult
+    ) -> tuple[type[ReductionRule], ...]:
+        if not self.indexed:
+            return self.rules
+        return self._table.get(dispatch_key(item), ())
+
+    def apply[S: AnyParseStack](self, stack: S) -> S | None:
+        for rule in self.rules_for(stack.item):
+            reduced = rule.apply(stack)
+            if reduced is None:
+                self.stats[rule].misses += 1
+            else:
+                self.stats[rule].hits += 1
+                return reduced
+        return None
+
+    def invocations(self) -> int:
+        return sum(stats.hits + stats.misses for stats in self.stats.values())
+
+    def reset_stats(self) -> None:
+        for stats in self.stats.values():
+            stats.hits = stats.misses = 0
+
+    def stats_report(self) -> str:
+        return "\n".join(
+            f"{rule.__name__:<24} {stats.hits:>8} hits {stats.misses:>8} misses"
+            for rule, stats in self.stats.items()
+        )
+
+
+reduction_dispatch = RuleDispatch(*REDUCTION_RULES)
+
+
+class ParseObserver(Protocol):
+    """
+    Gets told about every step parse takes
+
+    depth is how many items are on the stack after the step. A
+    ListParseStack is changed in place after the observer returns,
+    so observers must not keep the stack itself.
+    """
+
+    def on_shift(self, stack: AnyParseStack, depth: int) -> None: ...
+
+    def on_reduce(self, stack: AnyParseStack, depth: int) -> None: ...
+
+    def on_accept(self, result: Term) -> None: ...
 
 
 def display_intermediate_result(r: IntermediaryParseResult) -> str:
@@ -344,44 +565,92 @@ def display_intermediate_result(r: IntermediaryParseResult) -> str:
     return str(r)
 
 
-def display_parse_stack(stack: ParseStack, max: int | None = None) -> None:
+def format_parse_stack(stack: AnyParseStack, max: int | None = None) -> str:
     if max is None:
         max = 10**10
     full_display = " : ".join(display_intermediate_result(result) for result in stack)
-    if len(full_display) <= max:
-        print(full_display)
-    else:
-        print(f"{full_display[:max]} [...] ")
+    if len(full_display) > max:
+        full_display = f"{full_display[:max]} [...] "
     type_display = " : ".join(type(result).__name__ for result in stack)
-    print(f"   (Types) {type_display}\n")
+    return f"{full_display}\n   (Types) {type_display}\n"
 
 
-def parse(src: Iterable[Token]) -> Term:
-    parse_stack: ParseStack | None = None
-    print(parse_stack)
-    for token in src:
+def display_parse_stack(stack: AnyParseStack, max: int | None = None) -> None:
+    print(format_parse_stack(stack, max))
 
-        parse_stack = ParseStack(parse_stack, token)
-        display_parse_stack(parse_stack)
 
-        inner_stack = parse_stack
+type StackType = type[ParseStack] | type[ListParseStack]
 
-        while True:
-            inner_stack = reductions.apply(inner_stack)
-            if inner_stack is None:
-                break
-            else:
-                parse_stack = inner_stack
-                display_parse_stack(parse_stack)
 
-    print(len(parse_stack) if parse_stack is not None else 0)
+def parse(
+    src: Iterable[Token],
+    rules: RuleDispatch | type[ReductionRule] = reduction_dispatch,
+    observers: Sequence[ParseObserver] = (),
+    stack_type: StackType = ListParseStack,
+) -> Term:
+    """
+    Shift-reduce parses the tokens
+
+    Without observers this is a bare loop; stacks are
+    only ever looked at when someone is watching.
+    """
+
+    if observers:
+        return _traced_parse(src, rules, observers, stack_type)
+    return parse_tree(src, rules, stack_type).to_term()
+
+
+def parse_tree(
+    src: Iterable[Token],
+    rules: RuleDispatch | type[ReductionRule] = reduction_dispatch,
+    stack_type: StackType = ListParseStack,
+) -> Program:
+    """
+    parse without the conversion to a Term at the end
+    """
+
+    parse_stack: AnyParseStack | None = None
+    for token in src:
+        parse_stack = (
+            stack_type.of(token) if parse_stack is None else parse_stack.push(token)
+        )
+        while (reduced := rules.apply(parse_stack)) is not None:
+            parse_stack = reduced
+
+    return accepted_program(parse_stack)
+
+
+def _traced_parse(
+    src: Iterable[Token],
+    rules: RuleDispatch | type[ReductionRule],
+    observers: Sequence[ParseObserver],
+    stack_type: StackType,
+) -> Term:
+    parse_stack: AnyParseStack | None = None
+    for token in src:
+
+        parse_stack = (
+            stack_type.of(token) if parse_stack is None else parse_stack.push(token)
+        )
+        for observer in observers:
+            observer.on_shift(parse_stack, len(parse_stack))
+
+        while (reduced := rules.apply(parse_stack)) is not None:
+            parse_stack = reduced
+            for observer in observers:
+                observer.on_reduce(parse_stack, len(parse_stack))
 
     r = post_parse(parse_stack)
-    print(r)
+    for observer in observers:
+        observer.on_accept(r)
     return r
 
 
-def post_parse(stack: ParseStack | None) -> Term:
-    if stack is not None and stack.previous is None and isinstance(stack.item, Program):
-        return stack.item.to_term()
+def post_parse(stack: AnyParseStack | None) -> Term:
+    return accepted_program(stack).to_term()
+
+
+def accepted_program(stack: AnyParseStack | None) -> Program:
+    if stack is not None and len(stack) == 1 and isinstance(stack.item, Program):
+        return stack.item
     raise ValueError(f"Failed parse")
@@ -1,32 +1,65 @@
+import typing
+from collections.abc import Iterable, Mapping
 from dataclasses import dataclass
 from typing import Self
-from .term_graph import Term, term_of
-from .parse_tree import (
-    ConcreteApplicationNode,
-    ConcreteExprNode,
-    ListLiteralNode,
-    ProgramNode,
-    PyLiteralNode,
+
+from .language import (
+    BUILTINS,
+    DEFINE,
+    FUNCTION,
+    line_content,
+    list_items,
+    reference_name,
+)
+from .term_graph import (
+    BuiltinReferenceTerm,
+    FunctionCallTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    SlotReferenceTerm,
+    Term,
 )
 
 
 @dataclass
 class SymbolTable:
     """
-    Keeps track of variable bindings
+    Keeps track of variable bindings: the slot of each name bound
+    in a scope, and the scope it is in
     """
 
-    bindings: dict[str, Term]
+    bindings: dict[str, int]
     outer: Self | None = None
 
-    def bind(self, target: str, value: Term) -> None:
-        self.bindings[target] = value
-
-    def deref(self, name: str) -> Term:
-        try:
-            return self.bindings[name]
-        except KeyError:
+    def bind(self, target: str) -> int:
+        """
+        The slot for target, which is given the next one if it has none
+        """
+        slot = self.bindings.get(target)
+        if slot is None:
+            slot = self.bindings[target] = len(self.bindings)
+        return slot
+
+    def lookup(self, name: str) -> tuple[int, int] | None:
+        """
+        How many scopes out name is bound and its slot there,
+        or None if no scope binds it
+        """
+        table: SymbolTable | None = self
+        depth = 0
+        while table is not None:
+            slot = table.bindings.get(name)
+            if slot is not None:
+                return depth, slot
+            table = table.outer
+            depth += 1
+        return None
+
+    def deref(self, name: str) -> tuple[int, int]:
+        found = self.lookup(name)
+        if found is None:
             raise ValueError(f"Name {name} not defined")
+        return found
 
     def enter_scope(self) -> Self:
         return type(self)(dict(), self)
@@ -38,40 +71,139 @@ class SymbolTable:
 
     @classmethod
     def new(cls) -> Self:
-        return cls(OPO4_BUILTINS, None)
+        return cls(dict(), None)
 
 
-OPO4_BUILTINS = {"list": term_of("list", tuple(), False)}
+OPO4_BUILTINS: typing.Final = {
+    name: builtin for builtin, name in enumerate(("def", "fn", *sorted(BUILTINS)))
+}
+"""
+The id of each builtin, for names no scope binds
+"""
 
 
-def name_resolved_from_concrete(tree: ProgramNode) -> Term:
-    table = SymbolTable.new()
-    return term_of(
-        table.deref("prgm"),
-        tuple(_name_resolve_recursive(c, table) for c in tree.content),
-    )
+class UnresolvedNamesError(ValueError):
+    def __init__(self, names: Iterable[str]) -> None:
+        self.names = tuple(names)
+        super().__init__(f"Names not defined: {', '.join(self.names)}")
 
 
-ARROW = ConcreteApplicationNode("->", tuple())
-
-
-def _name_resolve_recursive(tree: ConcreteExprNode, table: SymbolTable) -> Term:
-    match tree:
+def resolve_names(
+    program: ProgramTerm, builtins: Mapping[str, int] = OPO4_BUILTINS
+) -> ProgramTerm:
+    """
+    The program with every name resolved, through the scopes it is
+    in, to a SlotReferenceTerm, or to a BuiltinReferenceTerm if no
+    scope binds it
+
+    The program is a scope, and so is each fn call, whose first
+    argument, if a list, is its parameters. A def binds its name in
+    the innermost scope around it, for all of that scope, so
+    definitions can be used before them and by themselves. Slots are
+    numbered in order of binding, parameters first.
+
+    Resolved names are terms too, so they are interned and shared
+    like any other. The same name used at the same distance from its
+    binding resolves to the same term wherever it is.
+
+    Raises UnresolvedNamesError, naming every name that could not
+    be resolved, once the whole program has been walked.
+    """
 
-        case ConcreteApplicationNode(id, args):
-            return term_of(
-                _name_resolve_recursive(id, table),
-                tuple(_name_resolve_recursive(arg, table) for arg in args),
+    unresolved: dict[str, None] = {}
+    # Each scope's resolutions, keyed by id(term) as terms are interned.
+    # The tables are kept here so that their ids stay theirs.
+    tables: list[SymbolTable] = []
+    memos: dict[int, dict[int, Term]] = {}
+
+    def enter(
+        outer: SymbolTable | None, params: Iterable[Term], body: Iterable[Term]
+    ) -> SymbolTable:
+        table = SymbolTable({}, outer)
+        for param in params:
+            name = reference_name(line_content(param))
+            if name is not None:
+                table.bind(name)
+        _bind_definitions(table, body)
+        tables.append(table)
+        memos[id(table)] = {}
+        return table
+
+    root = enter(None, (), program.top_level_exprs)
+    # A term, the scope it is in, and the scope of its arguments
+    # once they are waiting to be put together, or None before
+    stack: list[tuple[Term, SymbolTable, SymbolTable | None]] = [
+        (program, root, None)
+    ]
+    while stack:
+        term, table, inner = stack.pop()
+        memo = memos[id(table)]
+        if id(term) in memo:
+            continue
+
+        kind = type(term)
+        if kind is ReferenceTerm:
+            name = typing.cast(ReferenceTerm, term).name
+            found = table.lookup(name)
+            if found is not None:
+                memo[id(term)] = SlotReferenceTerm(name, *found)
+            elif name in builtins:
+                memo[id(term)] = BuiltinReferenceTerm(name, builtins[name])
+            else:
+                unresolved[name] = None
+                memo[id(term)] = term
+            continue
+
+        subterms = term.subterms()
+        if not subterms:
+            memo[id(term)] = term
+            continue
+
+        if inner is None:
+            inner = table
+            if kind is FunctionCallTerm and subterms[0] is FUNCTION:
+                args = subterms[1:]
+                params = list_items(line_content(args[0])) if args else None
+                inner = enter(table, params or (), args)
+
+            stack.append((term, table, inner))
+            stack.extend((arg, inner, None) for arg in reversed(subterms[1:]))
+            stack.append((subterms[0], table, None))
+            continue
+
+        # Only a call's arguments can be in a scope of its own
+        inner_memo = memos[id(inner)]
+        memo[id(term)] = term.with_subterms(
+            (
+                memo[id(subterms[0])],
+                *(inner_memo[id(arg)] for arg in subterms[1:]),
             )
+        )
 
-        case PyLiteralNode(_, v):
-            return term_of(v)
+    if unresolved:
+        raise UnresolvedNamesError(unresolved)
+    return typing.cast(ProgramTerm, memos[id(root)][id(program)])
 
-        case str(n):
-            return table.deref(n)
 
-        case ListLiteralNode(content):
-            return term_of(
-                table.deref("list"),
-                tuple(_name_resolve_recursive(item, table) for item in content),
-            )
+def _bind_definitions(table: SymbolTable, body: Iterable[Term]) -> None:
+    """
+    Binds each name a def in body binds, in the order they come,
+    leaving out those in the scopes of fn calls
+    """
+
+    seen: set[int] = set()
+    stack = list(reversed(list(body)))
+    while stack:
+        term = stack.pop()
+        if id(term) in seen or type(term) is not FunctionCallTerm:
+            continue
+        seen.add(id(term))
+
+        call = typing.cast(FunctionCallTerm, term)
+        if call.head is FUNCTION:
+            continue
+        name = reference_name(call.args[0]) if call.args else None
+        if call.head is DEFINE and name is not None:
+            table.bind(name)
+        stack.extend(reversed(call.args))
+        stack.append(call.head)
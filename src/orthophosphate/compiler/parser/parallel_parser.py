@@ -0,0 +1,347 @@
+import os
+import typing
+from array import array
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from ..tokenizer.token import Token
+from ..tokenizer.token_buffer import (
+    EOF_KIND,
+    EOF_TOKEN,
+    FILE_START_KIND,
+    FILE_START_TOKEN,
+    FIXED_KIND_BASE,
+    FIXED_TOKENS,
+    VALUE_TYPES,
+    TokenBuffer,
+)
+from .incremental_parser import run_ends
+from .multistage_parser import parse_tree
+from .parse_tree2 import (
+    AnyMultilineExpr,
+    InlineExpr,
+    InlineListLiteral,
+    IntLiteral,
+    ListLiteral,
+    MultilineExpr,
+    Name,
+    ParseTreeNode,
+    Program,
+    StrLiteral,
+)
+from .term_graph import ProgramTerm, Term
+from .term_serialization import dump_term, load_term
+
+MIN_PIECE_SIZE: typing.Final = 1 << 14
+"""
+Token streams are not cut into pieces of fewer than this many tokens,
+since below that sending a piece costs more than parsing it
+"""
+
+PIECES_PER_WORKER: typing.Final = 4
+"""
+More pieces than workers, so that a slow piece does not hold up the rest
+"""
+
+type Packed = tuple[bytes, tuple[int | str, ...]]
+"""
+Nodes in postfix order: a stream of codes, each followed by
+its child counts, then the values of the leaves in order
+
+Parents come after their children, so unpacking is a loop over a
+value stack however deep the nesting goes.
+"""
+
+# Codes in a packed stream of nodes
+_NAME: typing.Final = 0
+_INT: typing.Final = 1
+_STR: typing.Final = 2
+_INLINE_EXPR: typing.Final = 3
+_INLINE_LIST: typing.Final = 4
+_LIST: typing.Final = 5
+_MULTILINE: typing.Final = 6
+
+_KIND_OF_FIXED: typing.Final = {
+    (token.type, token.value): FIXED_KIND_BASE + i
+    for i, token in enumerate(FIXED_TOKENS)
+}
+
+
+@dataclass(frozen=True)
+class _TokenPiece:
+    """
+    The tokens of a piece, as sent to a worker: the kind, start and end
+    of each (as in TokenBuffer), and either the part of the source they
+    are in, starting at offset, or, for tokens that did not come in a
+    TokenBuffer, the values of those whose kind is not a fixed token
+    """
+
+    kinds: bytes
+    starts: bytes
+    ends: bytes
+    source: str
+    offset: int
+    values: tuple[str, ...] | None
+
+
+def parse_parallel(
+    tokens: Sequence[Token],
+    max_workers: int | None = None,
+    piece_size: int | None = None,
+) -> Term:
+    """
+    multistage_parser.parse, with the tokens cut at top-level run
+    boundaries (see incremental_parser) and the pieces parsed and
+    turned into terms in a process pool
+
+    Each worker is sent the kinds and spans of its tokens, and the part
+    of the source they are in if they came in a TokenBuffer, and sends
+    back its terms as term_serialization bytes. Interning the terms
+    again here is the part that is not parallel; with one worker, the
+    tokens are parsed here instead.
+    """
+
+    pieces = _parse_pieces(tokens, max_workers, piece_size, as_terms=True)
+    if isinstance(pieces, Program):
+        return pieces.to_term()
+    return ProgramTerm(
+        tuple(
+            expr
+            for piece in pieces
+            for expr in typing.cast(
+                ProgramTerm, load_term(typing.cast(bytes, piece))
+            ).top_level_exprs
+        )
+    )
+
+
+def parse_tree_parallel(
+    tokens: Sequence[Token],
+    max_workers: int | None = None,
+    piece_size: int | None = None,
+) -> Program:
+    """
+    parse_parallel without the conversion to a Term at the end
+    """
+
+    pieces = _parse_pieces(tokens, max_workers, piece_size, as_terms=False)
+    if isinstance(pieces, Program):
+        return pieces
+    return Program(
+        tuple(
+            node
+            for piece in pieces
+            for node in _unpack_nodes(typing.cast(Packed, piece))
+        )
+    )
+
+
+def plan_pieces(
+    tokens: Sequence[Token], max_workers: int, piece_size: int | None = None
+) -> list[int]:
+    """
+    Where the pieces of the tokens start: just after file_start, then
+    the first top-level run boundary after each multiple of piece_size
+
+    The last piece ends before EOF.
+    """
+
+    if piece_size is None:
+        piece_size = max(
+            MIN_PIECE_SIZE, len(tokens) // (max_workers * PIECES_PER_WORKER)
+        )
+
+    starts = [1]
+    target = 1 + piece_size
+    for end in run_ends(tokens, 1):
+        if end >= target and end < len(tokens) - 1:
+            starts.append(end)
+            target = end + piece_size
+    return starts
+
+
+def _parse_pieces(
+    tokens: Sequence[Token],
+    max_workers: int | None,
+    piece_size: int | None,
+    as_terms: bool,
+) -> Program | list[Packed | bytes]:
+    """
+    The packed results of parsing each piece, in order, or the
+    Program for the whole input if it is not worth splitting
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    starts = [1] if max_workers == 1 else plan_pieces(tokens, max_workers, piece_size)
+    if len(starts) == 1:
+        return parse_tree(tokens)
+
+    stops = starts[1:] + [len(tokens) - 1]
+    with ProcessPoolExecutor(min(max_workers, len(starts))) as pool:
+        futures = [
+            pool.submit(_parse_piece, _pack_tokens(tokens, start, stop), as_terms)
+            for start, stop in zip(starts, stops)
+        ]
+        # In order, so the error raised is the first one
+        return [future.result() for future in futures]
+
+
+def _parse_piece(piece: _TokenPiece, as_terms: bool) -> Packed | bytes:
+    program = parse_tree(_unpack_tokens(piece))
+    if as_terms:
+        return dump_term(program.to_term())
+    return _pack_nodes(program.content)
+
+
+def _pack_tokens(tokens: Sequence[Token], start: int, stop: int) -> _TokenPiece:
+    if isinstance(tokens, TokenBuffer):
+        if start == stop:
+            return _TokenPiece(b"", b"", b"", "", 0, None)
+        offset = tokens.starts[start]
+        source = tokens.source[
+            offset - tokens.offset : tokens.ends[stop - 1] - tokens.offset
+        ]
+        return _TokenPiece(
+            tokens.kinds[start:stop].tobytes(),
+            tokens.starts[start:stop].tobytes(),
+            tokens.ends[start:stop].tobytes(),
+            source,
+            offset,
+            None,
+        )
+
+    kinds = array("B")
+    starts = array("I")
+    ends = array("I")
+    values: list[str] = []
+    for i in range(start, stop):
+        token = tokens[i]
+        if token.type in VALUE_TYPES:
+            kinds.append(VALUE_TYPES.index(token.type))
+            values.append(token.value)
+        else:
+            kinds.append(_KIND_OF_FIXED[token.type, token.value])
+        starts.append(token.start)
+        ends.append(token.end)
+    return _TokenPiece(
+        kinds.tobytes(), starts.tobytes(), ends.tobytes(), "", 0, tuple(values)
+    )
+
+
+def _unpack_tokens(piece: _TokenPiece) -> Sequence[Token]:
+    """
+    The tokens of the piece, between a file_start and an EOF
+    """
+
+    if piece.values is None:
+        buffer = TokenBuffer(piece.source, piece.offset)
+        end = piece.offset + len(piece.source)
+        buffer.append(FILE_START_KIND, piece.offset, piece.offset)
+        buffer.kinds.frombytes(piece.kinds)
+        buffer.starts.frombytes(piece.starts)
+        buffer.ends.frombytes(piece.ends)
+        buffer.append(EOF_KIND, end, end)
+        return buffer
+
+    return (FILE_START_TOKEN, *_unpacked_token_objects(piece), EOF_TOKEN)
+
+
+def _unpacked_token_objects(piece: _TokenPiece) -> Iterator[Token]:
+    starts = array("I", piece.starts)
+    ends = array("I", piece.ends)
+    next_value = iter(piece.values or ()).__next__
+    for kind, start, end in zip(piece.kinds, starts, ends):
+        if kind >= FIXED_KIND_BASE:
+            fixed = FIXED_TOKENS[kind - FIXED_KIND_BASE]
+            yield Token(fixed.type, fixed.value, start, end)
+        else:
+            yield Token(VALUE_TYPES[kind], next_value(), start, end)
+
+
+def _pack_nodes(nodes: Sequence[AnyMultilineExpr]) -> Packed:
+    codes = array("I")
+    leaves: list[int | str] = []
+
+    stack: list[tuple[ParseTreeNode, bool]] = [
+        (node, False) for node in reversed(nodes)
+    ]
+    while stack:
+        node, children_done = stack.pop()
+        match node:
+            case Name(value):
+                codes.append(_NAME)
+                leaves.append(value)
+            case IntLiteral(value):
+                codes.append(_INT)
+                leaves.append(value)
+            case StrLiteral(value):
+                codes.append(_STR)
+                leaves.append(value)
+
+            case InlineExpr(head, contents) if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(contents))
+                stack.append((head, False))
+            case InlineExpr(_, contents):
+                codes.extend((_INLINE_EXPR, len(contents)))
+
+            case MultilineExpr(inline_args, args) if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(args))
+                stack.extend((child, False) for child in reversed(inline_args))
+            case MultilineExpr(inline_args, args):
+                codes.extend((_MULTILINE, len(inline_args), len(args)))
+
+            case InlineListLiteral(content) | ListLiteral(content) if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(content))
+            case InlineListLiteral(content):
+                codes.extend((_INLINE_LIST, len(content)))
+            case ListLiteral(content):
+                codes.extend((_LIST, len(content)))
+
+            case _:
+                raise ValueError(f"Cannot pack {node!r}")
+
+    return codes.tobytes(), tuple(leaves)
+
+
+def _unpack_nodes(packed: Packed) -> list[typing.Any]:
+    data, leaves = packed
+    codes = array("I")
+    codes.frombytes(data)
+    code_iter = iter(codes)
+    next_leaf = iter(leaves).__next__
+
+    values: list[typing.Any] = []
+    for code in code_iter:
+        if code == _NAME:
+            values.append(Name(next_leaf()))
+        elif code == _INT:
+            values.append(IntLiteral(next_leaf()))
+        elif code == _STR:
+            values.append(StrLiteral(next_leaf()))
+        elif code == _INLINE_EXPR:
+            contents = _pop(values, next(code_iter))
+            values.append(InlineExpr(values.pop(), contents))
+        elif code == _INLINE_LIST:
+            values.append(InlineListLiteral(_pop(values, next(code_iter))))
+        elif code == _LIST:
+            values.append(ListLiteral(_pop(values, next(code_iter))))
+        else:  # _MULTILINE
+            inline_count = next(code_iter)
+            args = _pop(values, next(code_iter))
+            values.append(MultilineExpr(_pop(values, inline_count), args))
+    return values
+
+
+def _pop(values: list[typing.Any], count: int) -> tuple[typing.Any, ...]:
+    """
+    Removes and returns the last count values
+    """
+    if count == 0:
+        return ()
+    popped = tuple(values[-count:])
+    del values[-count:]
+    return popped
@@ -0,0 +1,154 @@
+import sys
+import typing
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from ..tokenizer.token import Token, TokenType
+from .multistage_parser import AnyParseStack, format_parse_stack
+from .parse_tree2 import (
+    InlineExpr,
+    InlineListLiteral,
+    IntLiteral,
+    ListLiteral,
+    MultilineExpr,
+    Name,
+    Program,
+    StrLiteral,
+)
+from .term_graph import Term
+
+
+@dataclass
+class TextTracer:
+    """
+    Writes the whole stack after every step, as parse used to
+
+    That takes time proportional to the stack each step,
+    so it is only for small inputs.
+    """
+
+    file: typing.TextIO = field(default_factory=lambda: sys.stdout)
+    max: int | None = None
+
+    def on_shift(self, stack: AnyParseStack, depth: int) -> None:
+        print(format_parse_stack(stack, self.max), file=self.file)
+
+    def on_reduce(self, stack: AnyParseStack, depth: int) -> None:
+        print(format_parse_stack(stack, self.max), file=self.file)
+
+    def on_accept(self, result: Term) -> None:
+        print(result, file=self.file)
+
+
+SHIFT: typing.Final = 0
+REDUCE: typing.Final = 1
+ACCEPT: typing.Final = 2
+
+EVENT_NAMES: typing.Final = ("shift", "reduce", "accept")
+
+NODE_KINDS: typing.Final = (
+    Program,
+    MultilineExpr,
+    ListLiteral,
+    InlineExpr,
+    InlineListLiteral,
+    Name,
+    IntLiteral,
+    StrLiteral,
+)
+
+_TOKEN_KIND_BASE: typing.Final = len(NODE_KINDS)
+
+ITEM_KIND_NAMES: typing.Final = (
+    *(kind.__name__ for kind in NODE_KINDS),
+    *(f"Token {token_type.name}" for token_type in TokenType),
+)
+"""
+Name of each item kind code: node classes first, then token types
+"""
+
+_NODE_KIND_CODES: typing.Final = {kind: code for code, kind in enumerate(NODE_KINDS)}
+_TOKEN_KIND_CODES: typing.Final = {
+    token_type: _TOKEN_KIND_BASE + i for i, token_type in enumerate(TokenType)
+}
+
+
+@dataclass(frozen=True)
+class ParseEvent:
+    event: str
+    item_kind: str
+    depth: int
+    offset: int
+    """
+    Source offset of the token shifted; 0 for other events
+    """
+
+
+class EventRecorder:
+    """
+    Keeps a compact log of parse steps for looking at later:
+    one byte for the event, one for the kind of item on top of
+    the stack, and two unsigned ints for the depth and the offset
+    """
+
+    __slots__ = ("events", "item_kinds", "depths", "offsets")
+
+    def __init__(self) -> None:
+        self.events = array("B")
+        self.item_kinds = array("B")
+        self.depths = array("I")
+        self.offsets = array("I")
+
+    def _record(self, event: int, item_kind: int, depth: int, offset: int) -> None:
+        self.events.append(event)
+        self.item_kinds.append(item_kind)
+        self.depths.append(depth)
+        self.offsets.append(offset)
+
+    def on_shift(self, stack: AnyParseStack, depth: int) -> None:
+        token = typing.cast(Token, stack.item)
+        self._record(SHIFT, _TOKEN_KIND_CODES[token.type], depth, token.start)
+
+    def on_reduce(self, stack: AnyParseStack, depth: int) -> None:
+        self._record(REDUCE, _NODE_KIND_CODES[type(stack.item)], depth, 0)
+
+    def on_accept(self, result: Term) -> None:
+        self._record(ACCEPT, _NODE_KIND_CODES[Program], 0, 0)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __iter__(self) -> Iterator[ParseEvent]:
+        for event, item_kind, depth, offset in zip(
+            self.events, self.item_kinds, self.depths, self.offsets
+        ):
+            yield ParseEvent(
+                EVENT_NAMES[event], ITEM_KIND_NAMES[item_kind], depth, offset
+            )
+
+    def to_bytes(self) -> bytes:
+        """
+        The log as the event count followed by the four arrays
+        """
+        count = array("I", (len(self),))
+        return b"".join(
+            a.tobytes()
+            for a in (count, self.events, self.item_kinds, self.depths, self.offsets)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> typing.Self:
+        recorder = cls()
+        (count,) = array("I", data[: recorder.depths.itemsize])
+        pos = recorder.depths.itemsize
+        for a in (
+            recorder.events,
+            recorder.item_kinds,
+            recorder.depths,
+            recorder.offsets,
+        ):
+            size = count * a.itemsize
+            a.frombytes(data[pos : pos + size])
+            pos += size
+        return recorder
@@ -1,7 +1,8 @@
+import io
+import typing
 from abc import abstractmethod
-from collections.abc import Iterator, Sequence
+from collections.abc import Callable, Iterator, Sequence
 from dataclasses import dataclass
-from functools import cache
 from typing import Protocol, Self, cast, override
 
 from .term_graph import (
@@ -12,6 +13,8 @@ from .term_graph import (
     StrTerm,
     Term,
 )
+from .term_arena import TermArena
+from .tree_printer import write_tree
 
 type AnyExprNode = AnyMultilineExpr | AnyInlineExpr | InlineListLiteral
 """
@@ -35,18 +38,98 @@ class ParseTreeNode(Protocol):
     def get_render_contents(self) -> "tuple[str, Sequence[ParseTreeNode | str]]":
         raise NotImplementedError
 
+    def lowering_children(self) -> "Sequence[ParseTreeNode]":
+        """
+        The nodes whose terms lower_with needs, in order
+        """
+        return ()
+
     @abstractmethod
-    def to_term(self) -> Term:
+    def lower_with(self, child_terms: tuple[Term, ...]) -> Term:
+        """
+        The term for this node, given the terms of its lowering_children
+        """
         raise NotImplementedError
 
-    def inline_display(self) -> str:
+    @abstractmethod
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]) -> int:
+        """
+        lower_with, adding the term to the arena and giving its id
+        """
+        raise NotImplementedError
+
+    def to_term(self) -> Term:
+        """
+        Lowers the tree to a term
+        """
+        return self._lower(lambda node, child_terms: node.lower_with(child_terms))
+
+    def to_arena(self, arena: TermArena) -> int:
+        """
+        Lowers the tree straight into the arena, giving the term's id
+        """
+        return self._lower(
+            lambda node, child_ids: node.lower_into(arena, child_ids)
+        )
+
+    def _lower[T](self, lower: "Callable[[ParseTreeNode, tuple[T, ...]], T]") -> T:
+        """
+        Lowers children first, off an explicit stack, so
+        nesting depth is not limited by the recursion limit
+        """
+
+        results: list[T] = []
+        # A node and its child count, or -1 before its children are done
+        stack: list[tuple[ParseTreeNode, int]] = [(self, -1)]
+        while stack:
+            node, count = stack.pop()
+            if count < 0:
+                children = node.lowering_children()
+                if children:
+                    stack.append((node, len(children)))
+                    stack.extend((child, -1) for child in reversed(children))
+                    continue
+                count = 0
+
+            if count:
+                child_results = tuple(results[-count:])
+                del results[-count:]
+            else:
+                child_results = ()
+            results.append(lower(node, child_results))
+
+        return results[0]
+
+    def write_tree(
+        self,
+        file: typing.TextIO,
+        max_depth: int | None = None,
+        max_nodes: int | None = None,
+    ) -> int:
+        """
+        Writes the tree to file as it goes, leaving out what is
+        past the limits; see tree_printer.write_tree
+        """
+        return write_tree(self, file, _render_contents, "", max_depth, max_nodes)
+
+    def inline_parts(self) -> "Sequence[ParseTreeNode | str]":
+        """
+        What inline_display writes, in order: strings as they are
+        and nodes as their own inline_display
+        """
         head, args = self.get_render_contents()
-        if len(args) > 0:
-            args_display = " ".join(
-                arg if isinstance(arg, str) else arg.inline_display() for arg in args
-            )
-            return f"{head}({args_display})"
-        return head
+        return _call_parts(head, args)
+
+    def inline_display(self) -> str:
+        out: list[str] = []
+        stack: list[ParseTreeNode | str] = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+            else:
+                stack.extend(reversed(item.inline_parts()))
+        return "".join(out)
 
 
 @dataclass(frozen=True)
@@ -58,8 +141,16 @@ class Program(ParseTreeNode):
         return ("program", self.content)
 
     @override
-    def to_term(self):
-        return ProgramTerm(tuple(item.to_term() for item in self.content))
+    def lowering_children(self):
+        return self.content
+
+    @override
+    def lower_with(self, child_terms: tuple[Term, ...]):
+        return ProgramTerm(child_terms)
+
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.program(child_ids)
 
 
 @dataclass(frozen=True)
@@ -77,10 +168,21 @@ class MultilineExpr(AnyMultilineExpr):
         return (_inline_display(combined[0]), combined[1:])
 
     @override
-    def to_term(self):
-        combined = (*self.inline_args, *self.args)
-        combined_terms = tuple(item.to_term() for item in combined)
-        return FunctionCallTerm.of_tuple(combined_terms)
+    def inline_parts(self):
+        combined = (*self.inline_args, r"/n", *self.args)
+        return _call_parts(combined[0], combined[1:])
+
+    @override
+    def lowering_children(self):
+        return (*self.inline_args, *self.args)
+
+    @override
+    def lower_with(self, child_terms: tuple[Term, ...]):
+        return FunctionCallTerm.of_tuple(child_terms)
+
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.call(child_ids[0], child_ids[1:])
 
 
 @dataclass(frozen=True)
@@ -92,14 +194,20 @@ class ListLiteral(AnyMultilineExpr):
         return ("list", self.content)
 
     @override
-    def inline_display(self) -> str:
-        return f"[{" ".join(arg.inline_display() for arg in self.content)}]"
+    def inline_parts(self):
+        return _bracketed_parts("[", self.content, "]")
 
     @override
-    def to_term(self):
-        return FunctionCallTerm(
-            ReferenceTerm("opo4:list"), tuple(item.to_term() for item in self.content)
-        )
+    def lowering_children(self):
+        return self.content
+
+    @override
+    def lower_with(self, child_terms: tuple[Term, ...]):
+        return FunctionCallTerm(ReferenceTerm("opo4:list"), child_terms)
+
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.call(arena.reference("opo4:list"), child_ids)
 
 
 @dataclass(frozen=True)
@@ -116,10 +224,20 @@ class InlineExpr(AnyInlineExpr):
         return (self.head.inline_display(), self.contents)
 
     @override
-    def to_term(self):
-        return FunctionCallTerm(
-            self.head.to_term(), tuple(item.to_term() for item in self.contents)
-        )
+    def inline_parts(self):
+        return _call_parts(self.head, self.contents)
+
+    @override
+    def lowering_children(self):
+        return (self.head, *self.contents)
+
+    @override
+    def lower_with(self, child_terms: tuple[Term, ...]):
+        return FunctionCallTerm(child_terms[0], child_terms[1:])
+
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.call(child_ids[0], child_ids[1:])
 
 
 @dataclass(frozen=True)
@@ -136,27 +254,39 @@ class Name(SimpleLiteralOrVarNode):
     value: str
 
     @override
-    def to_term(self):
+    def lower_with(self, child_terms: tuple[Term, ...]):
         return ReferenceTerm(self.value)
 
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.reference(self.value)
+
 
 @dataclass(frozen=True)
 class IntLiteral(SimpleLiteralOrVarNode):
     value: int
 
     @override
-    def to_term(self):
+    def lower_with(self, child_terms: tuple[Term, ...]):
         return IntTerm(self.value)
 
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.integer(self.value)
+
 
 @dataclass(frozen=True)
 class StrLiteral(SimpleLiteralOrVarNode):
     value: str
 
     @override
-    def to_term(self):
+    def lower_with(self, child_terms: tuple[Term, ...]):
         return StrTerm(self.value)
 
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.string(self.value)
+
 
 @dataclass(frozen=True)
 class InlineListLiteral(AnyInlineExpr):
@@ -167,14 +297,20 @@ class InlineListLiteral(AnyInlineExpr):
         return ("list", self.content)
 
     @override
-    def inline_display(self) -> str:
-        return f"[{" ".join(arg.inline_display() for arg in self.content)}]"
+    def inline_parts(self):
+        return _bracketed_parts("[", self.content, "]")
 
     @override
-    def to_term(self):
-        return FunctionCallTerm(
-            ReferenceTerm("opo4:list"), tuple(item.to_term() for item in self.content)
-        )
+    def lowering_children(self):
+        return self.content
+
+    @override
+    def lower_with(self, child_terms: tuple[Term, ...]):
+        return FunctionCallTerm(ReferenceTerm("opo4:list"), child_terms)
+
+    @override
+    def lower_into(self, arena: TermArena, child_ids: tuple[int, ...]):
+        return arena.call(arena.reference("opo4:list"), child_ids)
 
 
 @dataclass(frozen=True)
@@ -192,11 +328,10 @@ class AnyNodeSeq(ParseTreeNode):
         return ("<>", tuple(self))
 
     @override
-    def inline_display(self) -> str:
-        return f"<{" ".join(arg.inline_display() for arg in iter(self))}>"
+    def inline_parts(self):
+        return _bracketed_parts("<", tuple(self), ">")
 
 
-@cache
 def _render_contents(
     node: ParseTreeNode | str,
 ) -> tuple[str, Sequence[ParseTreeNode | str]]:
@@ -210,34 +345,16 @@ def _render_contents(
     return node.get_render_contents()
 
 
-@cache
 def _display_node(node: ParseTreeNode | str, pre: str = "") -> str:
     """
     Provides a nice readable string
     rep of the Node with nesting
-
-    This function is recursive and
-    dangerous to the sanity of anyone
-    who works on it
     """
-    header, children = _render_contents(node)
-
-    render_contents: tuple[str, ...] = tuple(
-        _display_node(child, pre + ("║ " if i < len(children) - 1 else "  "))
-        for i, child in enumerate(children)
-    )
-
-    return f"{'' if pre == '' else'═'} {header}\n" + "".join(
-        (
-            f"{pre}╠{element}"  # Normal case
-            if i < len(render_contents) - 1
-            else f"{pre}╚{element}"  # Last element
-        )
-        for i, element in enumerate(render_contents)
-    )
+    out = io.StringIO()
+    write_tree(node, out, _render_contents, pre)
+    return out.getvalue()
 
 
-@cache
 def _inline_display(node: ParseTreeNode | str) -> str:
     """
     Produces an inline representation (e.g. "head(arg1 arg2 arg3)")
@@ -248,3 +365,26 @@ def _inline_display(node: ParseTreeNode | str) -> str:
     if isinstance(node, str):
         return node
     return node.inline_display()
+
+
+def _call_parts(
+    head: ParseTreeNode | str, args: Sequence[ParseTreeNode | str]
+) -> tuple[ParseTreeNode | str, ...]:
+    """
+    The inline_parts of "head(arg1 arg2 arg3)", or of just head without args
+    """
+    if not args:
+        return (head,)
+    return (head, *_bracketed_parts("(", args, ")"))
+
+
+def _bracketed_parts(
+    opener: str, items: Sequence[ParseTreeNode | str], closer: str
+) -> tuple[ParseTreeNode | str, ...]:
+    parts: list[ParseTreeNode | str] = [opener]
+    for i, item in enumerate(items):
+        if i:
+            parts.append(" ")
+        parts.append(item)
+    parts.append(closer)
+    return tuple(parts)
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+import typing
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from functools import cache
+
+from ..tokenizer.token import IndentType, Token, TokenType
+from ..utils.json_cache import load_or_build
+from .parse_tree2 import (
+    InlineExpr,
+    InlineListLiteral,
+    IntLiteral,
+    ListLiteral,
+    MultilineExpr,
+    Name,
+    Program,
+    StrLiteral,
+)
+from .term_graph import Term
+
+GENERATOR_VERSION: typing.Final = 1
+
+
+@dataclass(frozen=True)
+class Production:
+    lhs: str
+    rhs: tuple[str, ...]
+    action: str
+    """
+    Key in ACTIONS of what builds the value of lhs from those of rhs
+    """
+
+
+GRAMMAR: tuple[Production, ...] = (
+    Production("program", ("file_start", "blocks", "EOF"), "program"),
+    Production("blocks", (), "empty"),
+    Production("blocks", ("blocks", "block"), "append"),
+    Production("block", ("line",), "first"),
+    Production("block", ("line", "INDENT", "blocks", "DEDENT"), "indented_block"),
+    Production("block", ("[", "list_items", "]"), "list_literal"),
+    Production("list_items", ("block",), "one"),
+    Production("list_items", ("list_items", "block"), "append"),
+    Production("line", ("inlines", "NEWLINE"), "line"),
+    Production("inlines", ("call",), "one"),
+    Production("inlines", ("inlines", "call"), "append"),
+    Production("args", (), "empty"),
+    Production("args", ("inlines",), "first"),
+    Production("call", ("primary",), "first"),
+    Production("call", ("call", "(", "args", ")"), "call"),
+    Production("primary", ("NAME",), "name"),
+    Production("primary", ("INT",), "int"),
+    Production("primary", ("STR",), "str"),
+    Production("primary", ("[", "args", "]"), "inline_list"),
+)
+"""
+The syntax the Reduce* rules in multistage_parser accept, written out
+
+Lower-case symbols are nonterminals; the rest are terminals (see
+terminal_of). A multiline list literal holds whole lines, where an
+inline one holds inline expressions; which one a "[" starts is only
+known at the first NEWLINE or "]", which LALR(1) copes with because
+both go through inlines.
+"""
+
+ACTIONS: dict[str, Callable[[list[typing.Any]], typing.Any]] = {
+    "program": lambda v: Program(tuple(v[1])),
+    "empty": lambda v: [],
+    "one": lambda v: [v[0]],
+    "append": lambda v: (v[0].append(v[1]), v[0])[1],
+    "first": lambda v: v[0],
+    "indented_block": lambda v: (
+        MultilineExpr(v[0].inline_args, tuple(v[2])) if v[2] else v[0]
+    ),
+    "list_literal": lambda v: ListLiteral(tuple(v[1])),
+    "line": lambda v: MultilineExpr(tuple(v[0]), ()),
+    "call": lambda v: InlineExpr(v[0], tuple(v[2])),
+    "name": lambda v: Name(v[0].value),
+    "int": lambda v: IntLiteral(int(v[0].value)),
+    "str": lambda v: StrLiteral(v[0].value),
+    "inline_list": lambda v: InlineListLiteral(tuple(v[1])),
+}
+
+START: typing.Final = "program"
+END: typing.Final = "$end"
+"""
+The terminal after the last token
+"""
+
+
+def terminal_of(token: Token) -> str:
+    match token.type:
+        case TokenType.PUNC:
+            return token.value
+        case TokenType.INDENT_DEDENT:
+            return "INDENT" if token.value == IndentType.INDENT else "DEDENT"
+        case _:
+            return token.type.name
+
+
+ACCEPT: typing.Final = -1
+
+
+@dataclass(frozen=True)
+class ParserTables:
+    """
+    LALR(1) tables
+
+    actions[state][terminal] is a state to shift to if it is 0 or more,
+    ACCEPT, or -2 - p to reduce by production p. gotos[state][nonterminal]
+    is the state to go to after a reduction to that nonterminal.
+    """
+
+    actions: tuple[dict[str, int], ...]
+    gotos: tuple[dict[str, int], ...]
+
+
+class GrammarConflict(ValueError):
+    pass
+
+
+type _Item = tuple[int, int, str]
+"""
+(production, position of the dot, lookahead), where production 0
+is START' -> START and production p + 1 is grammar[p]
+"""
+
+
+def build_tables(grammar: tuple[Production, ...] = GRAMMAR) -> ParserTables:
+    """
+    Builds the canonical LR(1) states, then merges
+    the ones with the same core into LALR(1) states
+    """
+
+    productions = [Production(START + "'", (START,), "first"), *grammar]
+    nonterminals = {p.lhs for p in productions}
+    by_lhs: dict[str, list[int]] = {}
+    for i, p in enumerate(productions):
+        by_lhs.setdefault(p.lhs, []).append(i)
+
+    nullable: set[str] = set()
+    first: dict[str, set[str]] = {n: set() for n in nonterminals}
+    changed = True
+    while changed:
+        changed = False
+        for p in productions:
+            if p.lhs not in nullable and all(s in nullable for s in p.rhs):
+                nullable.add(p.lhs)
+                changed = True
+            for symbol in p.rhs:
+                new = first[symbol] if symbol in nonterminals else {symbol}
+                if not new <= first[p.lhs]:
+                    first[p.lhs] |= new
+                    changed = True
+                if symbol not in nullable:
+                    break
+
+    def first_of(symbols: Iterable[str], lookahead: str) -> set[str]:
+        result: set[str] = set()
+        for symbol in symbols:
+            if symbol not in nonterminals:
+                result.add(symbol)
+                return result
+            result |= first[symbol]
+            if symbol not in nullable:
+                return result
+        result.add(lookahead)
+        return result
+
+    def closure(items: Iterable[tuple[int, int, str]]) -> frozenset[_Item]:
+        stack = list(items)
+        seen = set(stack)
+        while stack:
+            production, dot, lookahead = stack.pop()
+            rhs = productions[production].rhs
+            if dot < len(rhs) and rhs[dot] in nonterminals:
+                for next_lookahead in first_of(rhs[dot + 1 :], lookahead):
+                    for inner in by_lhs[rhs[dot]]:
+                        item = (inner, 0, next_lookahead)
+                        if item not in seen:
+                            seen.add(item)
+                            stack.append(item)
+        return frozenset(seen)
+
+    start = closure(((0, 0, END),))
+    states: dict[frozenset[_Item], int] = {start: 0}
+    transitions: list[dict[str, int]] = []
+    worklist = [start]
+    while worklist:
+        state = worklist.pop(0)
+        moved: dict[str, list[_Item]] = {}
+        for production, dot, lookahead in state:
+            rhs = productions[production].rhs
+            if dot < len(rhs):
+                moved.setdefault(rhs[dot], []).append((production, dot + 1, lookahead))
+        edges: dict[str, int] = {}
+        for symbol, kernel in sorted(moved.items()):
+            target = closure(kernel)
+            if target not in states:
+                states[target] = len(states)
+                worklist.append(target)
+            edges[symbol] = states[target]
+        transitions.append(edges)
+
+    # Merge states with the same core
+    def core(state: frozenset[_Item]) -> frozenset[tuple[int, int]]:
+        return frozenset((production, dot) for production, dot, _ in state)
+
+    core_ids: dict[frozenset[tuple[int, int]], int] = {}
+    merged_of: list[int] = [0] * len(states)
+    merged_items: list[set[_Item]] = []
+    for state, index in sorted(states.items(), key=lambda pair: pair[1]):
+        merged = core_ids.setdefault(core(state), len(core_ids))
+        if merged == len(merged_items):
+            merged_items.append(set())
+        merged_items[merged] |= state
+        merged_of[index] = merged
+
+    actions: list[dict[str, int]] = [{} for _ in merged_items]
+    gotos: list[dict[str, int]] = [{} for _ in merged_items]
+    conflicts: list[str] = []
+
+    def set_action(state: int, terminal: str, action: int) -> None:
+        existing = actions[state].setdefault(terminal, action)
+        if existing != action:
+            conflicts.append(
+                f"state {state} on {terminal}: {_describe(productions, existing)}"
+                f" or {_describe(productions, action)}"
+            )
+
+    for index, edges in enumerate(transitions):
+        merged = merged_of[index]
+        for symbol, target in edges.items():
+            if symbol in nonterminals:
+                gotos[merged][symbol] = merged_of[target]
+            else:
+                set_action(merged, symbol, merged_of[target])
+
+    for merged, items in enumerate(merged_items):
+        for production, dot, lookahead in items:
+            if dot == len(productions[production].rhs):
+                set_action(
+                    merged, lookahead, ACCEPT if production == 0 else -1 - production
+                )
+
+    if conflicts:
+        raise GrammarConflict("Grammar is not LALR(1):\n" + "\n".join(conflicts))
+
+    return ParserTables(tuple(actions), tuple(gotos))
+
+
+def _describe(productions: list[Production], action: int) -> str:
+    if action >= 0:
+        return f"shift {action}"
+    if action == ACCEPT:
+        return "accept"
+    p = productions[-1 - action]
+    return f"reduce {p.lhs} -> {' '.join(p.rhs)}"
+
+
+def grammar_hash(grammar: tuple[Production, ...]) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            [GENERATOR_VERSION, [(p.lhs, p.rhs, p.action) for p in grammar]]
+        ).encode()
+    ).hexdigest()[:16]
+
+
+CACHE_DIR: typing.Final = os.path.join(os.path.dirname(__file__), "__pycache__")
+
+
+@cache
+def load_tables(grammar: tuple[Production, ...] = GRAMMAR) -> ParserTables:
+    """
+    The tables for the grammar, from the on-disk cache when possible
+    """
+
+    return load_or_build(
+        os.path.join(CACHE_DIR, f"lalr_{grammar_hash(grammar)}.json"),
+        lambda: build_tables(grammar),
+        lambda tables: {"actions": tables.actions, "gotos": tables.gotos},
+        lambda cached: ParserTables(tuple(cached["actions"]), tuple(cached["gotos"])),
+    )
+
+
+def lalr_parse(
+    src: Iterable[Token], grammar: tuple[Production, ...] = GRAMMAR
+) -> Term:
+    """
+    Parses the tokens with the grammar's LALR(1) tables, giving the
+    same result as multistage_parser.parse
+
+    Every token is shifted once and every node is built by exactly one
+    reduction, so this takes time linear in the number of tokens.
+    """
+
+    tables = load_tables(grammar)
+    actions = tables.actions
+    gotos = tables.gotos
+    reductions = [(p.lhs, len(p.rhs), ACTIONS[p.action]) for p in grammar]
+
+    states = [0]
+    values: list[typing.Any] = []
+
+    def feed(terminal: str, token: Token | None) -> bool:
+        """
+        Takes the terminal; returns whether the input was accepted
+        """
+        while True:
+            action = actions[states[-1]].get(terminal)
+            if action is None:
+                raise ValueError(f"Failed parse: unexpected {token or 'end of input'}")
+            if action >= 0:
+                states.append(action)
+                values.append(token)
+                return False
+            if action == ACCEPT:
+                return True
+
+            lhs, length, build = reductions[-2 - action]
+            if length:
+                args = values[-length:]
+                del values[-length:]
+                del states[-length:]
+            else:
+                args = []
+            values.append(build(args))
+            states.append(gotos[states[-1]][lhs])
+
+    for token in src:
+        feed(terminal_of(token), token)
+    feed(END, None)
+
+    (program,) = values
+    return program.to_term()
@@ -0,0 +1,347 @@
+import io
+import typing
+from array import array
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from .term_graph import (
+    BuiltinReferenceTerm,
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    SlotReferenceTerm,
+    StrTerm,
+    Term,
+)
+from .tree_printer import write_tree
+
+REFERENCE: typing.Final = 0
+INT: typing.Final = 1
+STR: typing.Final = 2
+CALL: typing.Final = 3
+PROGRAM: typing.Final = 4
+SLOT_REFERENCE: typing.Final = 5
+BUILTIN_REFERENCE: typing.Final = 6
+
+
+class TermArena:
+    """
+    Terms stored column by column: for each term id, one byte for its
+    kind and one unsigned int that is the head's id for a call or the
+    index of the value in a literal pool for a leaf. A term's children
+    (a call's args or a program's expressions) are the ids in
+    children[child_offsets[id] : child_offsets[id + 1]].
+
+    Leaves are shared, as with interned terms, so every name, int,
+    string and resolved reference is stored once. Resolved references
+    are kept whole in pools of their own (slots and builtins). Calls
+    and programs are not deduplicated by structure, since the table
+    for that would cost more than the terms themselves, but add_term
+    stores each subterm of the term it copies once, however many
+    times it is shared.
+    """
+
+    __slots__ = (
+        "kinds",
+        "values",
+        "child_offsets",
+        "children",
+        "strings",
+        "ints",
+        "slots",
+        "builtins",
+        "_string_ids",
+        "_int_ids",
+        "_slot_ids",
+        "_builtin_ids",
+        "_leaf_ids",
+    )
+
+    def __init__(self) -> None:
+        self.kinds = array("B")
+        self.values = array("I")
+        self.child_offsets = array("I", (0,))
+        self.children = array("I")
+        self.strings: list[str] = []
+        self.ints: list[int] = []
+        self.slots: list[tuple[str, int, int]] = []
+        self.builtins: list[tuple[str, int]] = []
+        self._string_ids: dict[str, int] = {}
+        self._int_ids: dict[int, int] = {}
+        self._slot_ids: dict[tuple[str, int, int], int] = {}
+        self._builtin_ids: dict[tuple[str, int], int] = {}
+        self._leaf_ids: dict[tuple[int, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def _add(self, kind: int, value: int, children: Sequence[int] = ()) -> int:
+        term_id = len(self.kinds)
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.children.extend(children)
+        self.child_offsets.append(len(self.children))
+        return term_id
+
+    def _leaf(self, kind: int, pool_index: int) -> int:
+        key = (kind, pool_index)
+        term_id = self._leaf_ids.get(key)
+        if term_id is None:
+            term_id = self._leaf_ids[key] = self._add(kind, pool_index)
+        return term_id
+
+    def _string_index(self, value: str) -> int:
+        index = self._string_ids.get(value)
+        if index is None:
+            index = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def reference(self, name: str) -> int:
+        return self._leaf(REFERENCE, self._string_index(name))
+
+    def string(self, value: str) -> int:
+        return self._leaf(STR, self._string_index(value))
+
+    def integer(self, value: int) -> int:
+        index = self._int_ids.get(value)
+        if index is None:
+            index = self._int_ids[value] = len(self.ints)
+            self.ints.append(value)
+        return self._leaf(INT, index)
+
+    def slot_reference(self, name: str, depth: int, slot: int) -> int:
+        key = (name, depth, slot)
+        index = self._slot_ids.get(key)
+        if index is None:
+            index = self._slot_ids[key] = len(self.slots)
+            self.slots.append(key)
+        return self._leaf(SLOT_REFERENCE, index)
+
+    def builtin_reference(self, name: str, builtin: int) -> int:
+        key = (name, builtin)
+        index = self._builtin_ids.get(key)
+        if index is None:
+            index = self._builtin_ids[key] = len(self.builtins)
+            self.builtins.append(key)
+        return self._leaf(BUILTIN_REFERENCE, index)
+
+    def call(self, head: int, args: Sequence[int]) -> int:
+        return self._add(CALL, head, args)
+
+    def program(self, exprs: Sequence[int]) -> int:
+        return self._add(PROGRAM, 0, exprs)
+
+    def children_of(self, term_id: int) -> array:
+        return self.children[
+            self.child_offsets[term_id] : self.child_offsets[term_id + 1]
+        ]
+
+    def leaf_value(self, term_id: int) -> int | str:
+        """
+        The value of a literal, or the name of a reference
+        """
+        kind = self.kinds[term_id]
+        if kind == INT:
+            return self.ints[self.values[term_id]]
+        if kind == SLOT_REFERENCE:
+            return self.slots[self.values[term_id]][0]
+        if kind == BUILTIN_REFERENCE:
+            return self.builtins[self.values[term_id]][0]
+        return self.strings[self.values[term_id]]
+
+    def leaf_text(self, term_id: int) -> str:
+        """
+        The leaf as the Term for it renders
+        """
+        if self.kinds[term_id] == SLOT_REFERENCE:
+            name, depth, slot = self.slots[self.values[term_id]]
+            return f"{name}@{depth}:{slot}"
+        return str(self.leaf_value(term_id))
+
+    def view(self, term_id: int) -> "ArenaTerm":
+        return ArenaTerm(self, term_id)
+
+    def nbytes(self) -> int:
+        """
+        Size of the columns, leaving out the literal pools
+        """
+        return sum(
+            len(column) * column.itemsize
+            for column in (self.kinds, self.values, self.child_offsets, self.children)
+        )
+
+    def add_term(self, term: Term) -> int:
+        """
+        Copies the term into the arena, children first, off an explicit stack
+        """
+
+        # By id(subterm), which is stable while term keeps it alive
+        copied: dict[int, int] = {}
+        ids: list[int] = []
+        stack: list[tuple[Term, int]] = [(term, -1)]
+        while stack:
+            current, count = stack.pop()
+            if count < 0 and id(current) in copied:
+                ids.append(copied[id(current)])
+                continue
+            match current:
+                case ReferenceTerm(name):
+                    ids.append(self.reference(name))
+                case IntTerm(value):
+                    ids.append(self.integer(value))
+                case StrTerm(value):
+                    ids.append(self.string(value))
+                case SlotReferenceTerm(name, depth, slot):
+                    ids.append(self.slot_reference(name, depth, slot))
+                case BuiltinReferenceTerm(name, builtin):
+                    ids.append(self.builtin_reference(name, builtin))
+                case FunctionCallTerm(head, args) if count < 0:
+                    stack.append((current, len(args)))
+                    stack.extend((arg, -1) for arg in reversed(args))
+                    stack.append((head, -1))
+                case FunctionCallTerm():
+                    args = _pop(ids, count)
+                    ids.append(self.call(ids.pop(), args))
+                    copied[id(current)] = ids[-1]
+                case ProgramTerm(exprs) if count < 0:
+                    stack.append((current, len(exprs)))
+                    stack.extend((expr, -1) for expr in reversed(exprs))
+                case ProgramTerm():
+                    ids.append(self.program(_pop(ids, count)))
+                    copied[id(current)] = ids[-1]
+                case _:
+                    raise ValueError(f"Cannot store {current!r} in an arena")
+        return ids[0]
+
+    def to_term(self, term_id: int) -> Term:
+        """
+        The interned Term for the id, built children first
+        """
+
+        kinds = self.kinds
+        values = self.values
+        built: dict[int, Term] = {}
+        terms: list[Term] = []
+        stack: list[tuple[int, bool]] = [(term_id, False)]
+        while stack:
+            current, children_done = stack.pop()
+            kind = kinds[current]
+            if not children_done and current in built:
+                terms.append(built[current])
+            elif kind == REFERENCE:
+                terms.append(ReferenceTerm(self.strings[values[current]]))
+            elif kind == INT:
+                terms.append(IntTerm(self.ints[values[current]]))
+            elif kind == STR:
+                terms.append(StrTerm(self.strings[values[current]]))
+            elif kind == SLOT_REFERENCE:
+                terms.append(SlotReferenceTerm(*self.slots[values[current]]))
+            elif kind == BUILTIN_REFERENCE:
+                terms.append(BuiltinReferenceTerm(*self.builtins[values[current]]))
+            elif not children_done:
+                stack.append((current, True))
+                children = self.children_of(current)
+                stack.extend((child, False) for child in reversed(children))
+                if kind == CALL:
+                    stack.append((values[current], False))
+            else:
+                child_terms = _pop(terms, len(self.children_of(current)))
+                if kind == CALL:
+                    terms.append(FunctionCallTerm(terms.pop(), child_terms))
+                else:
+                    terms.append(ProgramTerm(child_terms))
+                built[current] = terms[-1]
+        return terms[0]
+
+
+@dataclass(frozen=True, slots=True)
+class ArenaTerm:
+    """
+    A term in a TermArena, looked at through the same
+    render_contents interface as Term
+    """
+
+    arena: TermArena
+    id: int
+
+    def render_contents(self) -> "tuple[str, tuple[ArenaTerm, ...]]":
+        arena = self.arena
+        kind = arena.kinds[self.id]
+        if kind == CALL:
+            header = arena.view(arena.values[self.id]).display_node_inline()
+        elif kind == PROGRAM:
+            header = "Program"
+        else:
+            return arena.leaf_text(self.id), ()
+        return header, tuple(arena.view(child) for child in arena.children_of(self.id))
+
+    def display_node_inline(self) -> str:
+        """
+        Renders as Term.display_node_inline does, without recursing
+        """
+
+        arena = self.arena
+        out: list[str] = []
+        stack: list[int | str] = [self.id]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+                continue
+
+            kind = arena.kinds[item]
+            if kind == CALL:
+                head: int | str = arena.values[item]
+            elif kind == PROGRAM:
+                head = "Program"
+            else:
+                out.append(arena.leaf_text(item))
+                continue
+
+            children = arena.children_of(item)
+            if children:
+                stack.append(")")
+                for i in range(len(children) - 1, 0, -1):
+                    stack.append(children[i])
+                    stack.append(" ")
+                stack.append(children[0])
+                stack.append("(")
+            stack.append(head)
+
+        return "".join(out)
+
+    def display_node(self, pre: str = "") -> str:
+        out = io.StringIO()
+        write_tree(self, out, _render_contents, pre)
+        return out.getvalue()
+
+    def write_tree(
+        self,
+        file: typing.TextIO,
+        max_depth: int | None = None,
+        max_nodes: int | None = None,
+    ) -> int:
+        return write_tree(self, file, _render_contents, "", max_depth, max_nodes)
+
+    def to_term(self) -> Term:
+        return self.arena.to_term(self.id)
+
+    def __str__(self) -> str:
+        return self.display_node()
+
+
+def _render_contents(term: ArenaTerm) -> tuple[str, tuple[ArenaTerm, ...]]:
+    return term.render_contents()
+
+
+def _pop[T](values: list[T], count: int) -> tuple[T, ...]:
+    """
+    Removes and returns the last count values
+    """
+    if count == 0:
+        return ()
+    popped = tuple(values[-count:])
+    del values[-count:]
+    return popped
@@ -1,62 +1,179 @@
+import io
+import typing
 from abc import abstractmethod
-from dataclasses import dataclass
-from functools import cache
+from dataclasses import dataclass, field, fields
 from typing import Protocol, Self, override
+from weakref import KeyedRef
+
+from ..utils.bounded_cache import WeakKeyBoundedCache
+from .tree_printer import write_tree
 
 type Opo4Primitive = int | str
 
+_interned: dict[tuple[typing.Any, ...], KeyedRef] = {}
+"""
+A weak reference to every live term, by its class, field values
+and their types
+
+Terms are built from terms that are already interned, so a key
+hashes and compares its children by identity, one level deep. This
+is a WeakValueDictionary without the method calls, which are most
+of the cost of building a term.
+"""
+
+
+def _forget(ref: KeyedRef) -> None:
+    # Unless a new term has taken the key since
+    if _interned.get(ref.key) is ref:
+        del _interned[ref.key]
+
+
+_field_names: dict[type, tuple[str, ...]] = {}
+
+MAX_CACHED_LENGTH: typing.Final = 4096
+"""
+Renderings longer than this are not cached, so that
+the caches hold a bounded amount of text
+"""
+
+inline_cache: "WeakKeyBoundedCache[Term, str]" = WeakKeyBoundedCache(4096)
+"""
+What display_node_inline gave for recently rendered terms, mostly
+asked for again as the headers of calls in display_node
+
+Terms are held weakly, so that rendering a term does not keep it
+interned after the program it is in is freed.
+"""
+
+tree_cache: "WeakKeyBoundedCache[Term, str]" = WeakKeyBoundedCache(256)
+"""
+What display_node gave for recently rendered terms, tagged with
+the prefix they were rendered with
+"""
+
+
+def _init_field_names(cls: type) -> tuple[str, ...]:
+    names = _field_names.get(cls)
+    if names is None:
+        names = _field_names[cls] = tuple(f.name for f in fields(cls) if f.init)
+    return names
+
+
+class _Interning(type(Protocol)):  # type: ignore[misc]
+    """
+    Gives back the live term with the same class and field values,
+    if there is one, in place of constructing a new one
+
+    Done here rather than in __new__, since the dataclass __init__
+    would otherwise run again on the term given back. Keys have the
+    type of each field value too, so that 1, True and 1.0 make
+    different terms.
+    """
+
+    def __call__(cls, *args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        if kwargs:
+            names = _init_field_names(cls)[len(args) :]
+            args = (*args, *(kwargs[name] for name in names))
+
+        key = (cls, *args, *map(type, args))
+        ref = _interned.get(key)
+        if ref is not None:
+            term = ref()
+            if term is not None:
+                return term
+        term = super().__call__(*args)
+        object.__setattr__(term, "_hash", hash(key))
+        _interned[key] = KeyedRef(term, _forget, key)
+        return term
+
 
-@dataclass(frozen=True)
-class Term(Protocol):
+@dataclass(frozen=True, eq=False)
+class Term(Protocol, metaclass=_Interning):
+    """
+    Terms are hash-consed: constructing a term that is structurally
+    the same as a live one gives back that one, so equality is
+    identity and the terms of a program form a DAG with every repeated
+    subterm shared. Each term keeps the structural hash it was
+    interned under.
+    """
+
+    _hash: int = field(init=False, repr=False)
+
+    @override
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self) -> tuple[type[Self], tuple[typing.Any, ...]]:
+        # Unpickled terms are constructed as usual, so are interned too
+        return type(self), tuple(
+            getattr(self, name) for name in _init_field_names(type(self))
+        )
 
     @abstractmethod
     def render_contents(self) -> "tuple[str, tuple[Term, ...]]":
         raise NotImplementedError
 
-    @cache
+    def subterms(self) -> "tuple[Term, ...]":
+        """
+        The terms this one is built from, in order
+        """
+        return ()
+
+    def with_subterms(self, subterms: "tuple[Term, ...]") -> Self:
+        """
+        This term built from the given subterms in place of its own
+        """
+        return self
+
     def display_node_inline(self) -> str:
         """
         Provides a nice readable string rep
         of the Node without nesting
         """
-        header, children = self.render_contents()
-        if len(children) > 0:
-            args_str = " ".join(child.display_node_inline() for child in children)
-            return f"{header}({args_str})"
-        return f"{header}"
+        rendered = inline_cache.get(self)
+        if rendered is None:
+            rendered = _display_inline(self)
+            if len(rendered) <= MAX_CACHED_LENGTH:
+                inline_cache.put(self, rendered)
+        return rendered
 
-    @cache
     def display_node(self, pre: str = "") -> str:
         """
         Provides a nice readable string
         rep of the Node with nesting
-
-        This function is recursive and
-        dangerous to the sanity of anyone
-        who works on it
         """
-        header, children = self.render_contents()
-
-        render_contents: tuple[str, ...] = tuple(
-            child.display_node(pre + ("║ " if i < len(children) - 1 else "  "))
-            for i, child in enumerate(children)
-        )
+        rendered = tree_cache.get(self, pre)
+        if rendered is None:
+            rendered = _display_tree(self, pre)
+            if len(rendered) <= MAX_CACHED_LENGTH:
+                tree_cache.put(self, rendered, pre)
+        return rendered
 
-        return f"{'' if pre == '' else'═'} {header}\n" + "".join(
-            (
-                f"{pre}╠{element}"  # Normal case
-                if i < len(render_contents) - 1
-                else f"{pre}╚{element}"  # Last element
-            )
-            for i, element in enumerate(render_contents)
-        )
+    def write_tree(
+        self,
+        file: typing.TextIO,
+        max_depth: int | None = None,
+        max_nodes: int | None = None,
+    ) -> int:
+        """
+        Writes display_node to file as it goes, leaving out what is
+        past the limits; see tree_printer.write_tree
+        """
+        return write_tree(self, file, _render_contents, "", max_depth, max_nodes)
 
     @override
     def __str__(self):
         return self.display_node()
 
 
-@dataclass(frozen=True)
+def interned_count() -> int:
+    """
+    How many distinct terms are alive
+    """
+    return len(_interned)
+
+
+@dataclass(frozen=True, eq=False)
 class ProgramTerm(Term):
     top_level_exprs: tuple[Term, ...]
 
@@ -64,8 +181,16 @@ class ProgramTerm(Term):
     def render_contents(self):
         return "Program", self.top_level_exprs
 
+    @override
+    def subterms(self):
+        return self.top_level_exprs
+
+    @override
+    def with_subterms(self, subterms: tuple[Term, ...]):
+        return type(self)(subterms)
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class FunctionCallTerm(Term):
     head: Term
     args: tuple[Term, ...]
@@ -78,8 +203,16 @@ class FunctionCallTerm(Term):
     def render_contents(self):
         return self.head.display_node_inline(), self.args
 
+    @override
+    def subterms(self):
+        return (self.head, *self.args)
+
+    @override
+    def with_subterms(self, subterms: tuple[Term, ...]):
+        return self.of_tuple(subterms)
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class ReferenceTerm(Term):
     name: str
 
@@ -88,7 +221,37 @@ class ReferenceTerm(Term):
         return self.name, ()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
+class SlotReferenceTerm(Term):
+    """
+    A name resolved to its slot in the scope that binds it,
+    depth scopes out from where it is used
+    """
+
+    name: str
+    depth: int
+    slot: int
+
+    @override
+    def render_contents(self):
+        return f"{self.name}@{self.depth}:{self.slot}", ()
+
+
+@dataclass(frozen=True, eq=False)
+class BuiltinReferenceTerm(Term):
+    """
+    A name resolved to the builtin with the given id
+    """
+
+    name: str
+    builtin: int
+
+    @override
+    def render_contents(self):
+        return self.name, ()
+
+
+@dataclass(frozen=True, eq=False)
 class IntTerm(Term):
     value: int
 
@@ -97,10 +260,54 @@ class IntTerm(Term):
         return str(self.value), ()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class StrTerm(Term):
     value: str
 
     @override
     def render_contents(self):
         return str(self.value), ()
+
+
+def _display_inline(term: Term) -> str:
+    """
+    Renders "head(arg1 arg2 arg3)", one piece at a time
+    off an explicit stack, so nesting depth is not limited
+    by the recursion limit
+
+    A call's head is rendered inline in place of its header.
+    """
+
+    out: list[str] = []
+    stack: list[Term | str] = [term]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+
+        if isinstance(item, FunctionCallTerm):
+            head, children = item.head, item.args
+        else:
+            head, children = item.render_contents()
+
+        if children:
+            stack.append(")")
+            for i in range(len(children) - 1, 0, -1):
+                stack.append(children[i])
+                stack.append(" ")
+            stack.append(children[0])
+            stack.append("(")
+        stack.append(head)
+
+    return "".join(out)
+
+
+def _render_contents(term: Term) -> tuple[str, tuple[Term, ...]]:
+    return term.render_contents()
+
+
+def _display_tree(term: Term, pre: str = "") -> str:
+    out = io.StringIO()
+    write_tree(term, out, _render_contents, pre)
+    return out.getvalue()
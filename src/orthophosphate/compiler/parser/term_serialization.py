@@ -0,0 +1,295 @@
+import hashlib
+import os
+import typing
+
+from ..tokenizer import Tokenizer as tokenizer
+from .multistage_parser import parse
+from .term_graph import (
+    BuiltinReferenceTerm,
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    SlotReferenceTerm,
+    StrTerm,
+    Term,
+)
+
+FORMAT_VERSION: typing.Final = 2
+"""
+Bumped whenever the format or the meaning of a parse changes,
+so that files written before are rejected rather than misread
+"""
+
+MAGIC: typing.Final = b"OPO4T"
+
+_REFERENCE: typing.Final = 0
+_INT: typing.Final = 1
+_STR: typing.Final = 2
+_CALL: typing.Final = 3
+_PROGRAM: typing.Final = 4
+_SLOT_REFERENCE: typing.Final = 5
+_BUILTIN_REFERENCE: typing.Final = 6
+
+
+class TermFormatError(ValueError):
+    pass
+
+
+def dump_term(term: Term) -> bytes:
+    """
+    The term graph in a compact binary form
+
+    After MAGIC and FORMAT_VERSION come a table of the strings the terms
+    use, then every distinct term once, children before parents, the
+    last one being the root. All numbers are varints: a term is its
+    kind, then a string index, a zigzag int, a resolved reference's
+    name index and numbers, or a call's head and its children.
+    Children are written as how many terms back they are, which keeps
+    them to a byte or two however large the graph.
+    """
+
+    strings: dict[str, int] = {}
+    # By id(term), which is as good as the term while term keeps it
+    # alive, as terms are interned, and quicker to hash
+    ids: dict[int, int] = {}
+    body = bytearray()
+    write = body.append
+
+    def string_index(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    def write_varint(n: int) -> None:
+        while n >= 0x80:
+            write(n & 0x7F | 0x80)
+            n >>= 7
+        write(n)
+
+    # Dispatched on exact types, since matching on the term classes
+    # goes through Protocol's isinstance, which is many times slower
+    stack: list[tuple[Term, bool]] = [(term, False)]
+    while stack:
+        current, children_done = stack.pop()
+        if id(current) in ids:
+            continue
+
+        kind = type(current)
+        if kind is FunctionCallTerm:
+            call = typing.cast(FunctionCallTerm, current)
+            if not children_done:
+                stack.append((current, True))
+                stack.extend((arg, False) for arg in reversed(call.args))
+                stack.append((call.head, False))
+                continue
+            this_id = len(ids)
+            write(_CALL)
+            write_varint(this_id - ids[id(call.head)])
+            write_varint(len(call.args))
+            for arg in call.args:
+                write_varint(this_id - ids[id(arg)])
+        elif kind is ReferenceTerm:
+            write(_REFERENCE)
+            write_varint(string_index(typing.cast(ReferenceTerm, current).name))
+        elif kind is IntTerm:
+            value = typing.cast(IntTerm, current).value
+            write(_INT)
+            write_varint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif kind is StrTerm:
+            write(_STR)
+            write_varint(string_index(typing.cast(StrTerm, current).value))
+        elif kind is ProgramTerm:
+            exprs = typing.cast(ProgramTerm, current).top_level_exprs
+            if not children_done:
+                stack.append((current, True))
+                stack.extend((expr, False) for expr in reversed(exprs))
+                continue
+            this_id = len(ids)
+            write(_PROGRAM)
+            write_varint(len(exprs))
+            for expr in exprs:
+                write_varint(this_id - ids[id(expr)])
+        elif kind is SlotReferenceTerm:
+            slot_reference = typing.cast(SlotReferenceTerm, current)
+            write(_SLOT_REFERENCE)
+            write_varint(string_index(slot_reference.name))
+            write_varint(slot_reference.depth)
+            write_varint(slot_reference.slot)
+        elif kind is BuiltinReferenceTerm:
+            builtin_reference = typing.cast(BuiltinReferenceTerm, current)
+            write(_BUILTIN_REFERENCE)
+            write_varint(string_index(builtin_reference.name))
+            write_varint(builtin_reference.builtin)
+        else:
+            raise ValueError(f"Cannot serialize {current!r}")
+        ids[id(current)] = len(ids)
+
+    out = bytearray(MAGIC)
+    _write_varint(out, FORMAT_VERSION)
+    _write_varint(out, len(strings))
+    for value in strings:
+        encoded = value.encode()
+        _write_varint(out, len(encoded))
+        out += encoded
+    _write_varint(out, len(ids))
+    out += body
+    return bytes(out)
+
+
+def load_term(data: bytes) -> Term:
+    """
+    The term dump_term wrote
+
+    Raises TermFormatError if the data is not from this version of
+    dump_term, is cut short, or refers to strings or terms it does
+    not have.
+    """
+
+    if not data.startswith(MAGIC):
+        raise TermFormatError("Not a serialized term")
+    try:
+        pos = len(MAGIC)
+        version, pos = _read_varint(data, pos)
+        if version != FORMAT_VERSION:
+            raise TermFormatError(
+                f"Serialized term has format {version}, not {FORMAT_VERSION}"
+            )
+
+        string_count, pos = _read_varint(data, pos)
+        strings: list[str] = []
+        for _ in range(string_count):
+            length, pos = _read_varint(data, pos)
+            if pos + length > len(data):
+                raise IndexError
+            strings.append(data[pos : pos + length].decode())
+            pos += length
+
+        term_count, pos = _read_varint(data, pos)
+        numbers = _read_all_varints(data, pos)
+        terms: list[Term] = []
+
+        def string(index: int) -> str:
+            if not 0 <= index < len(strings):
+                raise TermFormatError(f"No string {index} in serialized term")
+            return strings[index]
+
+        def earlier(back: int) -> Term:
+            # Children come before their parents, so are 1 or more back
+            if not 0 < back <= len(terms):
+                raise TermFormatError(f"Term refers {back} back from {len(terms)}")
+            return terms[len(terms) - back]
+
+        i = 0
+        for _ in range(term_count):
+            kind = numbers[i]
+            if kind == _REFERENCE:
+                terms.append(ReferenceTerm(string(numbers[i + 1])))
+                i += 2
+            elif kind == _INT:
+                zigzag = numbers[i + 1]
+                value = zigzag // 2 if zigzag % 2 == 0 else -(zigzag + 1) // 2
+                terms.append(IntTerm(value))
+                i += 2
+            elif kind == _STR:
+                terms.append(StrTerm(string(numbers[i + 1])))
+                i += 2
+            elif kind == _SLOT_REFERENCE:
+                name = string(numbers[i + 1])
+                terms.append(SlotReferenceTerm(name, numbers[i + 2], numbers[i + 3]))
+                i += 4
+            elif kind == _BUILTIN_REFERENCE:
+                terms.append(
+                    BuiltinReferenceTerm(string(numbers[i + 1]), numbers[i + 2])
+                )
+                i += 3
+            elif kind == _CALL:
+                head = earlier(numbers[i + 1])
+                count = numbers[i + 2]
+                args = tuple(earlier(n) for n in numbers[i + 3 : i + 3 + count])
+                if len(args) != count:
+                    raise IndexError
+                terms.append(FunctionCallTerm(head, args))
+                i += 3 + count
+            elif kind == _PROGRAM:
+                count = numbers[i + 1]
+                exprs = tuple(earlier(n) for n in numbers[i + 2 : i + 2 + count])
+                if len(exprs) != count:
+                    raise IndexError
+                terms.append(ProgramTerm(exprs))
+                i += 2 + count
+            else:
+                raise TermFormatError(f"Unknown term kind {kind}")
+    except (IndexError, UnicodeDecodeError) as e:
+        raise TermFormatError("Serialized term is corrupt or cut short") from e
+
+    if i != len(numbers) or not terms:
+        raise TermFormatError("Serialized term is corrupt or cut short")
+    return terms[-1]
+
+
+def parse_cached(src: str, cache_dir: str) -> Term:
+    """
+    parse(tokenize(src)), kept in cache_dir by a hash of the source
+    so that a source that has not changed is only parsed once
+    """
+
+    digest = hashlib.sha256(src.encode())
+    digest.update(FORMAT_VERSION.to_bytes(4))
+    cache_path = os.path.join(cache_dir, f"{digest.hexdigest()[:32]}.opo4t")
+    try:
+        with open(cache_path, "rb") as file:
+            return load_term(file.read())
+    except (OSError, TermFormatError):
+        pass
+
+    term = parse(tokenizer.tokenize(src))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "wb") as file:
+            file.write(dump_term(term))
+    except OSError:
+        pass  # Only a cache
+    return term
+
+
+def _write_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read_all_varints(data: bytes, pos: int) -> list[int]:
+    """
+    Every varint from pos to the end, in one pass
+    """
+
+    numbers: list[int] = []
+    append = numbers.append
+    n = 0
+    shift = 0
+    for byte in memoryview(data)[pos:]:
+        if byte < 0x80:
+            append(n | byte << shift)
+            n = 0
+            shift = 0
+        else:
+            n |= (byte & 0x7F) << shift
+            shift += 7
+    if shift:
+        raise IndexError
+    return numbers
@@ -0,0 +1,76 @@
+import typing
+from collections.abc import Callable, Sequence
+
+ELISION: typing.Final = "..."
+"""
+Stands in for the nodes a limit left out
+"""
+
+_FLUSH_EVERY: typing.Final = 4096
+"""
+Pieces gathered before each write, so that writing costs few calls
+and the memory used does not grow with the tree
+"""
+
+
+def write_tree[N](
+    root: N,
+    file: typing.TextIO,
+    contents: Callable[[N], tuple[str, Sequence[N]]],
+    pre: str = "",
+    max_depth: int | None = None,
+    max_nodes: int | None = None,
+) -> int:
+    """
+    Writes one line per node to file, with box drawing for the nesting,
+    as display_node renders it; contents gives the header and children
+    of a node
+
+    Each node's line is followed by its children in order; the
+    children wait on an explicit stack with their prefixes, so
+    nesting depth is not limited by the recursion limit. The children
+    of a node at max_depth (the root is at 0) are written as one
+    ELISION line, and after max_nodes nodes the rest are. Returns how
+    many nodes were written.
+    """
+
+    write = file.write
+    out: list[str] = []
+    written = 0
+    stack: list[tuple[N, str, int] | str] = [(root, pre, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+
+        node, node_pre, depth = item
+        if max_nodes is not None and written == max_nodes:
+            # In place of this node and everything after it
+            out.append(f"{'' if node_pre == '' else'═'} {ELISION}\n")
+            break
+
+        header, children = contents(node)
+        out.append(f"{'' if node_pre == '' else'═'} {header}\n")
+        written += 1
+
+        if children and max_depth is not None and depth == max_depth:
+            out.append(f"{node_pre}╚═ {ELISION}\n")
+            children = ()
+
+        if children:
+            # Built once per node, so that the children share them
+            child_pre = node_pre + "║ "
+            connector = f"{node_pre}╠"  # Normal case
+            stack.append((children[-1], node_pre + "  ", depth + 1))
+            stack.append(f"{node_pre}╚")  # Last element
+            for i in range(len(children) - 2, -1, -1):
+                stack.append((children[i], child_pre, depth + 1))
+                stack.append(connector)
+
+        if len(out) >= _FLUSH_EVERY:
+            write("".join(out))
+            out.clear()
+
+    write("".join(out))
+    return written
@@ -1,11 +1,66 @@
 from collections.abc import Iterable, Iterator
+import enum
 import re
-
+import typing
+
+from .chunked_source import (
+    DEFAULT_CHUNK_SIZE,
+    RawMatch,
+    TextSource,
+    read_chunks,
+    scan_chunks,
+)
+from .lexer_generator import dfa_scan, load_tables, longest_match_spec
+from .line_index import LineIndex
 from .token import Token, TokenType, IndentType
+from .token_buffer import (
+    DEDENT_KIND,
+    EOF_KIND,
+    FILE_START_KIND,
+    INDENT_KIND,
+    INT_KIND,
+    NAME_KIND,
+    NEWLINE_KIND,
+    PUNC_KINDS,
+    STR_KIND,
+    TokenBuffer,
+)
+
+
+class Engine(enum.Enum):
+    """
+    Ways of turning source text into the token sequence
+
+    PIPELINE is the reference: raw_tokenize followed by the
+    separate clean-up passes. FUSED does the same work in one pass.
+    (dfa_raw_tokenize is not one: it is no faster than the regex.)
+    """
+
+    PIPELINE = enum.auto()
+    FUSED = enum.auto()
 
 
-def tokenize(input: str) -> tuple[Token, ...]:
-    return final_step(normalize_indents(remove_blank_lines(raw_tokenize(input))))
+def tokenize(input: str, engine: Engine = Engine.FUSED) -> tuple[Token, ...]:
+    match engine:
+        case Engine.PIPELINE:
+            return final_step(
+                normalize_indents(remove_blank_lines(raw_tokenize(input)))
+            )
+        case Engine.FUSED:
+            return tuple(fused_tokenize(input))
+
+
+def tokenize_stream(
+    source: TextSource, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Token]:
+    """
+    Streaming mode of tokenize: reads the source (a string, an open
+    text or binary file, or an mmap) in chunks and yields the same
+    tokens lazily, so the whole source never has to be in memory
+    """
+    return frame(
+        normalize_indents(remove_blank_lines(raw_tokenize_stream(source, chunk_size)))
+    )
 
 
 BLANK_LINE_CONTENT = frozenset({TokenType.NEWLINE, TokenType.INDENT_DEDENT})
@@ -44,6 +99,7 @@ def normalize_indents(raw: Iterable[Token]) -> Iterator[Token]:
     """
 
     indentation_delta: int = 0
+    last_end: int = 0
 
     for t in raw:
 
@@ -54,22 +110,29 @@ def normalize_indents(raw: Iterable[Token]) -> Iterator[Token]:
         else:
 
             # We hit a non-indent. Add back the saved indents.
-            indent_type = (
-                IndentType.INDENT if indentation_delta > 0 else IndentType.DEDENT
-            )
-            for _ in range(abs(indentation_delta)):
-                yield Token(TokenType.INDENT_DEDENT, indent_type)
+            yield from _indent_tokens(indentation_delta, t.start)
             indentation_delta = 0
 
             yield t
+            last_end = t.end
 
     # Add trailing dedents to return to zero indentation
-    indent_type = IndentType.INDENT if indentation_delta > 0 else IndentType.DEDENT
-    for _ in range(abs(indentation_delta)):
-        yield Token(TokenType.INDENT_DEDENT, indent_type)
+    yield from _indent_tokens(indentation_delta, last_end)
     indentation_delta = 0
 
 
+def frame(raw: Iterable[Token]) -> Iterator[Token]:
+    """
+    Add file start and end tokens
+    """
+    yield Token(TokenType.PUNC, "file_start", 0, 0)
+    last_end = 0
+    for t in raw:
+        yield t
+        last_end = t.end
+    yield Token(TokenType.PUNC, "EOF", last_end, last_end)
+
+
 def final_step(raw: Iterable[Token]) -> tuple[Token, ...]:
     """
     Add file start and end tokens. Make a tuple of the result.
@@ -85,7 +148,7 @@ def final_step(raw: Iterable[Token]) -> tuple[Token, ...]:
     # if as_tuple[-2].type == TokenType.NEWLINE:
     #     return as_tuple[:-2] + as_tuple[-1:]
 
-    return (Token(TokenType.PUNC, "file_start"), *raw, Token(TokenType.PUNC, "EOF"))
+    return tuple(frame(raw))
 
 
 TOKENS: tuple[tuple[str, str], ...] = (
@@ -108,47 +171,135 @@ TOKEN_REGEX = re.compile(
 )
 
 
+DFA_REWRITES: dict[str, tuple[tuple[str, int], ...]] = {
+    # The lazy STR pattern stops at the first quote that is not part of
+    # a \", or at the last \" if no other quote follows. The body cannot
+    # take a bare quote, so the longest match ends at the same place
+    r'"(?:\\"|[^"])*?"': ((r'"(?:\\"|[^"])*"', 0),),
+    # The lookahead becomes trailing context: the newline is matched,
+    # then given back (the second element is how many characters).
+    # The lazy block comment is spelled so that it cannot run past
+    # the first */
+    r"(?:#|//)[^\n]*?(?=\n)|/\*(?:.|\n)*?\*/": (
+        (r"(?:#|//)[^\n]*\n", 1),
+        (r"/\*(?:[^*]|\*+[^*/])*\*+/", 0),
+    ),
+    # "^" is handled by the scanner, which knows where the source starts
+    r"(?:\n|^)[ ]*": ((r"\n[ ]*", 0),),
+    # LINE wins over WHITESPACE at a newline
+    r"\s+": ((r"[^\S\n]\s*", 0),),
+}
+"""
+The TOKENS patterns that mean something else under longest-match
+scanning, or use syntax it does not have, and what to scan instead
+"""
+
+DFA_TOKENS: typing.Final = longest_match_spec(TOKENS, DFA_REWRITES)
+"""
+TOKENS for dfa_scan. Built at import, so a rewrite that no longer
+matches its TOKENS pattern, or a new pattern the scanner cannot
+express, fails there; the differential tests check that scanning with
+it agrees with TOKEN_REGEX.
+"""
+
+
 def raw_tokenize(input: str) -> Iterator[Token]:
+    return _tokens_of_matches(
+        (match_object.lastgroup, match_object.group(), match_object.start())
+        for match_object in re.finditer(TOKEN_REGEX, input)
+    )
+
+
+def dfa_raw_tokenize(input: str) -> Iterator[Token]:
+    """
+    raw_tokenize using the DFA built from TOKENS (see lexer_generator)
+
+    Works straight off the integer DFA_TOKENS entries the scanner
+    gives, rather than going back to group names. No faster than
+    raw_tokenize, so it is not an Engine.
+    """
+
+    tables = load_tables(DFA_TOKENS)
+    token_types = tuple(_CONTENT_TOKEN_TYPES.get(name) for name in tables.names)
+    lines = tuple(name == "LINE" for name in tables.names)
+    skipped = tuple(name in ("WHITESPACE", "COMMENT") for name in tables.names)
+
+    current_indent = 0
+
+    for entry, start, end in dfa_scan(input, tables):
+
+        token_type = token_types[entry]
+        if token_type is not None:
+            yield Token(token_type, input[start:end], start, end)
+
+        elif skipped[entry]:
+            pass
+
+        elif lines[entry]:
+            # The "^" at the very start of the source has no newline
+            line_start = start + 1 if input.startswith("\n", start) else start
+            yield Token(TokenType.NEWLINE, "", start, line_start)
+
+            new_indent_raw = end - start - 1  # Exclude newline itself
+            assert (
+                new_indent_raw % 4 == 0
+            ), f"Indentation on line {_line_of(input, end)} is not divisible by 4"
+            new_indent = round(new_indent_raw / 4)
+            yield from _indent_tokens(new_indent - current_indent, end)
+            current_indent = new_indent
+
+        else:  # UNEXPECTED
+            _raise_unexpected_at(input, start, end, tables.names[entry])
+
+
+def raw_tokenize_stream(
+    source: TextSource, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[Token]:
+    return _tokens_of_matches(scan_chunks(TOKEN_REGEX, read_chunks(source, chunk_size)))
 
+
+def _tokens_of_matches(matches: Iterable[RawMatch]) -> Iterator[Token]:
+
+    # Sources can be streamed, so lines are counted as we go rather
+    # than looked up in a LineIndex
     line_start = 0
     line_num = 1
 
     current_indent = 0
 
-    for match_object in re.finditer(TOKEN_REGEX, input):
+    for type_string, lexeme, start in matches:
 
-        type_string = match_object.lastgroup
-        lexeme = match_object.group()
-        col_num = match_object.start() - line_start
+        end = start + len(lexeme)
+
+        if type_string != "LINE" and "\n" in lexeme:
+            # Strings, comments and whitespace can all span lines
+            line_num += count_newlines(lexeme)
+            line_start = start + lexeme.rfind("\n") + 1
 
         match type_string:
 
             case "INT":
-                yield Token(TokenType.INT, lexeme)
+                yield Token(TokenType.INT, lexeme, start, end)
 
             case "STR":
-                yield Token(TokenType.STR, lexeme)
+                yield Token(TokenType.STR, lexeme, start, end)
 
             case "COMMENT":
-
-                newline_count = count_newlines(lexeme)
-
-                if newline_count > 0:
-                    line_num += newline_count
-                    line_start = 0
+                pass
 
             case "PUNC":
-                yield Token(TokenType.PUNC, lexeme)
+                yield Token(TokenType.PUNC, lexeme, start, end)
 
             case "NAME":
-                yield Token(TokenType.NAME, lexeme)
+                yield Token(TokenType.NAME, lexeme, start, end)
 
             case "LINE":
 
-                line_start = match_object.start() + 1
-                line_num += 1
+                newline_count = count_newlines(lexeme)  # 0 for the "^" case
+                line_start = start + newline_count
+                line_num += newline_count
 
-                yield Token(TokenType.NEWLINE, "")
+                yield Token(TokenType.NEWLINE, "", start, line_start)
 
                 new_indent_raw = len(lexeme) - 1  # Exclude newline itself
                 assert (
@@ -162,6 +313,8 @@ def raw_tokenize(input: str) -> Iterator[Token]:
                     yield Token(
                         TokenType.INDENT_DEDENT,
                         IndentType.DEDENT if is_dedent else IndentType.INDENT,
+                        end,
+                        end,
                     )
 
                 current_indent = new_indent
@@ -171,9 +324,249 @@ def raw_tokenize(input: str) -> Iterator[Token]:
 
             case _:  # UNEXPECTED
                 raise ValueError(
-                    f"Unexpected character '{lexeme}' at line {line_num} col {col_num} (categorized {type_string})"
+                    f"Unexpected character '{lexeme}' at line {line_num} col {start - line_start} (categorized {type_string})"
                 )
 
 
+_CONTENT_TOKEN_TYPES: dict[str | None, TokenType] = {
+    "NAME": TokenType.NAME,
+    "PUNC": TokenType.PUNC,
+    "INT": TokenType.INT,
+    "STR": TokenType.STR,
+}
+
+
+def fused_tokenize(input: str) -> Iterator[Token]:
+    """
+    Does the work of raw_tokenize, remove_blank_lines, normalize_indents
+    and frame in one pass over the regex matches
+
+    The tokens of a line are held back until its newline shows up, which
+    is when we know whether the line is blank. Indentation changes pile up
+    in pending_indent until the next line with content (or the end).
+    """
+    yield Token(TokenType.PUNC, "file_start", 0, 0)
+    yield from resume_fused_tokenize(input, 0, 0, False)
+
+
+def resume_fused_tokenize(
+    input: str, pos: int, current_indent: int, mid_line: bool
+) -> Iterator[Token]:
+    """
+    Runs fused_tokenize from pos (which must be where a regex
+    match starts) up to and including EOF
+
+    current_indent is the indentation the scan would have reached by pos.
+    mid_line says that a line with content is in progress, even though
+    none of its tokens are seen here, so the next newline is kept.
+    """
+
+    line_indent = 0  # Indentation change at the start of the current line
+    pending_indent = 0  # Indentation change not yet emitted
+
+    line_tokens: list[Token] = []
+    last_end = pos
+
+    for match_object in TOKEN_REGEX.finditer(input, pos):
+
+        type_string = match_object.lastgroup
+        token_type = _CONTENT_TOKEN_TYPES.get(type_string)
+
+        if token_type is not None:
+            start, end = match_object.span()
+            line_tokens.append(Token(token_type, input[start:end], start, end))
+
+        elif type_string == "WHITESPACE" or type_string == "COMMENT":
+            pass
+
+        elif type_string == "LINE":
+
+            pending_indent += line_indent
+            if line_tokens or mid_line:
+                if pending_indent != 0:
+                    yield from _indent_tokens(pending_indent, line_tokens[0].start)
+                    pending_indent = 0
+                yield from line_tokens
+                line_tokens.clear()
+                mid_line = False
+                last_end = match_object.start() + 1
+                yield Token(TokenType.NEWLINE, "", match_object.start(), last_end)
+
+            new_indent_raw = match_object.end() - match_object.start() - 1
+            assert (
+                new_indent_raw % 4 == 0
+            ), f"Indentation on line {_line_of(input, match_object.end())} is not divisible by 4"
+            new_indent = new_indent_raw // 4
+            line_indent = new_indent - current_indent
+            current_indent = new_indent
+
+        else:  # UNEXPECTED
+            _raise_unexpected(input, match_object)
+
+    # Whatever follows the last newline is dropped, as in remove_blank_lines
+    if pending_indent != 0:
+        yield from _indent_tokens(pending_indent, last_end)
+
+    yield Token(TokenType.PUNC, "EOF", last_end, last_end)
+
+
+def tokenize_columnar(input: str) -> TokenBuffer:
+    """
+    Produces the same token sequence as tokenize,
+    stored compactly in a TokenBuffer
+    """
+
+    buffer = TokenBuffer(input)
+    buffer.append(FILE_START_KIND, 0, 0)
+    pending_indent, _ = scan_columnar(input, buffer)
+    last_end = buffer.ends[-1]
+    append_indents(buffer, pending_indent, last_end)
+    buffer.append(EOF_KIND, last_end, last_end)
+    return buffer
+
+
+COLUMN_ZERO_LINE: typing.Final = re.compile(r"\n(?=[^\s#/])")
+"""
+A newline before a line that has a token at column zero
+
+Where one of these is a real LINE match (not inside a string or
+comment), the indentation there is zero, so tokenizing can start over.
+Comment lines are left out so that the line is never blank.
+"""
+
+
+def scan_columnar(
+    input: str, buffer: TokenBuffer, start: int = 0, stop: int | None = None
+) -> tuple[int, int]:
+    """
+    Appends the tokens of input from start to buffer, without
+    file_start, EOF, or the indentation changes still to come,
+    as tokenize_columnar does for the whole source
+
+    start must be 0 or just after a COLUMN_ZERO_LINE newline. With
+    a stop, the scan ends at the first COLUMN_ZERO_LINE that ends at
+    or after it. Gives the indentation change not yet appended, and
+    where the scan ended.
+
+    Works like fused_tokenize, except that a line's tokens go straight
+    into the buffer; if the last line turns out to have no newline,
+    they are cut back off at the end.
+    """
+
+    append_kind = buffer.kinds.append
+    append_start = buffer.starts.append
+    append_end = buffer.ends.append
+
+    current_indent = 0
+    line_indent = 0  # Indentation change at the start of the current line
+    pending_indent = 0  # Indentation change not yet emitted
+
+    line_mark = -1  # Where the current line begins in the buffer; -1 while blank
+    pending_before_line = 0  # pending_indent before the current line began
+
+    for match_object in TOKEN_REGEX.finditer(input, start):
+
+        type_string = match_object.lastgroup
+
+        if type_string == "WHITESPACE":
+            continue
+
+        if type_string == "LINE":
+
+            if line_mark >= 0:
+                buffer.append(
+                    NEWLINE_KIND, match_object.start(), match_object.start() + 1
+                )
+                line_mark = -1
+            else:
+                pending_indent += line_indent
+
+            new_indent_raw = match_object.end() - match_object.start() - 1
+            assert (
+                new_indent_raw % 4 == 0
+            ), f"Indentation on line {_line_of(input, match_object.end())} is not divisible by 4"
+            new_indent = new_indent_raw // 4
+            line_indent = new_indent - current_indent
+            current_indent = new_indent
+
+            if (
+                stop is not None
+                and match_object.end() >= stop
+                and COLUMN_ZERO_LINE.match(input, match_object.start())
+            ):
+                return pending_indent + line_indent, match_object.end()
+            continue
+
+        if type_string == "NAME":
+            kind = NAME_KIND
+        elif type_string == "PUNC":
+            kind = PUNC_KINDS[match_object.group()]
+        elif type_string == "INT":
+            kind = INT_KIND
+        elif type_string == "STR":
+            kind = STR_KIND
+        elif type_string == "COMMENT":
+            continue
+        else:  # UNEXPECTED
+            _raise_unexpected(input, match_object)
+
+        token_start = match_object.start()
+
+        if line_mark < 0:
+            # First token on this line, so the line is not blank
+            line_mark = len(buffer)
+            pending_before_line = pending_indent
+            pending_indent += line_indent
+            append_indents(buffer, pending_indent, token_start)
+            pending_indent = 0
+
+        append_kind(kind)
+        append_start(token_start)
+        append_end(match_object.end())
+
+    if line_mark >= 0:
+        # Whatever follows the last newline is dropped, as in remove_blank_lines
+        del buffer.kinds[line_mark:]
+        del buffer.starts[line_mark:]
+        del buffer.ends[line_mark:]
+        pending_indent = pending_before_line
+
+    return pending_indent, len(input)
+
+
+def append_indents(buffer: TokenBuffer, indentation_delta: int, at: int) -> None:
+    kind = INDENT_KIND if indentation_delta > 0 else DEDENT_KIND
+    for _ in range(abs(indentation_delta)):
+        buffer.append(kind, at, at)
+
+
+def _indent_tokens(indentation_delta: int, at: int) -> Iterator[Token]:
+    indent_type = IndentType.INDENT if indentation_delta > 0 else IndentType.DEDENT
+    for _ in range(abs(indentation_delta)):
+        yield Token(TokenType.INDENT_DEDENT, indent_type, at, at)
+
+
+def _line_of(input: str, offset: int) -> int:
+    """
+    Only for error messages; the engines that tokenize a whole
+    string do not count lines as they go
+    """
+    return LineIndex.of_source(input).line_col(offset)[0]
+
+
+def _raise_unexpected(input: str, match_object: re.Match[str]) -> typing.NoReturn:
+    start, end = match_object.span()
+    _raise_unexpected_at(input, start, end, match_object.lastgroup)
+
+
+def _raise_unexpected_at(
+    input: str, start: int, end: int, category: str | None
+) -> typing.NoReturn:
+    line_num, col_num = LineIndex.of_source(input).line_col(start)
+    raise ValueError(
+        f"Unexpected character '{input[start:end]}' at line {line_num} col {col_num} (categorized {category})"
+    )
+
+
 def count_newlines(s: str) -> int:
-    return sum(1 if char == "\n" else 0 for char in s)
+    return s.count("\n")
@@ -0,0 +1,119 @@
+import codecs
+import mmap
+import re
+import typing
+from collections.abc import Iterator
+
+type TextSource = str | typing.TextIO | typing.BinaryIO | mmap.mmap
+"""
+Anything the streaming tokenizer can read from
+"""
+
+type RawMatch = tuple[str | None, str, int]
+"""
+(group name, lexeme, absolute offset of the lexeme in the source)
+"""
+
+DEFAULT_CHUNK_SIZE: typing.Final = 1 << 16
+
+_TOKEN_PREFIXES: typing.Final = frozenset({'"', "/", "#", "-"})
+"""
+Characters that start a string, a comment or "->"
+"""
+
+
+def read_chunks(
+    source: TextSource, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterator[str]:
+    """
+    Reads the source as a series of strings of at most chunk_size characters
+    (bytes for binary sources, which are decoded as UTF-8)
+    """
+
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            yield source[i : i + chunk_size]
+        return
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    if isinstance(source, mmap.mmap):
+        for i in range(0, len(source), chunk_size):
+            yield decoder.decode(source[i : i + chunk_size])
+        yield decoder.decode(b"", final=True)
+        return
+
+    while True:
+        data = source.read(chunk_size)
+        if not data:
+            break
+        yield data if isinstance(data, str) else decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def scan_chunks(pattern: re.Pattern[str], chunks: Iterator[str]) -> Iterator[RawMatch]:
+    """
+    Runs the pattern over a chunked source as if it were one string
+
+    A match that touches the end of the buffer (or that could be the start
+    of an unfinished string or comment) is held back until more text arrives,
+    so only the unconsumed tail of the source is ever kept in memory.
+    """
+
+    pending = ""
+    base = 0  # Absolute offset of pending[0]
+    pos = 0  # Where scanning resumes in pending
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer = pending + chunk
+        consumed = yield from _scan(pattern, buffer, pos, base, final=False)
+
+        # Keep one character before the resume point so that "^" in the
+        # pattern never matches anywhere but the real start of the source
+        keep = consumed - 1 if consumed > 0 else 0
+        pending = buffer[keep:]
+        base += keep
+        pos = consumed - keep
+
+    yield from _scan(pattern, pending, pos, base, final=True)
+
+
+def _scan(
+    pattern: re.Pattern[str], buffer: str, pos: int, base: int, final: bool
+) -> typing.Generator[RawMatch, None, int]:
+    """
+    Yields the settled matches in the buffer and returns
+    how far into the buffer they reach
+    """
+    for match_object in pattern.finditer(buffer, pos):
+        if not final and not _is_settled(match_object, buffer):
+            return match_object.start()
+        yield (
+            match_object.lastgroup,
+            match_object.group(),
+            base + match_object.start(),
+        )
+    return len(buffer)
+
+
+def _is_settled(match_object: re.Match[str], buffer: str) -> bool:
+    """
+    Whether reading more of the source could not change this match
+    """
+    if match_object.end() == len(buffer):
+        return False
+
+    start = match_object.start()
+    match match_object.lastgroup:
+        case "STR":
+            # A string closing on an escaped quote is what the STR
+            # pattern backtracks to when its real end is not read yet
+            return not match_object.group().endswith('\\"')
+        case "COMMENT":
+            return True
+        case _:
+            # Strings, comments and arrows that are not complete yet
+            # fall through to whatever later pattern matches at their start
+            return buffer[start : start + 1] not in _TOKEN_PREFIXES
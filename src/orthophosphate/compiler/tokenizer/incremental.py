@@ -0,0 +1,254 @@
+import re
+import typing
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+
+from .token import IndentType, Token, TokenType
+from .Tokenizer import (
+    TOKEN_REGEX,
+    _CONTENT_TOKEN_TYPES,
+    fused_tokenize,
+    resume_fused_tokenize,
+)
+
+
+@dataclass(frozen=True)
+class TextEdit:
+    """
+    Replaces `removed` characters at `offset` with `inserted`
+    """
+
+    offset: int
+    removed: int
+    inserted: str
+
+    def apply(self, source: str) -> str:
+        return (
+            source[: self.offset] + self.inserted + source[self.offset + self.removed :]
+        )
+
+    @property
+    def delta(self) -> int:
+        """
+        How far text after the edit moves
+        """
+        return len(self.inserted) - self.removed
+
+
+@dataclass(frozen=True)
+class TokenEdit:
+    """
+    Replaces old_tokens[start:stop] with tokens;
+    every token after that moves by delta
+    """
+
+    start: int
+    stop: int
+    tokens: tuple[Token, ...]
+    delta: int
+
+    def apply(self, old_tokens: Sequence[Token]) -> tuple[Token, ...]:
+        """
+        The full new token sequence
+
+        Unlike relex, this takes time proportional to the number of
+        tokens after the edit, since each of them gets a new span.
+        Use splice to avoid that.
+        """
+        delta = self.delta
+        if delta == 0:
+            tail = tuple(old_tokens[self.stop :])
+        else:
+            tail = tuple(_shifted(t, delta) for t in old_tokens[self.stop :])
+        return (*old_tokens[: self.start], *self.tokens, *tail)
+
+    def splice(self, old_tokens: Sequence[Token]) -> "SplicedTokens":
+        """
+        The full new token sequence as a view over the old one, built
+        in constant time; later tokens are only moved when looked at
+        """
+        return SplicedTokens(old_tokens, self)
+
+
+MAX_SPLICE_DEPTH = 16
+"""
+How many SplicedTokens may be stacked on each other before
+one is flattened into a tuple to keep lookups fast
+"""
+
+
+class SplicedTokens(Sequence[Token]):
+    """
+    Old tokens with a TokenEdit applied
+    """
+
+    __slots__ = ("_old", "_edit", "_depth", "_new_stop", "_len")
+
+    def __init__(self, old_tokens: Sequence[Token], edit: TokenEdit) -> None:
+        depth = old_tokens._depth + 1 if isinstance(old_tokens, SplicedTokens) else 1
+        if depth > MAX_SPLICE_DEPTH:
+            old_tokens = tuple(old_tokens)
+            depth = 1
+        self._old = old_tokens
+        self._edit = edit
+        self._depth = depth
+        self._new_stop = edit.start + len(edit.tokens)
+        self._len = len(old_tokens) - (edit.stop - edit.start) + len(edit.tokens)
+
+    def __len__(self) -> int:
+        return self._len
+
+    @typing.overload
+    def __getitem__(self, index: int) -> Token: ...
+    @typing.overload
+    def __getitem__(self, index: slice) -> tuple[Token, ...]: ...
+
+    def __getitem__(self, index: int | slice) -> Token | tuple[Token, ...]:
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(*index.indices(self._len)))
+
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+
+        edit = self._edit
+        if index < edit.start:
+            return self._old[index]
+        if index < self._new_stop:
+            return edit.tokens[index - edit.start]
+        return _shifted(self._old[index - self._new_stop + edit.stop], edit.delta)
+
+    def __iter__(self) -> Iterator[Token]:
+        edit = self._edit
+        old = self._old
+        for i in range(edit.start):
+            yield old[i]
+        yield from edit.tokens
+        for i in range(edit.stop, len(old)):
+            yield _shifted(old[i], edit.delta)
+
+
+def relex(
+    source: str, tokens: Sequence[Token], edit: TextEdit
+) -> tuple[str, TokenEdit]:
+    """
+    Re-tokenizes only the part of an edited source that can have changed
+
+    tokens must be what tokenize gave for source. Lexing restarts at the
+    last newline token before the edit (which is never inside a string or
+    comment) and stops at the first newline token after the edit where the
+    new tokens line up with the old ones again: same place (allowing for
+    the edit) and same indentation. Everything after that is reused.
+
+    Returns the new source and how to change the old tokens into the new.
+    """
+
+    new_source = edit.apply(source)
+
+    restart = _restart_index(tokens, edit.offset)
+    if restart == 0:
+        current_indent = 0
+        new_stream = fused_tokenize(new_source)
+    else:
+        current_indent = _indent_before(source, tokens, restart)
+        new_stream = resume_fused_tokenize(
+            new_source, tokens[restart].start, current_indent, True
+        )
+
+    delta = edit.delta
+    edit_end = edit.offset + len(edit.inserted)
+
+    new_tokens: list[Token] = []
+    new_depth = old_depth = current_indent
+    old_index = restart
+
+    for t in new_stream:
+        new_tokens.append(t)
+
+        if t.type is TokenType.INDENT_DEDENT:
+            new_depth += 1 if t.value == IndentType.INDENT else -1
+
+        elif t.type is TokenType.NEWLINE and t.start >= edit_end:
+            old_start = t.start - delta
+            while old_index < len(tokens) and tokens[old_index].start < old_start:
+                old_depth += _depth_change(tokens[old_index])
+                old_index += 1
+
+            if (
+                old_index < len(tokens)
+                and tokens[old_index].type is TokenType.NEWLINE
+                and tokens[old_index].start == old_start
+                and old_depth == new_depth
+            ):
+                # In sync: from here on the old tokens are right
+                return new_source, TokenEdit(
+                    restart, old_index + 1, tuple(new_tokens), delta
+                )
+
+    return new_source, TokenEdit(restart, len(tokens), tuple(new_tokens), delta)
+
+
+def _restart_index(tokens: Sequence[Token], offset: int) -> int:
+    """
+    Index of the last newline token that starts before offset,
+    or 0 (file_start) if there is none
+    """
+    i = bisect_left(tokens, offset, key=lambda t: t.start) - 1
+    while i > 0:
+        if tokens[i].type is TokenType.NEWLINE:
+            return i
+        i -= 1
+    return 0
+
+
+def _indent_before(source: str, tokens: Sequence[Token], newline_index: int) -> int:
+    """
+    The indentation the scan had reached at the newline token at
+    newline_index
+
+    That is the indentation of the last line break before the line's
+    first token, so the text from the newline that ended the previous
+    line up to that token (only blank lines and comments) is rescanned.
+    """
+
+    previous = newline_index - 1
+    while previous > 0 and tokens[previous].type is not TokenType.NEWLINE:
+        previous -= 1
+    scan_from = tokens[previous].start  # 0 for file_start
+
+    first_content = previous + 1
+    while tokens[first_content].type is TokenType.INDENT_DEDENT:
+        first_content += 1
+    scan_to = tokens[first_content].start
+
+    indent = 0
+    for match_object in _matches_between(source, scan_from, scan_to):
+        if match_object.lastgroup == "LINE":
+            indent = (match_object.end() - match_object.start() - 1) // 4
+    return indent
+
+
+def _matches_between(source: str, start: int, stop: int) -> Iterator[re.Match[str]]:
+    """
+    The regex matches from start up to stop or the first token with content
+    """
+    for match_object in TOKEN_REGEX.finditer(source, start):
+        if match_object.start() >= stop or (
+            match_object.lastgroup in _CONTENT_TOKEN_TYPES
+        ):
+            return
+        yield match_object
+
+
+def _shifted(t: Token, delta: int) -> Token:
+    if delta == 0:
+        return t
+    return Token(t.type, t.value, t.start + delta, t.end + delta)
+
+
+def _depth_change(t: Token) -> int:
+    if t.type is TokenType.INDENT_DEDENT:
+        return 1 if t.value == IndentType.INDENT else -1
+    return 0
@@ -0,0 +1,457 @@
+import hashlib
+import json
+import os
+import re
+import typing
+from collections.abc import Iterator
+from dataclasses import dataclass
+from functools import cache
+
+from ..utils.json_cache import load_or_build
+
+GENERATOR_VERSION: typing.Final = 1
+
+type TokenSpec = tuple[tuple[str, str, int], ...]
+"""
+Token patterns for longest-match scanning: (group name, pattern,
+trailing context). Earlier entries win ties.
+"""
+
+type CharSet = frozenset[int]
+"""
+Characters as atoms: code points below 128 stand for themselves,
+and OTHER_SPACE and OTHER stand for all the others
+"""
+
+ASCII_SIZE: typing.Final = 128
+OTHER_SPACE: typing.Final = ASCII_SIZE
+OTHER: typing.Final = ASCII_SIZE + 1
+ALL_ATOMS: typing.Final[CharSet] = frozenset(range(OTHER + 1))
+
+_SPACE_ATOMS: typing.Final[CharSet] = frozenset(
+    {c for c in range(ASCII_SIZE) if re.match(r"\s", chr(c))} | {OTHER_SPACE}
+)
+
+
+def atom_of(char: str) -> int:
+    code = ord(char)
+    if code < ASCII_SIZE:
+        return code
+    return OTHER_SPACE if re.match(r"\s", char) else OTHER
+
+
+# Regex syntax tree: ("set", CharSet) | ("seq", [...]) | ("alt", [...])
+# | ("star", node) | ("plus", node) | ("opt", node)
+type RegexNode = tuple[str, typing.Any]
+
+
+class _RegexParser:
+    """
+    Parses the small part of regex syntax that a TokenSpec may use
+    """
+
+    _ESCAPES: typing.Final = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v"}
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.pos = 0
+
+    def parse(self) -> RegexNode:
+        node = self._alt()
+        if self.pos != len(self.pattern):
+            raise ValueError(f"Unsupported regex syntax at {self.pos} in {self.pattern}")
+        return node
+
+    def _peek(self) -> str | None:
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def _take(self) -> str:
+        char = self.pattern[self.pos]
+        self.pos += 1
+        return char
+
+    def _alt(self) -> RegexNode:
+        branches = [self._seq()]
+        while self._peek() == "|":
+            self._take()
+            branches.append(self._seq())
+        return ("alt", branches) if len(branches) > 1 else branches[0]
+
+    def _seq(self) -> RegexNode:
+        items: list[RegexNode] = []
+        while self._peek() not in (None, "|", ")"):
+            item = self._atom()
+            match self._peek():
+                case "*":
+                    self._take()
+                    item = ("star", item)
+                case "+":
+                    self._take()
+                    item = ("plus", item)
+                case "?":
+                    self._take()
+                    item = ("opt", item)
+                case _:
+                    items.append(item)
+                    continue
+            if self._peek() == "?":
+                raise ValueError(f"Lazy quantifiers are not supported: {self.pattern}")
+            items.append(item)
+        return ("seq", items)
+
+    def _atom(self) -> RegexNode:
+        char = self._take()
+        match char:
+            case "(":
+                if self.pattern.startswith("?:", self.pos):
+                    self.pos += 2
+                else:
+                    raise ValueError(f"Only (?:...) groups are supported: {self.pattern}")
+                node = self._alt()
+                if self._take() != ")":
+                    raise ValueError(f"Unclosed group in {self.pattern}")
+                return node
+            case "[":
+                return ("set", self._class())
+            case ".":
+                return ("set", ALL_ATOMS - {ord("\n")})
+            case "^" | "$":
+                raise ValueError(f"Anchors are not supported: {self.pattern}")
+            case "\\":
+                return ("set", self._escape())
+            case _:
+                return ("set", frozenset({ord(char)}))
+
+    def _escape(self) -> CharSet:
+        char = self._take()
+        match char:
+            case "s":
+                return _SPACE_ATOMS
+            case "S":
+                return ALL_ATOMS - _SPACE_ATOMS
+            case "d":
+                return frozenset(range(ord("0"), ord("9") + 1))
+            case _:
+                return frozenset({ord(self._ESCAPES.get(char, char))})
+
+    def _class(self) -> CharSet:
+        negate = self._peek() == "^"
+        if negate:
+            self._take()
+        members: set[int] = set()
+        first = True
+        while first or self._peek() != "]":
+            first = False
+            char = self._take()
+            if char == "\\":
+                chars = self._escape()
+            else:
+                chars = frozenset({ord(char)})
+            if (
+                self._peek() == "-"
+                and self.pattern[self.pos + 1] != "]"
+                and len(chars) == 1
+            ):
+                self._take()
+                high = self._take()
+                (low,) = chars
+                chars = frozenset(range(low, ord(high) + 1))
+            members |= chars
+        self._take()  # ]
+        return ALL_ATOMS - members if negate else frozenset(members)
+
+
+@dataclass
+class _NFA:
+    epsilons: list[list[int]]
+    edges: list[list[tuple[CharSet, int]]]
+
+    def new_state(self) -> int:
+        self.epsilons.append([])
+        self.edges.append([])
+        return len(self.epsilons) - 1
+
+    def build(self, node: RegexNode, start: int) -> int:
+        """
+        Adds the node's states after start; returns the end state
+        """
+        match node:
+            case ("set", chars):
+                end = self.new_state()
+                self.edges[start].append((chars, end))
+                return end
+            case ("seq", items):
+                current = start
+                for item in items:
+                    current = self.build(item, current)
+                return current
+            case ("alt", branches):
+                end = self.new_state()
+                for branch in branches:
+                    branch_start = self.new_state()
+                    self.epsilons[start].append(branch_start)
+                    self.epsilons[self.build(branch, branch_start)].append(end)
+                return end
+            case ("star", inner):
+                loop = self.new_state()
+                self.epsilons[start].append(loop)
+                self.epsilons[self.build(inner, loop)].append(loop)
+                return loop
+            case ("plus", inner):
+                loop = self.new_state()
+                self.epsilons[start].append(loop)
+                inner_end = self.build(inner, loop)
+                self.epsilons[inner_end].append(loop)
+                return inner_end
+            case ("opt", inner):
+                end = self.build(inner, start)
+                self.epsilons[start].append(end)
+                return end
+            case _:
+                raise ValueError(f"Unknown regex node {node}")
+
+
+@dataclass(frozen=True)
+class LexerTables:
+    """
+    A DFA over character classes
+
+    State 0 is the start state. transitions[state * class_count + c] is
+    the next state on a character of class c, or -1. accepts[state] is
+    the spec entry matched on reaching the state, or -1.
+    """
+
+    atom_classes: tuple[int, ...]
+    """
+    Character class of each atom
+    """
+    class_count: int
+    transitions: tuple[int, ...]
+    accepts: tuple[int, ...]
+    names: tuple[str, ...]
+    trails: tuple[int, ...]
+
+    def class_of(self, char: str) -> int:
+        return self.atom_classes[atom_of(char)]
+
+
+def longest_match_spec(
+    tokens: tuple[tuple[str, str], ...],
+    rewrites: dict[str, tuple[tuple[str, int], ...]],
+) -> TokenSpec:
+    """
+    The (group name, pattern) pairs of a regex alternation as a
+    TokenSpec, with each pattern in rewrites replaced by its rewritten
+    entries and the others kept as they are
+
+    Raises ValueError if a rewrite is for a pattern that is not in the
+    tokens (it has gone stale), or if a kept pattern uses syntax that
+    longest-match scanning cannot express.
+    """
+
+    stale = rewrites.keys() - {pattern for _, pattern in tokens}
+    if stale:
+        raise ValueError(f"Rewrites for patterns not in the tokens: {sorted(stale)}")
+
+    spec: list[tuple[str, str, int]] = []
+    for name, pattern in tokens:
+        if pattern in rewrites:
+            spec.extend(
+                (name, rewritten, trail) for rewritten, trail in rewrites[pattern]
+            )
+        else:
+            _RegexParser(pattern).parse()
+            spec.append((name, pattern, 0))
+    return tuple(spec)
+
+
+def build_tables(spec: TokenSpec) -> LexerTables:
+    """
+    Compiles a token spec into a DFA by subset construction
+    """
+
+    nfa = _NFA([], [])
+    nfa_start = nfa.new_state()
+    nfa_accepts: dict[int, int] = {}
+    for entry, (_, pattern, _) in enumerate(spec):
+        entry_start = nfa.new_state()
+        nfa.epsilons[nfa_start].append(entry_start)
+        nfa_accepts[nfa.build(_RegexParser(pattern).parse(), entry_start)] = entry
+
+    # Atoms that no character set tells apart share a class
+    char_sets = sorted(
+        {chars for edges in nfa.edges for chars, _ in edges}, key=sorted
+    )
+    signatures: dict[tuple[bool, ...], int] = {}
+    atom_classes = tuple(
+        signatures.setdefault(
+            tuple(atom in chars for chars in char_sets), len(signatures)
+        )
+        for atom in range(OTHER + 1)
+    )
+    class_count = len(signatures)
+    class_atoms = [atom_classes.index(c) for c in range(class_count)]
+
+    def closure(states: typing.Iterable[int]) -> frozenset[int]:
+        stack = list(states)
+        seen = set(stack)
+        while stack:
+            for target in nfa.epsilons[stack.pop()]:
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return frozenset(seen)
+
+    start = closure((nfa_start,))
+    dfa_states: dict[frozenset[int], int] = {start: 0}
+    worklist = [start]
+    transitions: list[int] = []
+    accepts: list[int] = []
+
+    while worklist:
+        current = worklist.pop(0)
+        matched = [nfa_accepts[s] for s in current if s in nfa_accepts]
+        accepts.append(min(matched) if matched else -1)
+
+        for c in range(class_count):
+            atom = class_atoms[c]
+            moved = closure(
+                target
+                for s in current
+                for chars, target in nfa.edges[s]
+                if atom in chars
+            )
+            if not moved:
+                transitions.append(-1)
+                continue
+            if moved not in dfa_states:
+                dfa_states[moved] = len(dfa_states)
+                worklist.append(moved)
+            transitions.append(dfa_states[moved])
+
+    return LexerTables(
+        atom_classes,
+        class_count,
+        tuple(transitions),
+        tuple(accepts),
+        tuple(name for name, _, _ in spec),
+        tuple(trail for _, _, trail in spec),
+    )
+
+
+def spec_hash(spec: TokenSpec) -> str:
+    return hashlib.sha256(
+        json.dumps([GENERATOR_VERSION, spec]).encode()
+    ).hexdigest()[:16]
+
+
+CACHE_DIR: typing.Final = os.path.join(os.path.dirname(__file__), "__pycache__")
+
+
+@cache
+def load_tables(spec: TokenSpec) -> LexerTables:
+    """
+    The tables for the spec, from the on-disk cache when possible
+    """
+
+    return load_or_build(
+        os.path.join(CACHE_DIR, f"dfa_{spec_hash(spec)}.json"),
+        lambda: build_tables(spec),
+        lambda tables: {
+            "atom_classes": tables.atom_classes,
+            "class_count": tables.class_count,
+            "transitions": tables.transitions,
+            "accepts": tables.accepts,
+            "names": tables.names,
+            "trails": tables.trails,
+        },
+        lambda cached: LexerTables(
+            tuple(cached["atom_classes"]),
+            cached["class_count"],
+            tuple(cached["transitions"]),
+            tuple(cached["accepts"]),
+            tuple(cached["names"]),
+            tuple(cached["trails"]),
+        ),
+    )
+
+
+def dfa_scan(input: str, tables: LexerTables) -> Iterator[tuple[int, int, int]]:
+    """
+    Splits the input into (spec entry, start, end)
+    triples by longest match, as TOKEN_REGEX.finditer would
+
+    Dispatch is on integers only: the input is first turned into one
+    character class per character, then each token is a walk through
+    the transition table. That walk is a Python loop over characters,
+    so this is no faster than TOKEN_REGEX, whose loop is in C: the two
+    are within 10% of each other either way (see
+    tokenizer_benchmark_script). It is here to check the spec against
+    the regex, not to replace it.
+    """
+
+    class_count = tables.class_count
+    transitions = tables.transitions
+    accepts = tables.accepts
+    trails = tables.trails
+
+    classes = _class_codes(input, tables)
+    length = len(classes)
+    pos = 0
+
+    if length == 0:
+        yield (tables.names.index("LINE"), 0, 0)
+        return
+
+    while pos < length:
+        state = 0
+        i = pos
+        last_entry = -1
+        last_end = pos
+
+        while i < length:
+            state = transitions[state * class_count + classes[i]]
+            if state < 0:
+                break
+            i += 1
+            entry = accepts[state]
+            if entry >= 0:
+                last_entry = entry
+                last_end = i
+
+        if pos == 0 and _start_of_line_wins(tables, last_entry):
+            # TOKEN_REGEX's LINE also matches "^" plus spaces
+            spaces = len(input) - len(input.lstrip(" "))
+            yield (tables.names.index("LINE"), 0, spaces)
+            if spaces == 0:
+                # Like finditer, never match empty twice at one place
+                yield (last_entry, 0, last_end - trails[last_entry])
+                pos = last_end - trails[last_entry]
+            else:
+                pos = spaces
+            continue
+
+        end = last_end - trails[last_entry]
+        yield (last_entry, pos, end)
+        pos = end
+
+
+def _start_of_line_wins(tables: LexerTables, entry: int) -> bool:
+    """
+    Whether "^" (part of LINE) beats what was found at the very start
+    """
+    line_entry = tables.names.index("LINE")
+    return entry > line_entry
+
+
+def _class_codes(input: str, tables: LexerTables) -> bytes:
+    """
+    The character class of every character, as one byte each
+    """
+    atom_classes = tables.atom_classes
+    translation = {c: atom_classes[c] for c in range(ASCII_SIZE)}
+    if not input.isascii():
+        for char in set(input):
+            if ord(char) >= ASCII_SIZE:
+                translation[ord(char)] = atom_classes[atom_of(char)]
+    return input.translate(translation).encode("latin-1")
@@ -0,0 +1,56 @@
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Self
+
+from .chunked_source import TextSource, read_chunks
+
+
+@dataclass(frozen=True)
+class LineIndex:
+    """
+    The offset at which each line of a source starts, so that
+    offsets can be turned into lines and columns by binary search
+    instead of by rescanning the source
+    """
+
+    line_starts: array[int]
+
+    @classmethod
+    def of_source(cls, source: TextSource) -> Self:
+        if isinstance(source, str):
+            return cls.of_chunks((source,))
+        return cls.of_chunks(read_chunks(source))
+
+    @classmethod
+    def of_chunks(cls, chunks: Iterable[str]) -> Self:
+        line_starts = array("I", (0,))
+        base = 0
+        for chunk in chunks:
+            newline = chunk.find("\n")
+            while newline != -1:
+                line_starts.append(base + newline + 1)
+                newline = chunk.find("\n", newline + 1)
+            base += len(chunk)
+        return cls(line_starts)
+
+    def line_col(self, offset: int) -> tuple[int, int]:
+        """
+        The line (counting from 1) and column (counting from 0) of an offset
+        """
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1]
+
+    def offset_of(self, line: int, col: int) -> int:
+        """
+        Inverse of line_col
+        """
+        return self.line_starts[line - 1] + col
+
+    def describe(self, offset: int) -> str:
+        line, col = self.line_col(offset)
+        return f"line {line} col {col}"
+
+    def __len__(self) -> int:
+        return len(self.line_starts)
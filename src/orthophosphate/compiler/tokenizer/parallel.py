@@ -0,0 +1,276 @@
+import os
+import typing
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterable, Mapping
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+
+from .token_buffer import EOF_KIND, FILE_START_KIND, TokenBuffer
+from .Tokenizer import (
+    COLUMN_ZERO_LINE,
+    append_indents,
+    scan_columnar,
+    tokenize_columnar,
+)
+
+MIN_PIECE_SIZE: typing.Final = 1 << 16
+"""
+Sources are not cut into pieces smaller than this many characters,
+since below that starting a task costs more than it saves
+"""
+
+PIECES_PER_WORKER: typing.Final = 4
+"""
+More pieces than workers, so that a slow piece does not hold up the rest
+"""
+
+@dataclass(frozen=True)
+class _Piece:
+    """
+    What tokenizing from a boundary up to the next boundary gave
+
+    The tokens are as tokenize_columnar would give them for the piece
+    alone, without file_start and EOF. pending is the indentation change
+    not yet emitted at the end, and end is where the scan stopped, which
+    is past the planned stop if that was inside a string or comment.
+    start is where the scan started, which is past the planned start if
+    that was.
+    """
+
+    start: int
+    tokens: TokenBuffer
+    pending: int
+    end: int
+    error: AssertionError | ValueError | None
+
+
+def tokenize_parallel(
+    input: str, max_workers: int | None = None, piece_size: int | None = None
+) -> TokenBuffer:
+    """
+    tokenize_columnar, with the source cut at column-zero lines
+    and the pieces tokenized in a process pool
+
+    Each piece is tokenized as if it started at a real line boundary
+    with zero indentation. A piece whose planned start turns out to be
+    inside a string or comment is thrown away: the piece before it runs
+    on to the next real boundary, and the pieces are rejoined from there.
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    starts = plan_pieces(input, max_workers, piece_size)
+    if len(starts) == 1:
+        return tokenize_columnar(input)
+
+    with ProcessPoolExecutor(min(max_workers, len(starts))) as pool:
+        scanned = _submit(pool, [(input, starts)], len(input) // len(starts))
+        return _stitch(input, starts, scanned[0])
+
+
+def tokenize_files(
+    paths: Iterable[str],
+    max_workers: int | None = None,
+    piece_size: int | None = None,
+) -> dict[str, TokenBuffer]:
+    """
+    tokenize_columnar for every file, spread over a process pool
+
+    Each file is read once, here. Large files are cut into pieces as
+    in tokenize_parallel, small ones are sent a few to a task, and each
+    task is sent only the text of its own pieces.
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    sources: dict[str, str] = {}
+    for path in paths:
+        with open(path) as file:
+            sources[path] = file.read()
+
+    total = sum(len(source) for source in sources.values())
+    if piece_size is None:
+        piece_size = max(MIN_PIECE_SIZE, total // (max_workers * PIECES_PER_WORKER))
+    plans = [
+        (source, plan_pieces(source, max_workers, piece_size))
+        for source in sources.values()
+    ]
+
+    with ProcessPoolExecutor(max_workers) as pool:
+        scanned = _submit(pool, plans, piece_size)
+        return {
+            path: _stitch(source, starts, pieces)
+            for path, (source, starts), pieces in zip(sources, plans, scanned)
+        }
+
+
+def plan_pieces(
+    input: str, max_workers: int, piece_size: int | None = None
+) -> list[int]:
+    """
+    Where the pieces of the source start: 0, then the first
+    column-zero line after each multiple of piece_size
+    """
+
+    if piece_size is None:
+        piece_size = max(
+            MIN_PIECE_SIZE, len(input) // (max_workers * PIECES_PER_WORKER)
+        )
+
+    starts = [0]
+    target = piece_size
+    while target < len(input):
+        match_object = COLUMN_ZERO_LINE.search(input, target)
+        if match_object is None:
+            break
+        starts.append(match_object.end())
+        target = match_object.end() + piece_size
+    return starts
+
+
+type _Scanned = Mapping[int, tuple[Future[list[_Piece | None]], int]]
+"""
+Where to find the piece for each planned start: a task, and the index
+of the piece among those it scanned
+"""
+
+
+def _submit(
+    pool: ProcessPoolExecutor,
+    plans: list[tuple[str, list[int]]],
+    batch_size: int,
+) -> list[_Scanned]:
+    """
+    Sends the pieces of each source, as planned, to the pool, in tasks
+    of about batch_size characters, and gives where to find each
+    source's pieces
+
+    Each piece is sent as a slice of its source running one line past
+    its stop, and one character more for COLUMN_ZERO_LINE to look at,
+    so that it can run on to the next boundary if the planned one
+    turns out not to be real.
+    """
+
+    scanned: list[dict[int, tuple[Future[list[_Piece | None]], int]]] = []
+    batch: list[tuple[str, int, int | None]] = []
+    batch_starts: list[tuple[int, int]] = []  # Source and start of each
+    batch_length = 0
+
+    def send() -> None:
+        nonlocal batch, batch_starts, batch_length
+        future = pool.submit(_scan_slices, batch)
+        for index, (source, start) in enumerate(batch_starts):
+            scanned[source][start] = (future, index)
+        batch, batch_starts, batch_length = [], [], 0
+
+    for source, (input, starts) in enumerate(plans):
+        scanned.append({})
+        for start, stop in zip(starts, starts[1:] + [len(input)]):
+            following = COLUMN_ZERO_LINE.search(input, stop)
+            if stop == len(input) or following is None:
+                batch.append((input[start:], start, None))
+            else:
+                text = input[start : following.end() + 1]
+                batch.append((text, start, stop - start))
+            batch_starts.append((source, start))
+            batch_length += stop - start
+            if batch_length >= batch_size:
+                send()
+    if batch:
+        send()
+    return scanned
+
+
+def _stitch(input: str, starts: list[int], scanned: _Scanned) -> TokenBuffer:
+    """
+    Joins the pieces that start where the one before them ended,
+    tokenizing here whatever the pool could not
+    """
+
+    buffer = TokenBuffer(input)
+    buffer.append(FILE_START_KIND, 0, 0)
+    pending = 0
+
+    pos = 0
+    while True:
+        # The piece planned to cover pos, which may have started late
+        index = bisect_right(starts, pos) - 1
+        future, at = scanned[starts[index]]
+        piece = future.result()[at]
+        if piece is None or piece.start != pos:
+            stop = starts[index + 1] if index + 1 < len(starts) else len(input)
+            piece = _scan_piece(input, pos, stop)
+
+        if piece.error is not None:
+            raise piece.error
+
+        tokens = piece.tokens
+        if len(tokens):
+            # A piece starts with the content of a column-zero line,
+            # which is where the indentation carried over goes
+            append_indents(buffer, pending, tokens.starts[0])
+            pending = 0
+            buffer.kinds.extend(tokens.kinds)
+            buffer.starts.extend(tokens.starts)
+            buffer.ends.extend(tokens.ends)
+        pending += piece.pending
+
+        pos = piece.end
+        if pos >= len(input):
+            break
+
+    last_end = buffer.ends[-1]
+    append_indents(buffer, pending, last_end)
+    buffer.append(EOF_KIND, last_end, last_end)
+    return buffer
+
+
+def _scan_piece(input: str, start: int, stop: int) -> _Piece:
+    """
+    scan_columnar from start up to the first column-zero line at
+    or after stop, with errors handed back rather than raised, since
+    they only count if the piece is kept
+    """
+
+    # The source stays with the caller; only the token arrays go back
+    tokens = TokenBuffer("")
+    try:
+        pending, end = scan_columnar(input, tokens, start, stop)
+    except (AssertionError, ValueError) as e:
+        return _Piece(start, tokens, 0, len(input), e)
+    return _Piece(start, tokens, pending, end, None)
+
+
+def _scan_slices(slices: list[tuple[str, int, int | None]]) -> list[_Piece | None]:
+    """
+    The pieces for the slices of sources a task was sent, each with
+    where in its source it starts and its stop, if it does not run to
+    the end of the source
+
+    A slice that has an error in it is scanned again from its next
+    column-zero line, in case its start was not a real boundary. One
+    that still has an error, or does not reach a boundary at or after
+    its stop, gives None, so that the caller scans it with the rest of
+    the source to hand.
+    """
+
+    pieces: list[_Piece | None] = []
+    for text, base, stop in slices:
+        piece = _scan_piece(text, 0, len(text) if stop is None else stop)
+        if piece.error is not None:
+            following = COLUMN_ZERO_LINE.search(text)
+            if following is not None and (stop is None or following.end() <= stop):
+                piece = _scan_piece(
+                    text, following.end(), len(text) if stop is None else stop
+                )
+        if piece.error is not None or (stop is not None and piece.end == len(text)):
+            pieces.append(None)
+            continue
+
+        tokens = piece.tokens
+        if base:
+            tokens.starts = array("I", [offset + base for offset in tokens.starts])
+            tokens.ends = array("I", [offset + base for offset in tokens.ends])
+        pieces.append(
+            _Piece(base + piece.start, tokens, piece.pending, base + piece.end, None)
+        )
+    return pieces
@@ -19,10 +19,23 @@ class IndentType(enum.StrEnum):
     DEDENT = enum.auto()
 
 
-@dataclass(frozen=True, eq=False)
+@dataclass(frozen=True, eq=False, slots=True)
 class Token:
     type: TokenType
     value: str
+    start: int = 0
+    """
+    Offset of the first character of the token in its source
+    """
+    end: int = 0
+    """
+    Offset just past the last character of the token
+
+    Tokens without text of their own are zero-width: file_start at 0,
+    indents and dedents at the start of the token after them, and the
+    dedents at the end of the source and EOF at the end of the last
+    token, before any blank lines or comments that follow it.
+    """
 
     def matches(self, type: TokenType, value: str) -> bool:
         return self.type == type and self.value == value
@@ -0,0 +1,154 @@
+from array import array
+from collections.abc import Iterator, Sequence
+import typing
+
+from .token import IndentType, Token, TokenType
+
+VALUE_TYPES: typing.Final = (TokenType.NAME, TokenType.INT, TokenType.STR)
+"""
+Token types whose value is a slice of the source. A token of one of
+these types is stored in a TokenBuffer as its index in this tuple.
+"""
+
+NEWLINE_TOKEN: typing.Final = Token(TokenType.NEWLINE, "")
+INDENT_TOKEN: typing.Final = Token(TokenType.INDENT_DEDENT, IndentType.INDENT)
+DEDENT_TOKEN: typing.Final = Token(TokenType.INDENT_DEDENT, IndentType.DEDENT)
+FILE_START_TOKEN: typing.Final = Token(TokenType.PUNC, "file_start")
+EOF_TOKEN: typing.Final = Token(TokenType.PUNC, "EOF")
+
+FIXED_TOKENS: typing.Final = (
+    NEWLINE_TOKEN,
+    INDENT_TOKEN,
+    DEDENT_TOKEN,
+    FILE_START_TOKEN,
+    EOF_TOKEN,
+    *(
+        Token(TokenType.PUNC, punc)
+        for punc in (";", "(", ")", "{", "}", "[", "]", "->")
+    ),
+)
+"""
+Tokens whose type and value are always the same. These are stored as
+len(VALUE_TYPES) plus their index in this tuple.
+
+They are read back as TokenViews like the rest, not as these
+instances, since each has a span of its own. A view is two slots
+and is freed as soon as the parser moves past it, so what a token
+costs to keep is still the nine bytes of its columns.
+"""
+
+FIXED_KIND_BASE: typing.Final = len(VALUE_TYPES)
+
+NAME_KIND: typing.Final = VALUE_TYPES.index(TokenType.NAME)
+INT_KIND: typing.Final = VALUE_TYPES.index(TokenType.INT)
+STR_KIND: typing.Final = VALUE_TYPES.index(TokenType.STR)
+NEWLINE_KIND: typing.Final = FIXED_KIND_BASE + FIXED_TOKENS.index(NEWLINE_TOKEN)
+INDENT_KIND: typing.Final = FIXED_KIND_BASE + FIXED_TOKENS.index(INDENT_TOKEN)
+DEDENT_KIND: typing.Final = FIXED_KIND_BASE + FIXED_TOKENS.index(DEDENT_TOKEN)
+FILE_START_KIND: typing.Final = FIXED_KIND_BASE + FIXED_TOKENS.index(FILE_START_TOKEN)
+EOF_KIND: typing.Final = FIXED_KIND_BASE + FIXED_TOKENS.index(EOF_TOKEN)
+
+KIND_TYPES: typing.Final = (
+    *VALUE_TYPES,
+    *(token.type for token in FIXED_TOKENS),
+)
+"""
+The type of the tokens of each kind
+"""
+
+PUNC_KINDS: typing.Final = {
+    token.value: FIXED_KIND_BASE + i
+    for i, token in enumerate(FIXED_TOKENS)
+    if token.type is TokenType.PUNC
+}
+
+
+class TokenBuffer(Sequence[Token]):
+    """
+    A compact token sequence: one byte for the kind of each token
+    and two unsigned ints for where it starts and ends in the source
+
+    Indexing gives a TokenView, which reads its type, value and span
+    out of the buffer, so the parser can take a TokenBuffer anywhere
+    it takes a tuple of Tokens.
+
+    A buffer may hold only part of a source, starting at offset in it,
+    with its spans still in the offsets of the whole source.
+    """
+
+    __slots__ = ("source", "offset", "kinds", "starts", "ends")
+
+    def __init__(self, source: str, offset: int = 0) -> None:
+        self.source = source
+        self.offset = offset
+        self.kinds = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def append(self, kind: int, start: int, end: int) -> None:
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @typing.overload
+    def __getitem__(self, index: int) -> Token: ...
+    @typing.overload
+    def __getitem__(self, index: slice) -> tuple[Token, ...]: ...
+
+    def __getitem__(self, index: int | slice) -> Token | tuple[Token, ...]:
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(*index.indices(len(self))))
+
+        return TokenView(self, index if index >= 0 else index + len(self))
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.kinds)):
+            yield TokenView(self, index)
+
+    def value_at(self, index: int) -> str:
+        kind = self.kinds[index]
+        if kind >= FIXED_KIND_BASE:
+            return FIXED_TOKENS[kind - FIXED_KIND_BASE].value
+        offset = self.offset
+        return self.source[self.starts[index] - offset : self.ends[index] - offset]
+
+    def span_at(self, index: int) -> tuple[int, int]:
+        return self.starts[index], self.ends[index]
+
+    def __repr__(self) -> str:
+        return f"TokenBuffer({len(self)} tokens)"
+
+
+class TokenView(Token):
+    """
+    A token that reads its type, value and span
+    out of a TokenBuffer when asked for them
+    """
+
+    __slots__ = ("_buffer", "_index")
+
+    _buffer: TokenBuffer
+    _index: int
+
+    def __init__(self, buffer: TokenBuffer, index: int) -> None:
+        object.__setattr__(self, "_buffer", buffer)
+        object.__setattr__(self, "_index", index)
+
+    @property
+    def type(self) -> TokenType:  # type: ignore ; Overrides a dataclass field
+        return KIND_TYPES[self._buffer.kinds[self._index]]
+
+    @property
+    def value(self) -> str:  # type: ignore ; Overrides a dataclass field
+        return self._buffer.value_at(self._index)
+
+    @property
+    def start(self) -> int:  # type: ignore ; Overrides a dataclass field
+        return self._buffer.starts[self._index]
+
+    @property
+    def end(self) -> int:  # type: ignore ; Overrides a dataclass field
+        return self._buffer.ends[self._index]
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import dataclass, field
+from weakref import ref
+
+
+@dataclass
+class BoundedCache[K, V]:
+    """
+    A least-recently-used cache of at most maxsize entries
+    that counts how often it is asked for a key it has
+
+    Unlike functools.cache, what is in it does not stay alive
+    for the life of the process.
+    """
+
+    maxsize: int
+    hits: int = 0
+    misses: int = 0
+    _entries: OrderedDict[K, V] = field(default_factory=OrderedDict, repr=False)
+
+    def get(self, key: K) -> V | None:
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = 0
+
+    def stats_report(self) -> str:
+        return (
+            f"{len(self)}/{self.maxsize} entries"
+            f" {self.hits:>8} hits {self.misses:>8} misses"
+        )
+
+
+@dataclass
+class WeakKeyBoundedCache[K, V]:
+    """
+    A BoundedCache of values for objects, and optionally a tag with
+    each, that refers to the objects weakly, so that being in the
+    cache does not keep them alive
+
+    Entries are by id(key), with a weak reference to check the key
+    against, since a dead object's id can be taken by a new one. An
+    entry whose key has died is never hit, and falls out as the cache
+    fills.
+    """
+
+    maxsize: int
+    _cache: BoundedCache[tuple[int, Hashable], tuple[ref[K], V]] = field(
+        init=False, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        self._cache = BoundedCache(self.maxsize)
+
+    def get(self, key: K, tag: Hashable = None) -> V | None:
+        entry = self._cache.get((id(key), tag))
+        if entry is None:
+            return None
+        key_ref, value = entry
+        if key_ref() is not key:
+            self._cache.hits -= 1
+            self._cache.misses += 1
+            return None
+        return value
+
+    def put(self, key: K, value: V, tag: Hashable = None) -> None:
+        self._cache.put((id(key), tag), (ref(key), value))
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def reset_stats(self) -> None:
+        self._cache.reset_stats()
+
+    def stats_report(self) -> str:
+        return self._cache.stats_report()
@@ -1,22 +1,280 @@
-from collections.abc import Mapping
-from dataclasses import dataclass, field
+import typing
+from collections.abc import Iterable, Iterator, Mapping
 from typing import Self
 
+_BITS: typing.Final = 5
+_MASK: typing.Final = (1 << _BITS) - 1
+_HASH_BITS: typing.Final = 64
+_HASH_MASK: typing.Final = (1 << _HASH_BITS) - 1
+
+_MISSING: typing.Final = object()
+
+
+class _Node:
+    """
+    One level of the trie: which of the 32 branches for the next five
+    bits of the hash are taken, and what is on each, in order
+
+    An entry is a (key, value) tuple, or a node for the keys whose
+    hashes share those bits too. A node belongs to the builder that
+    made it, if any, which may change it in place; anything else
+    copies the path to what it changes.
+    """
+
+    __slots__ = ("bitmap", "entries", "owner")
+
+    def __init__(
+        self, bitmap: int, entries: list[typing.Any], owner: object | None
+    ) -> None:
+        self.bitmap = bitmap
+        self.entries = entries
+        self.owner = owner
+
+
+class _Collisions:
+    """
+    Every entry whose key has the same full hash, once the hash has
+    no bits left to tell them apart
+    """
+
+    __slots__ = ("hash", "entries")
+
+    def __init__(
+        self, hash: int, entries: list[tuple[typing.Any, typing.Any]]
+    ) -> None:
+        self.hash = hash
+        self.entries = entries
+
+
+def _leaf_node(
+    shift: int,
+    entry: tuple[typing.Any, typing.Any],
+    h: int,
+    other: tuple[typing.Any, typing.Any],
+    other_h: int,
+    owner: object | None,
+) -> "_Node | _Collisions":
+    """
+    The smallest subtree at shift holding the two entries
+    """
+    if shift >= _HASH_BITS:
+        return _Collisions(h, [other, entry])
+
+    branch = (h >> shift) & _MASK
+    other_branch = (other_h >> shift) & _MASK
+    if branch == other_branch:
+        child = _leaf_node(shift + _BITS, entry, h, other, other_h, owner)
+        return _Node(1 << branch, [child], owner)
+    entries = [entry, other] if branch < other_branch else [other, entry]
+    return _Node((1 << branch) | (1 << other_branch), entries, owner)
+
+
+def _assoc(
+    node: "_Node | _Collisions",
+    shift: int,
+    h: int,
+    key: typing.Any,
+    value: typing.Any,
+    owner: object | None,
+) -> "tuple[_Node | _Collisions, bool]":
+    """
+    The node with key set to value, and whether key is new
+
+    Changes node in place if owner owns it, and copies it otherwise.
+    """
+
+    if type(node) is _Collisions:
+        entries = list(node.entries)
+        for i, (k, _) in enumerate(entries):
+            if k is key or k == key:
+                entries[i] = (key, value)
+                return _Collisions(h, entries), False
+        entries.append((key, value))
+        return _Collisions(h, entries), True
+
+    node = typing.cast(_Node, node)
+    bit = 1 << ((h >> shift) & _MASK)
+    index = (node.bitmap & (bit - 1)).bit_count()
+    if node.owner is owner and owner is not None:
+        edited = node
+    else:
+        edited = _Node(node.bitmap, list(node.entries), owner)
+
+    if not node.bitmap & bit:
+        edited.bitmap |= bit
+        edited.entries.insert(index, (key, value))
+        return edited, True
+
+    entry = node.entries[index]
+    if type(entry) is tuple:
+        k = entry[0]
+        if k is key or k == key:
+            if entry[1] is value:
+                return node, False
+            edited.entries[index] = (key, value)
+            return edited, False
+        edited.entries[index] = _leaf_node(
+            shift + _BITS, (key, value), h, entry, hash(k) & _HASH_MASK, owner
+        )
+        return edited, True
+
+    child, added = _assoc(entry, shift + _BITS, h, key, value, owner)
+    if child is entry:
+        return node, added
+    edited.entries[index] = child
+    return edited, added
+
 
-@dataclass
 class COWDict[K, V](Mapping[K, V]):
-    _dict: dict[K, V] = field(default_factory=dict[K, V])
+    """
+    An immutable mapping, where set gives a new one with one more
+    or one changed binding
 
-    def __getitem__(self, key: K):
-        return self._dict[key]
+    It is a persistent hash array mapped trie: set copies only the
+    path of nodes down to the key, O(log n) of them, and the new
+    mapping shares everything else with the old. Many bindings are
+    best added at once with update, or with a builder.
+    """
 
-    def __iter__(self):
-        return iter(self._dict)
+    __slots__ = ("_root", "_len")
 
-    def __len__(self):
-        return len(self._dict)
+    def __init__(self, items: Mapping[K, V] | Iterable[tuple[K, V]] = ()) -> None:
+        self._root: _Node | None = None
+        self._len = 0
+        if items:
+            built = COWDictBuilder(self)
+            built.update(items)
+            self._root, self._len = built._root, built._len
+
+    @classmethod
+    def _of(cls, root: _Node | None, length: int) -> Self:
+        new = cls.__new__(cls)
+        new._root = root
+        new._len = length
+        return new
+
+    def _find(self, key: object) -> typing.Any:
+        node: typing.Any = self._root
+        if node is None:
+            return _MISSING
+        h = hash(key) & _HASH_MASK
+        shift = 0
+        while True:
+            if type(node) is _Collisions:
+                for k, v in node.entries:
+                    if k is key or k == key:
+                        return v
+                return _MISSING
+            bit = 1 << ((h >> shift) & _MASK)
+            bitmap = node.bitmap
+            if not bitmap & bit:
+                return _MISSING
+            entry = node.entries[(bitmap & (bit - 1)).bit_count()]
+            if type(entry) is tuple:
+                k = entry[0]
+                return entry[1] if k is key or k == key else _MISSING
+            node = entry
+            shift += _BITS
+
+    def __getitem__(self, key: K) -> V:
+        value = self._find(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: K, default: typing.Any = None) -> typing.Any:
+        value = self._find(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key: object) -> bool:
+        return self._find(key) is not _MISSING
+
+    def __iter__(self) -> Iterator[K]:
+        for key, _ in _entries(self._root):
+            yield key
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(_entries(self._root))!r})"
 
     def set(self, k: K, v: V) -> Self:
-        copy = self._dict.copy()
-        copy[k] = v
-        return type(self)(copy)
+        h = hash(k) & _HASH_MASK
+        if self._root is None:
+            return self._of(_Node(1 << (h & _MASK), [(k, v)], None), 1)
+        root, added = _assoc(self._root, 0, h, k, v, None)
+        if root is self._root:
+            return self
+        return self._of(typing.cast(_Node, root), self._len + added)
+
+    def update(self, items: Mapping[K, V] | Iterable[tuple[K, V]]) -> Self:
+        """
+        A new mapping with all of items set, changing
+        the nodes it copies in place as it goes
+        """
+        built = COWDictBuilder(self)
+        built.update(items)
+        return built.persistent()
+
+    def transient(self) -> "COWDictBuilder[K, V]":
+        return COWDictBuilder(self)
+
+
+class COWDictBuilder[K, V]:
+    """
+    Sets bindings in place, starting from a COWDict, for building
+    a new one out of many bindings at once
+
+    Nodes the builder copies are its own, so each is only copied
+    once however many keys under it are set; those of the COWDict
+    it started from are left as they are.
+    """
+
+    __slots__ = ("_root", "_len", "_owner")
+
+    def __init__(self, start: COWDict[K, V] | None = None) -> None:
+        self._root: _Node | None = None if start is None else start._root
+        self._len = 0 if start is None else start._len
+        self._owner: object | None = object()
+
+    def __setitem__(self, k: K, v: V) -> None:
+        if self._owner is None:
+            raise ValueError("Builder used after persistent()")
+        h = hash(k) & _HASH_MASK
+        if self._root is None:
+            self._root = _Node(1 << (h & _MASK), [(k, v)], self._owner)
+            self._len = 1
+            return
+        root, added = _assoc(self._root, 0, h, k, v, self._owner)
+        self._root = typing.cast(_Node, root)
+        self._len += added
+
+    def update(self, items: Mapping[K, V] | Iterable[tuple[K, V]]) -> None:
+        pairs = items.items() if isinstance(items, Mapping) else items
+        for k, v in pairs:
+            self[k] = v
+
+    def __len__(self) -> int:
+        return self._len
+
+    def persistent(self) -> COWDict[K, V]:
+        """
+        The COWDict built; the builder cannot be used after, since
+        its nodes are now shared
+        """
+        self._owner = None
+        return COWDict._of(self._root, self._len)
+
+
+def _entries(root: _Node | None) -> Iterator[tuple[typing.Any, typing.Any]]:
+    if root is None:
+        return
+    stack: list[typing.Any] = [root]
+    while stack:
+        node = stack.pop()
+        for entry in reversed(node.entries):
+            if type(entry) is tuple:
+                yield entry
+            else:
+                stack.append(entry)
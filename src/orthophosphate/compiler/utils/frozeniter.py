@@ -1,67 +1,131 @@
+import typing
 from collections.abc import Iterable, Iterator
+from itertools import islice
 from typing import overload
 
-from .lazy_value import Lazy, lazy_of
+CHUNK_SIZE: typing.Final = 1024
+"""
+How many elements are pulled from the source iterator at a time
+"""
 
-type FrozenIter[T] = IterCons[T] | None
 
-type IterCons[T] = tuple[T, Lazy[FrozenIter[T]]]
+class Chunk[T]:
+    """
+    A block of elements pulled from a source iterator, and
+    the next block, pulled the first time it is asked for
+
+    Chunks only refer forward, so those before the earliest
+    position still held are freed.
+    """
+
+    __slots__ = ("items", "_source", "_next")
+
+    def __init__(self, items: list[T], source: Iterator[T] | None) -> None:
+        self.items = items
+        self._source = source
+        self._next: Chunk[T] | None = None
+
+    @classmethod
+    def pull(cls, source: Iterator[T], size: int) -> "Chunk[T] | None":
+        items = list(islice(source, size))
+        if not items:
+            return None
+        return cls(items, source if len(items) == size else None)
+
+    def unpulled(self) -> bool:
+        """
+        Whether the next chunk is still to be pulled
+
+        WARNING: Not a pure function
+        """
+        return self._source is not None
+
+    def next_chunk(self) -> "Chunk[T] | None":
+        if self._source is not None:
+            self._next = Chunk.pull(self._source, len(self.items))
+            self._source = None
+        return self._next
+
+
+type FrozenIter[T] = tuple[Chunk[T], int] | None
+"""
+A position in a stream of elements: a chunk and an index into it,
+or None past the end. Positions are immutable, and each can be
+gone back to any number of times.
+"""
 
 
 def next_frozen[T](frozeniter: FrozenIter[T]) -> FrozenIter[T]:
-    match frozeniter:
-        case (_, next_lazy):
-            return next_lazy()
-        case None:
-            raise ValueError(f"Attempted to get next of zero-length FrozenIter")
+    if frozeniter is None:
+        raise ValueError(f"Attempted to get next of zero-length FrozenIter")
+    chunk, index = frozeniter
+    if index + 1 < len(chunk.items):
+        return (chunk, index + 1)
+    following = chunk.next_chunk()
+    return None if following is None else (following, 0)
 
 
 @overload
 def get(frozeniter: None) -> None: ...
 @overload
-def get[T](frozeniter: tuple[T, Lazy[FrozenIter[T]]]) -> T: ...
+def get[T](frozeniter: tuple[Chunk[T], int]) -> T: ...
 
 
 def get[T](frozeniter: FrozenIter[T]) -> T | None:
-    match frozeniter:
-        case (v, _):
-            return v
-        case None:
-            return None
+    if frozeniter is None:
+        return None
+    chunk, index = frozeniter
+    return chunk.items[index]
 
 
-def frozeniter_of_iter[T](iterable: Iterable[T]) -> FrozenIter[T]:
-
-    iterator = iter(iterable)
-
-    def _supply_next() -> FrozenIter[T]:
-        try:
-            v = next(iterator)
-        except StopIteration:
-            return None
-        return (v, lazy_of(_supply_next))
+def frozeniter_of_iter[T](
+    iterable: Iterable[T], chunk_size: int = CHUNK_SIZE
+) -> FrozenIter[T]:
+    """
+    The position of the first element of iterable
 
-    return _supply_next()
+    Elements are pulled chunk_size at a time, the first chunk
+    right away, so the iterable is read ahead of the positions
+    taken by up to that many elements.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"Chunk size must be positive, not {chunk_size}")
+    first = Chunk.pull(iter(iterable), chunk_size)
+    return None if first is None else (first, 0)
 
 
 def iter_of_frozeniter[T](frozeniter: FrozenIter[T]) -> Iterator[T]:
-    next: FrozenIter[T] = frozeniter
-    while isinstance(next, tuple):
-        yield next[0]
-        next = next[1]()
+    if frozeniter is None:
+        return
+    chunk: Chunk[T] | None
+    chunk, index = frozeniter
+    yield from islice(chunk.items, index, None)
+    chunk = chunk.next_chunk()
+    while chunk is not None:
+        yield from chunk.items
+        chunk = chunk.next_chunk()
 
 
 def display[T](
     frozeniter: FrozenIter[T], maxsize: int = 10, open_lazies: int = 1
 ) -> str:
-    if maxsize <= 0:
-        return "..."
-    match frozeniter:
-        case None:
-            return "NIL"
-        case (item, next_lazy) as cons:
-            if next_lazy.unevaluated() and open_lazies <= 0:
-                return "... (Unevaluated)"
-            return (
-                f"{item} : {display(next_frozen(cons), maxsize - 1, open_lazies - 1)}"
-            )
+    """
+    The elements from frozeniter on, up to maxsize of them,
+    pulling at most open_lazies more chunks to show them
+    """
+    out: list[str] = []
+    position = frozeniter
+    while position is not None:
+        if len(out) >= maxsize:
+            out.append("...")
+            return " : ".join(out)
+        chunk, index = position
+        if index + 1 == len(chunk.items) and chunk.unpulled():
+            if open_lazies <= 0:
+                out.append(f"{chunk.items[index]} : ... (Unevaluated)")
+                return " : ".join(out)
+            open_lazies -= 1
+        out.append(str(chunk.items[index]))
+        position = next_frozen(position)
+    out.append("NIL")
+    return " : ".join(out)
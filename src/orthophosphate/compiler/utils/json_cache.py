@@ -0,0 +1,35 @@
+import json
+import os
+import typing
+from collections.abc import Callable
+
+
+def load_or_build[T](
+    cache_path: str,
+    build: Callable[[], T],
+    to_json: Callable[[T], typing.Any],
+    of_json: Callable[[typing.Any], T],
+) -> T:
+    """
+    What build gives, kept as JSON at cache_path so that it is only
+    built once
+
+    cache_path should be named by a hash of whatever the result
+    depends on. A cache file that cannot be read, or that of_json
+    cannot make sense of, is built over.
+    """
+
+    try:
+        with open(cache_path) as file:
+            return of_json(json.load(file))
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    result = build()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as file:
+            json.dump(to_json(result), file)
+    except OSError:
+        pass  # Only a cache
+    return result
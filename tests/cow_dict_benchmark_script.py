@@ -0,0 +1,95 @@
+"""
+Compares COWDict with a mapping that copies every binding on set,
+as COWDict used to: time to bind each of n names one by one and all
+at once, and the memory taken by every version kept along the way
+
+Run from the repo root: python tests/cow_dict_benchmark_script.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+
+OPO4_PATH = os.path.join(
+    os.path.abspath(""),  # Repo
+    "src",  # src
+    "orthophosphate",  # orthophosphate dir in src
+)
+
+sys.path.insert(0, OPO4_PATH)
+
+from compiler.utils.copy_on_write_dict import COWDict  # type: ignore
+
+SIZES = (1_000, 10_000, 100_000)
+
+COPYING_LIMIT = 20_000
+"""
+The copying mapping takes quadratic time and memory,
+so is not run on anything bigger
+"""
+
+
+class CopyingDict[K, V]:
+    def __init__(self, d: dict[K, V] | None = None) -> None:
+        self._dict = {} if d is None else d
+
+    def set(self, k: K, v: V) -> "CopyingDict[K, V]":
+        copy = self._dict.copy()
+        copy[k] = v
+        return CopyingDict(copy)
+
+
+def measure(build: Callable[[], object]) -> tuple[float, int]:
+    """
+    Seconds taken by build, and bytes held by what it returns, traced
+    in a second run as tracing slows it down
+    """
+    start = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    kept = build()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return seconds, held
+
+
+def one_by_one(empty: object, names: list[str], keep: bool) -> Callable[[], object]:
+    def build() -> object:
+        versions = []
+        current = empty
+        for i, name in enumerate(names):
+            current = current.set(name, i)  # type: ignore[attr-defined]
+            if keep:
+                versions.append(current)
+        return versions if keep else current
+
+    return build
+
+
+def report(n: int) -> None:
+    names = [f"name_{i}" for i in range(n)]
+    cases: list[tuple[str, Callable[[], object]]] = [
+        ("COWDict.set", one_by_one(COWDict(), names, keep=False)),
+        ("COWDict.set, every version", one_by_one(COWDict(), names, keep=True)),
+        ("COWDict.update", lambda: COWDict().update(zip(names, range(n)))),
+    ]
+    if n <= COPYING_LIMIT:
+        cases += [
+            ("copying set", one_by_one(CopyingDict(), names, keep=False)),
+            ("copying, every version", one_by_one(CopyingDict(), names, keep=True)),
+        ]
+
+    print(f"{n} bindings")
+    for name, build in cases:
+        seconds, held = measure(build)
+        print(f"    {name:<28} {seconds * 1000:10.1f} ms {held / 2**20:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        report(size)
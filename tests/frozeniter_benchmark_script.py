@@ -0,0 +1,111 @@
+"""
+Compares the chunked FrozenIter with one built of a cons cell and a
+Lazy per element, as it used to be: time to walk the tokens of a
+large synthetic source, looking a few tokens ahead and backtracking
+at each, and the memory held by keeping the first position
+
+Run from the repo root: python tests/frozeniter_benchmark_script.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable
+
+OPO4_PATH = os.path.join(
+    os.path.abspath(""),  # Repo
+    "src",  # src
+    "orthophosphate",  # orthophosphate dir in src
+)
+
+sys.path.insert(0, OPO4_PATH)
+
+from compiler.tokenizer import Tokenizer as tokenizer  # type: ignore
+from compiler.utils import frozeniter  # type: ignore
+from compiler.utils.lazy_value import lazy_of  # type: ignore
+from synthetic_corpus import generate_source
+
+SIZES = (20_000, 100_000)
+
+LOOKAHEAD = 3
+
+
+def lazy_cons_of_iter(iterable: Iterable[object]) -> object:
+    iterator = iter(iterable)
+
+    def supply_next() -> object:
+        try:
+            v = next(iterator)
+        except StopIteration:
+            return None
+        return (v, lazy_of(supply_next))
+
+    return supply_next()
+
+
+def lazy_cons_next(cons: object) -> object:
+    return cons[1]()  # type: ignore[index]
+
+
+def walk(
+    start: object, next_position: Callable[[object], object]
+) -> Callable[[], object]:
+    """
+    Steps through every position, looking LOOKAHEAD positions
+    ahead of each then going back to it, as a parser might
+    """
+
+    def run() -> object:
+        position = start
+        while position is not None:
+            ahead = position
+            for _ in range(LOOKAHEAD):
+                if ahead is None:
+                    break
+                ahead = next_position(ahead)
+            position = next_position(position)
+        return start
+
+    return run
+
+
+def held_bytes(build: Callable[[], object]) -> int:
+    """
+    Bytes held by what build returns
+    """
+    tracemalloc.start()
+    kept = build()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return held
+
+
+def timed(build: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    build()
+    return time.perf_counter() - start
+
+
+def report(blocks: int) -> None:
+    tokens = tokenizer.tokenize(generate_source(blocks))
+    print(f"{blocks} blocks, {len(tokens)} tokens")
+    cases = [
+        (
+            "chunked",
+            lambda: frozeniter.frozeniter_of_iter(tokens),
+            frozeniter.next_frozen,
+        ),
+        ("cons and Lazy", lambda: lazy_cons_of_iter(tokens), lazy_cons_next),
+    ]
+    for name, make, next_position in cases:
+        seconds = timed(walk(make(), next_position))
+        # Traced in a second run, as tracing slows it down
+        held = held_bytes(lambda: walk(make(), next_position)())
+        print(f"    {name:<16} {seconds * 1000:10.1f} ms {held / 2**20:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        report(size)
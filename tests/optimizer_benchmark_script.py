@@ -0,0 +1,102 @@
+"""
+Reports what partial evaluation and common subexpression elimination
+save on the synthetic corpus and the example sources, and how long
+they take
+
+Run from the repo root: python tests/optimizer_benchmark_script.py
+"""
+
+import glob
+import os
+import sys
+import time
+
+OPO4_PATH = os.path.join(
+    os.path.abspath(""),  # Repo
+    "src",  # src
+    "orthophosphate",  # orthophosphate dir in src
+)
+
+sys.path.insert(0, OPO4_PATH)
+
+from compiler.optimizer.common_subexpressions import (  # type: ignore
+    eliminate_common_subexpressions,
+)
+from compiler.optimizer.constant_folding import partial_evaluation  # type: ignore
+from compiler.optimizer.rewriting import Rewriter  # type: ignore
+from compiler.parser import multistage_parser as parser  # type: ignore
+from compiler.parser.term_graph import FunctionCallTerm  # type: ignore
+from compiler.tokenizer import Tokenizer as tokenizer  # type: ignore
+from synthetic_corpus import generate_source
+
+SIZES = (1_000, 10_000)
+
+
+def arithmetic_source(lines: int) -> str:
+    """
+    Helper functions called on constants and on names known only
+    in game, mixed as a pack that computes scores might mix them
+    """
+    out = [
+        "def double fn([x] sum(x x))",
+        "def clamp fn([x lo hi] max(lo min(x hi)))",
+        "def area fn([w h] product(w h))",
+    ]
+    for i in range(lines):
+        out.append(
+            f"set score.value sum(double({i % 50}) clamp({i} 10 100) $s)"
+            f" area({i % 7} 3) lt(area(2 {i % 9}) 10) length([{i} x])"
+        )
+    return "\n".join(out) + "\n"
+
+
+def call_count(program) -> int:
+    count = 0
+    stack = [program]
+    while stack:
+        term = stack.pop()
+        count += type(term) is FunctionCallTerm
+        stack.extend(term.subterms())
+    return count
+
+
+def report(name: str, src: str) -> None:
+    program = parser.parse(tokenizer.tokenize(src))
+    calls = call_count(program)
+
+    start = time.perf_counter()
+    evaluated = Rewriter(partial_evaluation(program)).rewrite(program)
+    evaluating = time.perf_counter() - start
+    evaluated_calls = call_count(evaluated)
+
+    start = time.perf_counter()
+    _, cse = eliminate_common_subexpressions(evaluated)
+    hoisting = time.perf_counter() - start
+
+    print(name)
+    print(
+        f"    evaluated {calls:>8} -> {evaluated_calls:>8} calls"
+        f" ({(calls - evaluated_calls) / max(calls, 1):6.1%} saved)"
+        f" {evaluating * 1000:8.1f} ms"
+    )
+    print(
+        f"    hoisted   {cse.calls_before:>8} -> {cse.calls_after:>8} calls"
+        f" ({cse.calls_saved / max(cse.calls_before, 1):6.1%} saved)"
+        f" {hoisting * 1000:8.1f} ms, {cse.hoisted} temporaries"
+    )
+
+
+if __name__ == "__main__":
+    for path in sorted(
+        glob.glob(os.path.join(OPO4_PATH, "compiler", "test_src_files", "*.opo4"))
+    ):
+        with open(path) as file:
+            src = file.read()
+        try:
+            report(os.path.basename(path), src)
+        except ValueError as e:
+            print(f"{os.path.basename(path)} does not parse: {e}")
+
+    for size in SIZES:
+        report(f"synthetic, {size} blocks", generate_source(size) + "end\n")
+        report(f"arithmetic, {size} lines", arithmetic_source(size))
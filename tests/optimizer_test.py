@@ -0,0 +1,330 @@
+import random
+
+import pytest
+
+import src.orthophosphate.compiler.parser.multistage_parser as parser
+import src.orthophosphate.compiler.tokenizer.Tokenizer as tokenizer
+from src.orthophosphate.compiler.optimizer.common_subexpressions import (
+    DEFINE,
+    eliminate_common_subexpressions,
+)
+import src.orthophosphate.compiler.optimizer.constant_folding as folding
+from src.orthophosphate.compiler.optimizer.constant_folding import (
+    CONSTANT_FOLDING,
+    MAX_CALL_DEPTH,
+    partial_evaluation,
+    wrap_int,
+)
+from src.orthophosphate.compiler.optimizer.rewriting import (
+    RewriteError,
+    Rewriter,
+    Rule,
+    RuleSet,
+    rewrite_all,
+    substitute,
+    substitute_all,
+)
+from src.orthophosphate.compiler.parser.language import BUILTINS
+from src.orthophosphate.compiler.parser.term_graph import (
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    Term,
+)
+
+
+def call(name: str, *args: Term) -> FunctionCallTerm:
+    return FunctionCallTerm(ReferenceTerm(name), args)
+
+
+def fold_add(term: Term) -> Term | None:
+    match term:
+        case FunctionCallTerm(ReferenceTerm("add"), (IntTerm(a), IntTerm(b))):
+            return IntTerm(a + b)
+    return None
+
+
+def add_zero(term: Term) -> Term | None:
+    match term:
+        case FunctionCallTerm(ReferenceTerm("add"), (x, IntTerm(0))):
+            return x
+    return None
+
+
+def double(term: Term) -> Term | None:
+    match term:
+        case FunctionCallTerm(ReferenceTerm("double"), (x,)):
+            return call("add", x, x)
+    return None
+
+
+ARITHMETIC = RuleSet(
+    "arithmetic",
+    (
+        Rule("fold_add", fold_add, (FunctionCallTerm,)),
+        Rule("add_zero", add_zero, (FunctionCallTerm,)),
+        Rule("double", double, (FunctionCallTerm,)),
+    ),
+)
+
+
+def test_rewrites_to_a_fixpoint():
+    rewriter = Rewriter(ARITHMETIC)
+    assert rewriter.rewrite(
+        call("add", call("add", IntTerm(1), IntTerm(2)), call("double", IntTerm(3)))
+    ) is IntTerm(9)
+
+    # Replacements are rewritten as well
+    x = ReferenceTerm("x")
+    assert rewriter.rewrite(call("double", call("add", x, IntTerm(0)))) is call(
+        "add", x, x
+    )
+
+    untouched = ProgramTerm((call("f", ReferenceTerm("x")), IntTerm(1)))
+    assert rewriter.rewrite(untouched) is untouched
+    assert Rewriter(RuleSet("none", ())).rewrite(untouched) is untouched
+
+    assert rewrite_all(
+        call("double", IntTerm(2)),
+        [Rewriter(RuleSet("double", ARITHMETIC.rules[2:])), rewriter],
+    ) is IntTerm(4)
+
+
+def test_shared_subterms_are_rewritten_once():
+    shared = call("add", IntTerm(1), IntTerm(2))
+    program = ProgramTerm(tuple(call("f", shared, shared) for _ in range(100)))
+    rewriter = Rewriter(ARITHMETIC)
+
+    assert rewriter.rewrite(program) is ProgramTerm(
+        (call("f", IntTerm(3), IntTerm(3)),) * 100
+    )
+    assert rewriter.stats["fold_add"].hits == 1
+
+    tries = rewriter.stats["fold_add"].tries
+    rewriter.rewrite(program)
+    assert rewriter.stats["fold_add"].tries == tries
+    assert "fold_add" in rewriter.stats_report()
+
+
+def test_rules_are_tried_on_their_kinds():
+    seen: list[Term] = []
+
+    def record(term: Term) -> None:
+        seen.append(term)
+
+    rewriter = Rewriter(RuleSet("record", (Rule("record", record, (IntTerm,)),)))
+    rewriter.rewrite(call("f", IntTerm(1), call("g", IntTerm(2)), IntTerm(1)))
+    assert seen == [IntTerm(1), IntTerm(2)]
+
+
+def test_deep_terms_do_not_recurse():
+    term: Term = IntTerm(0)
+    for _ in range(100_000):
+        term = call("add", term, IntTerm(1))
+    assert Rewriter(ARITHMETIC).rewrite(term) is IntTerm(100_000)
+
+
+def test_rules_that_never_stop_are_rejected():
+    def wrap(term: Term) -> Term | None:
+        return call("f", term) if term is ReferenceTerm("a") else None
+
+    def swap(term: Term) -> Term | None:
+        match term:
+            case ReferenceTerm("a"):
+                return ReferenceTerm("b")
+            case ReferenceTerm("b"):
+                return ReferenceTerm("a")
+        return None
+
+    for rule in (Rule("wrap", wrap), Rule("swap", swap)):
+        with pytest.raises(RewriteError):
+            Rewriter(RuleSet("loop", (rule,))).rewrite(call("g", ReferenceTerm("a")))
+
+
+def test_repeated_pure_calls_are_hoisted():
+    program = parser.parse(
+        tokenizer.tokenize(
+            "f sum(sum(1 2) 3) sum(sum(1 2) 3)\n"
+            "g sum(1 2) [1 2] [1 2]\n"
+            "h sum(x 1) sum(x 1) sum(sum(4 5) 6) sum(sum(4 5) 6)\n"
+        )
+    )
+    hoisted, report = eliminate_common_subexpressions(program)
+
+    # sum(1 2) is only made twice once its caller is hoisted, and
+    # [1 2] has no calls in it, so hoisting either would save nothing
+    assert hoisted.display_node_inline() == (
+        "Program("
+        "def(opo4:cse_0 sum(sum(1 2) 3)) "
+        "def(opo4:cse_1 sum(sum(4 5) 6)) "
+        "f(opo4:cse_0 opo4:cse_0) "
+        "g(sum(1 2) opo4:list(1 2) opo4:list(1 2)) "
+        "h(sum(x 1) sum(x 1) opo4:cse_1 opo4:cse_1))"
+    )
+    assert (report.hoisted, report.calls_before, report.calls_after) == (2, 16, 14)
+    assert report.calls_saved == 2
+
+    # Nothing left to hoist
+    assert eliminate_common_subexpressions(hoisted)[0] is hoisted
+
+    nested = parser.parse(
+        tokenizer.tokenize("f sum(sum(1 2) 3) sum(sum(1 2) 3) sum(1 2) sum(1 2)\n")
+    )
+    assert eliminate_common_subexpressions(nested)[0].display_node_inline() == (
+        "Program("
+        "def(opo4:cse_0 sum(1 2)) "
+        "def(opo4:cse_1 sum(opo4:cse_0 3)) "
+        "f(opo4:cse_1 opo4:cse_1 opo4:cse_0 opo4:cse_0))"
+    )
+
+
+def test_hoisting_leaves_the_programs_names_alone():
+    program = parser.parse(
+        tokenizer.tokenize(
+            "def opo4:cse_0 5\n"
+            "f sum(1 opo4:cse_0) sum(1 opo4:cse_0) sum(sum(1 2) 3) sum(sum(1 2) 3)\n"
+        )
+    )
+    hoisted, report = eliminate_common_subexpressions(program)
+    assert hoisted.display_node_inline() == (
+        "Program("
+        "def(opo4:cse_1 sum(sum(1 2) 3)) "
+        "def(opo4:cse_0 5) "
+        "f(sum(1 opo4:cse_0) sum(1 opo4:cse_0) opo4:cse_1 opo4:cse_1))"
+    )
+    assert report.hoisted == 1
+
+
+def test_shadowed_builtins_are_not_hoisted():
+    program = parser.parse(
+        tokenizer.tokenize(
+            "def sum fn([a b] say(a))\n"
+            + "f sum(sum(1 2) 3) sum(sum(1 2) 3) sum(sum(1 2) 3)\n"
+            + "g max(max(1 2) 3) max(max(1 2) 3)\n"
+        )
+    )
+    hoisted, report = eliminate_common_subexpressions(program)
+    assert report.hoisted == 1
+    assert hoisted.display_node_inline().startswith(
+        "Program(def(opo4:cse_0 max(max(1 2) 3)) def(sum fn("
+    )
+    assert "f(sum(sum(1 2) 3) sum(sum(1 2) 3) sum(sum(1 2) 3))" in (
+        hoisted.display_node_inline()
+    )
+
+
+def test_hoisting_keeps_every_call():
+    # The synthetic corpus binds every name it calls somewhere
+    rng = random.Random(3)
+
+    def expr(depth: int) -> str:
+        if depth == 0 or rng.random() < 0.3:
+            return rng.choice(("1", "2", "x"))
+        args = " ".join(expr(depth - 1) for _ in range(rng.randint(1, 3)))
+        return f"{rng.choice(('sum', 'max', 'f'))}({args})"
+
+    src = "".join(f"g {expr(3)} {expr(3)}\n" for _ in range(300))
+    program = parser.parse(tokenizer.tokenize(src))
+    hoisted, report = eliminate_common_subexpressions(program)
+    assert report.hoisted and report.calls_saved > 0
+
+    definitions = {
+        expr.args[0]: expr.args[1]
+        for expr in hoisted.top_level_exprs[: report.hoisted]
+        if isinstance(expr, FunctionCallTerm) and expr.head is DEFINE
+    }
+    assert len(definitions) == report.hoisted
+
+    def inline(term: Term) -> Term | None:
+        return definitions.get(term)
+
+    rest = ProgramTerm(hoisted.top_level_exprs[report.hoisted :])
+    assert Rewriter(RuleSet("inline", (Rule("inline", inline),))).rewrite(
+        rest
+    ) is program
+
+
+def evaluated(src: str) -> str:
+    program = parser.parse(tokenizer.tokenize(src))
+    return Rewriter(partial_evaluation(program)).rewrite(program).display_node_inline()
+
+
+def test_constants_are_folded():
+    folded = Rewriter(CONSTANT_FOLDING).rewrite(
+        parser.parse(
+            tokenizer.tokenize(
+                "f sum(1 2 3) product(65536 65536) difference(0 7)\n"
+                "f quotient(difference(0 7) 2) remainder(difference(0 7) 2)\n"
+                "f max(1 5 2) min(4 3) quotient(1 0) remainder(x 0)\n"
+                'f lt(1 2) ge(1 2) eq("a" "a") ne("a" "a") lt("a" "b") eq(1 "1")\n'
+                "f length([1 [2 3]]) concat([1] [] [x 2]) item([4 5 6] 1) item([4] 1)\n"
+                "f sum(1 x 2 y 3) sum(x 1) sum(1 x) product(x y) [sum(1 1)]\n"
+            )
+        )
+    )
+    assert folded.display_node_inline() == (
+        "Program("
+        "f(6 0 -7) "
+        "f(-4 1) "
+        "f(5 3 quotient(1 0) remainder(x 0)) "
+        'f(1 0 1 0 lt("a" "b") eq(1 "1")) '
+        "f(2 opo4:list(1 x 2) 5 item(opo4:list(4) 1)) "
+        "f(sum(x y 6) sum(x 1) sum(x 1) product(x y) opo4:list(2)))"
+    )
+
+    assert wrap_int(2**31) == -(2**31)
+    assert wrap_int(-(2**31) - 1) == 2**31 - 1
+    # A constant on its own is wrapped too
+    assert Rewriter(CONSTANT_FOLDING).rewrite(
+        parser.parse(tokenizer.tokenize("f sum(5000000000) sum(x 5000000000)\n"))
+    ).display_node_inline() == "Program(f(705032704 sum(x 705032704)))"
+
+
+def test_only_builtins_are_folded():
+    assert {
+        *folding.ARITHMETIC, *folding.COMPARISONS, *folding.LIST_OPERATIONS
+    } <= BUILTINS
+
+
+def test_pure_functions_are_evaluated():
+    assert evaluated(
+        "def double fn([x] sum(x x))\n"
+        "def quad fn([x] double(double(x)))\n"
+        "f quad(3) double(y) quad([1]) double(1 2) item([quad(1) 7] 0)\n"
+    ).endswith("f(12 double(y) quad(opo4:list(1)) double(1 2) 4))")
+
+    # Impure, rebound or unending functions are left for the pack
+    for src in (
+        "def f fn([x] sum(x y))\ng f(1)\n",
+        "def f fn([x] sum(x 1))\ndef f fn([x] sum(x 2))\ng f(1)\n",
+        "def f fn([x] sum(x 1))\ng\n    def f 2\n    f(1)\nend\n",
+        "def f fn([x] g(x))\ndef g fn([x] h(x))\ng f(1)\n",
+        "def f fn([n] f(sum(n 1)))\ng f(1)\n",
+    ):
+        assert "f(1)" in evaluated(src), src
+
+    # Builtins the program binds are not folded
+    assert evaluated("def sum fn([x] x)\ng sum(1 2)\n").endswith("g(sum(1 2)))")
+
+
+def test_calls_are_evaluated_to_the_depth_limit():
+    def chain(length: int) -> str:
+        return "def f0 fn([x] sum(x 1))\n" + "".join(
+            f"def f{i} fn([x] f{i - 1}(x))\n" for i in range(1, length)
+        ) + f"g f{length - 1}(0)\n"
+
+    assert evaluated(chain(MAX_CALL_DEPTH)).endswith("g(1))")
+    assert evaluated(chain(MAX_CALL_DEPTH + 1)).endswith(f"g(f{MAX_CALL_DEPTH}(0)))")
+
+
+def test_substitute_replaces_outermost_occurrences():
+    x = ReferenceTerm("x")
+    term = call("f", call("g", x), x, IntTerm(1))
+    assert substitute(term, {x: IntTerm(2), call("g", x): x}) is call(
+        "f", x, IntTerm(2), IntTerm(1)
+    )
+    assert substitute_all((term, call("h", x)), {x: IntTerm(2)}) == (
+        call("f", call("g", IntTerm(2)), IntTerm(2), IntTerm(1)),
+        call("h", IntTerm(2)),
+    )
@@ -0,0 +1,132 @@
+"""
+Times the parse stack implementations, the LALR(1) parser,
+reparsing after a one-line edit, parsing in a process pool and
+loading a serialized term
+
+Run from the repo root: python tests/parser_benchmark_script.py
+
+Serial and parallel parsing of 15,000 blocks from a TokenBuffer, on a
+machine with one CPU (so the workers take turns):
+
+    serial      4662 ms
+    1 worker    4337 ms  (1.07x; one worker parses here, serially)
+    2 workers   5952 ms  (0.78x)
+    4 workers   6440 ms  (0.72x)
+    8 workers   6634 ms  (0.70x)
+
+Of that, the workers' own parsing and dump_term take 4326 ms in all
+and the load_term calls here 1131 ms, so with a CPU for each worker
+the parallel parse should take about 4326 / N + 1131 ms: 1.4x with
+2 workers and 2.0x with 4, never more than 4x. That has not been
+measured here.
+"""
+
+import os
+import re
+import sys
+import timeit
+
+OPO4_PATH = os.path.join(
+    os.path.abspath(""),  # Repo
+    "src",  # src
+    "orthophosphate",  # orthophosphate dir in src
+)
+
+sys.path.insert(0, OPO4_PATH)
+
+from compiler.parser import multistage_parser as parser  # type: ignore
+from compiler.parser import parser_generator  # type: ignore
+from compiler.parser.incremental_parser import parse_blocks, reparse  # type: ignore
+from compiler.parser.parallel_parser import parse_parallel  # type: ignore
+from compiler.parser.term_serialization import dump_term, load_term  # type: ignore
+from compiler.tokenizer.incremental import TextEdit, relex  # type: ignore
+from compiler.tokenizer import Tokenizer as tokenizer  # type: ignore
+from synthetic_corpus import generate_source
+
+REPEATS = 5
+
+WORKER_COUNTS = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+
+
+def deep_nesting(depth: int) -> str:
+    """
+    One inline expression nested depth levels deep,
+    then one block indented depth levels deep
+    """
+    inline = "f(" * depth + "x" + ")" * depth
+    block = "\n".join("    " * i + f"g{i}" for i in range(depth))
+    return f"{inline}\n{block}\nend\n"
+
+
+def long_flat(lines: int) -> str:
+    return "".join(f"f x{i} {i} \"s\"\n" for i in range(lines))
+
+
+INPUTS = {
+    "deep nesting": deep_nesting(400),
+    "long flat": long_flat(20_000),
+    "synthetic": generate_source(2_000) + "end\n",
+}
+
+if __name__ == "__main__":
+    for name, src in INPUTS.items():
+        tokens = tokenizer.tokenize(src)
+        print(f"{name}: {len(tokens)} tokens")
+        for stack_type in (parser.ParseStack, parser.ListParseStack):
+            best = min(
+                timeit.repeat(
+                    lambda: parser.parse(tokens, stack_type=stack_type),
+                    number=1,
+                    repeat=REPEATS,
+                )
+            )
+            print(f"    {stack_type.__name__:<16} {best * 1000:8.1f} ms")
+        best = min(
+            timeit.repeat(
+                lambda: parser_generator.lalr_parse(tokens), number=1, repeat=REPEATS
+            )
+        )
+        print(f"    {'LALR(1) tables':<16} {best * 1000:8.1f} ms")
+
+    src = generate_source(15_000) + "end\n"
+    tokens = tokenizer.tokenize(src)
+    print(f"\nOne-line edit in {src.count(chr(10))} lines")
+    blocks = parse_blocks(tokens)
+    middle = re.compile(r"\n(?=\S)").search(src, len(src) // 2).end()
+
+    def edit_and_reparse() -> None:
+        _, token_edit = relex(src, tokens, TextEdit(middle, 0, "inserted(1 2)\n"))
+        reparse(blocks, token_edit.splice(tokens), token_edit).term()
+
+    for name, action in (
+        ("full parse", lambda: parser.parse(tokens)),
+        ("relex + reparse", edit_and_reparse),
+    ):
+        best = min(timeit.repeat(action, number=1, repeat=REPEATS))
+        print(f"    {name:<16} {best * 1000:8.1f} ms")
+
+    data = dump_term(parser.parse(tokens))
+    print(f"\nSerialized term, {len(data)} bytes for {len(src)} characters")
+    for name, action in (
+        ("tokenize + parse", lambda: parser.parse(tokenizer.tokenize(src))),
+        ("load", lambda: load_term(data)),
+    ):
+        best = min(timeit.repeat(action, number=1, repeat=REPEATS))
+        print(f"    {name:<16} {best * 1000:8.1f} ms")
+
+    tokens = tokenizer.tokenize_columnar(src)
+    print(f"\nSerial and parallel, {len(tokens)} tokens in a TokenBuffer")
+    serial = min(timeit.repeat(lambda: parser.parse(tokens), number=1, repeat=REPEATS))
+    print(f"    {'serial':<16} {serial * 1000:8.1f} ms")
+    for workers in WORKER_COUNTS:
+        best = min(
+            timeit.repeat(
+                lambda: parse_parallel(tokens, max_workers=workers),
+                number=1,
+                repeat=REPEATS,
+            )
+        )
+        print(
+            f"    {f'{workers} workers':<16} {best * 1000:8.1f} ms"
+            f"  ({serial / best:.2f}x)"
+        )
@@ -0,0 +1,660 @@
+import gc
+import io
+import os.path
+import pickle
+import random
+import re
+import sys
+import typing
+
+import pytest
+
+import src.orthophosphate.compiler.parser.multistage_parser as parser
+import src.orthophosphate.compiler.tokenizer.Tokenizer as tokenizer
+from src.orthophosphate.compiler.parser import parser_generator
+from src.orthophosphate.compiler.parser.incremental_parser import (
+    parse_blocks,
+    reparse,
+)
+from src.orthophosphate.compiler.parser.name_resolver import (
+    OPO4_BUILTINS,
+    SymbolTable,
+    UnresolvedNamesError,
+    resolve_names,
+)
+from src.orthophosphate.compiler.parser.parallel_parser import (
+    _pack_tokens,
+    _unpack_tokens,
+    parse_parallel,
+    parse_tree_parallel,
+)
+from src.orthophosphate.compiler.parser.parse_tracing import EventRecorder, TextTracer
+from src.orthophosphate.compiler.parser.parse_tree2 import (
+    InlineExpr,
+    IntLiteral,
+    MultilineExpr,
+    Name,
+    Program,
+    _display_node,
+)
+from src.orthophosphate.compiler.parser import term_serialization
+from src.orthophosphate.compiler.parser.term_arena import TermArena
+from src.orthophosphate.compiler.parser.term_graph import (
+    BuiltinReferenceTerm,
+    FunctionCallTerm,
+    IntTerm,
+    ProgramTerm,
+    ReferenceTerm,
+    SlotReferenceTerm,
+    StrTerm,
+    Term,
+    inline_cache,
+    interned_count,
+    tree_cache,
+)
+from src.orthophosphate.compiler.tokenizer.incremental import TextEdit, relex
+from synthetic_corpus import generate_source
+
+TEST_SRC_PATH = os.path.join(
+    os.path.abspath("."), "src", "orthophosphate", "compiler", "test_src_files"
+)
+
+EXAMPLE_SOURCES: tuple[str, ...] = (
+    "f(x 1 2)\n",
+    "f x\n    y\n    z\n\ng\n",
+    'say [a "b" c(d)]\nh\n',
+    "f\n    x 0\n    y b(2)\n    z\n        1\n        2\nend\n",
+)
+
+
+def all_sources() -> tuple[str, ...]:
+    with open(os.path.join(TEST_SRC_PATH, "function_experimentation.opo4")) as file:
+        # Closing indented blocks need a line after them
+        return EXAMPLE_SOURCES + (file.read(), generate_source(15, seed=1) + "end\n")
+
+
+def parse_with(
+    src: str, rules: parser.RuleDispatch | type[parser.ReductionRule]
+) -> Term:
+    return parser.parse(tokenizer.tokenize(src), rules)
+
+
+def test_dispatch_matches_chained_rules():
+    for src in all_sources():
+        assert parse_with(src, parser.RuleDispatch(*parser.REDUCTION_RULES)) == (
+            parse_with(src, parser.reductions)
+        ), src
+
+
+def test_dispatch_tries_fewer_rules():
+    for src in all_sources():
+        indexed = parser.RuleDispatch(*parser.REDUCTION_RULES)
+        unindexed = parser.RuleDispatch(*parser.REDUCTION_RULES, indexed=False)
+        assert parse_with(src, indexed) == parse_with(src, unindexed)
+
+        hits = {rule: stats.hits for rule, stats in indexed.stats.items()}
+        assert hits == {rule: stats.hits for rule, stats in unindexed.stats.items()}
+        assert indexed.invocations() < unindexed.invocations() / 2, src
+
+
+def test_parse_prints_nothing_by_default(capsys):
+    parser.parse(tokenizer.tokenize(EXAMPLE_SOURCES[1]))
+    assert capsys.readouterr().out == ""
+
+
+def test_text_tracer_shows_every_step():
+    src = "f(x 1)\n"
+    tokens = tokenizer.tokenize(src)
+    out = io.StringIO()
+    result = parser.parse(tokens, observers=(TextTracer(out),))
+
+    steps = out.getvalue().split("   (Types) ")
+    assert "PUNC file_start : NAME f" in steps[1]
+    assert out.getvalue().endswith(f"{result}\n")
+
+
+def test_event_recorder_round_trips():
+    tokens = tokenizer.tokenize(EXAMPLE_SOURCES[3])
+    recorder = EventRecorder()
+    parser.parse(tokens, observers=(recorder,))
+
+    events = list(recorder)
+    shifts = [e for e in events if e.event == "shift"]
+    assert [e.offset for e in shifts] == [t.start for t in tokens]
+    assert events[-2].item_kind == "Program" and events[-2].depth == 1
+    assert events[-1].event == "accept"
+    assert list(EventRecorder.from_bytes(recorder.to_bytes())) == events
+
+
+def test_both_stacks_parse_the_same():
+    for src in all_sources():
+        tokens = tokenizer.tokenize(src)
+        assert parser.parse(tokens, stack_type=parser.ParseStack) == parser.parse(
+            tokens, stack_type=parser.ListParseStack
+        ), src
+
+
+def test_list_stack_rolls_back_to_checkpoints():
+    stack = parser.ListParseStack.of(1)
+    stack.push(2)
+    outer = stack.checkpoint()
+    stack.push(3).replace_top(2, 23)
+    inner = stack.checkpoint()
+    stack.replace_top(2, 123)
+    assert list(stack) == [123] and len(stack) == 1
+
+    stack.rollback(inner)
+    assert list(stack) == [1, 23]
+    stack.rollback(outer)
+    assert list(stack) == [1, 2] and list(stack.from_top()) == [2, 1]
+
+    stack.release(inner)
+    stack.release(outer)
+    stack.push(4)
+    assert stack.checkpoint() == 0
+
+
+def test_list_stack_keeps_logging_while_checkpoints_are_held():
+    # Checkpoints with no change between them have the same mark
+    stack = parser.ListParseStack.of(1)
+    outer = stack.checkpoint()
+    inner = stack.checkpoint()
+    assert outer == inner == 0
+
+    stack.release(inner)
+    stack.push(2)
+    stack.rollback(outer)
+    assert list(stack) == [1]
+
+
+def parse_or_fail(parse, tokens) -> Term | str:
+    try:
+        return parse(tokens)
+    except ValueError:
+        return "failed"
+
+
+def test_lalr_parser_matches_reduction_rules():
+    rng = random.Random(6)
+    pieces = ("a", "1", '"s"', "(", ")", "[", "]", "\n", "\n    ", " ", "f(", ";")
+    fuzzed = tuple(
+        "".join(rng.choice(pieces) for _ in range(rng.randint(1, 14))) + "\nend\n"
+        for _ in range(2000)
+    )
+    for src in all_sources() + ("[a\n] b\n", "f()(x)\n", "[]\n") + fuzzed:
+        try:
+            tokens = tokenizer.tokenize(src)
+        except (AssertionError, ValueError):
+            continue
+        assert parse_or_fail(parser_generator.lalr_parse, tokens) == parse_or_fail(
+            parser.parse, tokens
+        ), src
+
+
+def test_lalr_tables_survive_the_disk_cache():
+    parser_generator.load_tables.cache_clear()
+    first = parser_generator.load_tables()  # Writes the cache if missing
+    parser_generator.load_tables.cache_clear()
+    assert parser_generator.load_tables() == first == parser_generator.build_tables()
+
+
+def test_conflicting_grammar_is_rejected():
+    ambiguous = parser_generator.GRAMMAR + (
+        parser_generator.Production("primary", ("(", "args", ")"), "first"),
+        parser_generator.Production("call", ("(", "args", ")"), "first"),
+    )
+    with pytest.raises(parser_generator.GrammarConflict, match="reduce"):
+        parser_generator.build_tables(ambiguous)
+
+
+def test_block_parse_matches_parse():
+    for src in all_sources():
+        tokens = tokenizer.tokenize(src)
+        assert parse_blocks(tokens).term() == parser.parse(tokens), src
+
+
+def test_reparse_matches_parsing_the_edited_source():
+    rng = random.Random(7)
+    insertions = ("x", "12", " ", "    ", "\n", "\n    ", "(", ")", "[", "]", "\nf\n")
+
+    src = generate_source(40, seed=3) + "end\n"
+    tokens = tokenizer.tokenize(src)
+    blocks = parse_blocks(tokens)
+    for _ in range(300):
+        offset = rng.randint(0, len(src) - 5)
+        edit = TextEdit(
+            offset,
+            rng.randint(0, 4),
+            "".join(rng.choice(insertions) for _ in range(rng.randint(0, 2))),
+        )
+        try:
+            expected = parser.parse(tokenizer.tokenize(edit.apply(src)))
+        except (AssertionError, ValueError):
+            continue
+
+        src, token_edit = relex(src, tokens, edit)
+        tokens = token_edit.apply(tokens)
+        blocks = reparse(blocks, tokens, token_edit)
+        assert blocks.term() == expected, edit
+
+
+def test_block_parse_rejects_what_parse_rejects():
+    def parse_error(parse: typing.Callable[[], object]) -> tuple[type, str]:
+        with pytest.raises(ValueError) as info:
+            parse()
+        return info.type, str(info.value)
+
+    for src in ("f )\n", "f(x\n", "f x\n)\ng y\n", "g\n    h (\nk\n", "[1 2\n3]\n"):
+        tokens = tokenizer.tokenize(src)
+        assert parse_error(lambda: parse_blocks(tokens)) == parse_error(
+            lambda: parser.parse(tokens)
+        ), src
+
+    src = "f x\ng y\nh z\n"
+    tokens = tokenizer.tokenize(src)
+    blocks = parse_blocks(tokens)
+    for edit in (TextEdit(4, 0, "("), TextEdit(5, 1, ")"), TextEdit(0, 0, "]")):
+        new_src, token_edit = relex(src, tokens, edit)
+        new_tokens = token_edit.splice(tokens)
+        expected = parse_error(lambda: parser.parse(tokenizer.tokenize(new_src)))
+        assert parse_error(lambda: reparse(blocks, new_tokens, token_edit)) == expected
+        assert parse_error(lambda: reparse(blocks, new_tokens)) == expected
+
+    # A failed reparse leaves the old parse as it was
+    assert reparse(blocks, tokens).term() == parser.parse(tokens)
+
+
+def test_reparse_only_parses_the_edited_block():
+    src = generate_source(500, seed=8) + "end\n"
+    tokens = tokenizer.tokenize(src)
+    blocks = parse_blocks(tokens)
+    middle = re.compile(r"\n(?=\S)").search(src, len(src) // 2).end()
+
+    new_src, token_edit = relex(src, tokens, TextEdit(middle, 0, "inserted(1 2)\n"))
+    new_tokens = token_edit.splice(tokens)
+    new_blocks = reparse(blocks, new_tokens, token_edit)
+    assert new_blocks.reparsed == 1
+    assert new_blocks.term() == parser.parse(tokenizer.tokenize(new_src))
+
+    # Without the edit, every block is looked up by its fingerprint instead
+    assert reparse(blocks, new_tokens).reparsed == 0
+
+
+def test_parallel_parse_matches_parse():
+    for src in all_sources() + (generate_source(200, seed=11) + "end\n",):
+        for tokens in (tokenizer.tokenize(src), tokenizer.tokenize_columnar(src)):
+            expected = parser.parse_tree(tokens)
+            for piece_size in (1, 16, 10_000):
+                assert (
+                    parse_tree_parallel(tokens, max_workers=2, piece_size=piece_size)
+                    == expected
+                ), (src, piece_size)
+                assert (
+                    parse_parallel(tokens, max_workers=2, piece_size=piece_size)
+                    == expected.to_term()
+                ), (src, piece_size)
+
+
+def test_packed_tokens_keep_their_spans():
+    src = generate_source(50, seed=12) + "end\n"
+    for tokens in (tokenizer.tokenize(src), tokenizer.tokenize_columnar(src)):
+        for start, stop in ((1, len(tokens) - 1), (40, 90)):
+            unpacked = _unpack_tokens(_pack_tokens(tokens, start, stop))
+            assert [(t.type, t.value, t.start, t.end) for t in unpacked[1:-1]] == [
+                (t.type, t.value, t.start, t.end) for t in tokens[start:stop]
+            ]
+
+
+def test_parallel_parse_raises_on_a_failed_piece():
+    tokens = tokenizer.tokenize("f x\n" * 50 + "g )\n" + "h y\n" * 50)
+    with pytest.raises(ValueError, match="^Failed parse$"):
+        parse_parallel(tokens, max_workers=2, piece_size=8)
+
+
+def test_deep_nesting_lowers_and_renders_without_recursing():
+    depth = 100_000
+    limit = sys.getrecursionlimit()
+
+    inline: InlineExpr | Name = Name("x")
+    for _ in range(depth):
+        inline = InlineExpr(Name("f"), (inline,))
+    program = Program((MultilineExpr((inline,), ()),))
+
+    nested = "f(" * depth + "x" + ")" * depth
+    assert str(program) == f"program({nested}(/n))"
+
+    term = program.to_term()
+    assert term.display_node_inline() == f"Program({nested})"
+
+    # The tree rendering has a line per level, each as long as its depth
+    block: MultilineExpr = MultilineExpr((Name("x"),), ())
+    for _ in range(limit * 2):
+        block = MultilineExpr((Name("g"),), (block,))
+    tree = Program((block,)).to_term().display_node()
+    assert tree.count("\n") == limit * 2 + 2
+    assert tree.endswith("═ x\n")
+
+    assert sys.getrecursionlimit() == limit
+
+
+def test_million_node_trees_lower_and_render():
+    rows, width = 500, 1_000
+    program = Program(
+        tuple(
+            MultilineExpr(
+                (Name(f"f{i}"),),
+                tuple(MultilineExpr((IntLiteral(j),), ()) for j in range(width)),
+            )
+            for i in range(rows)
+        )
+    )
+    term = program.to_term()
+    assert isinstance(term, ProgramTerm)
+    assert len(term.top_level_exprs) == rows
+    assert term.top_level_exprs[3] == FunctionCallTerm(
+        ReferenceTerm("f3"),
+        tuple(FunctionCallTerm(IntTerm(j), ()) for j in range(width)),
+    )
+
+    tree = term.display_node()
+    assert tree.count("\n") == 1 + rows * (width + 1)
+    assert tree.startswith(" Program\n╠═ f0\n║ ╠═ 0\n")
+    assert _display_node(program).count("\n") == 1 + rows * (2 + 2 * width)
+
+
+def test_terms_are_interned():
+    term = FunctionCallTerm(ReferenceTerm("f"), (IntTerm(1), StrTerm("1")))
+    same = FunctionCallTerm(
+        head=ReferenceTerm(name="f"), args=(IntTerm(1), StrTerm("1"))
+    )
+    assert term is same
+    assert hash(term) == hash(same)
+    assert term.args[0] is not term.args[1]
+    assert pickle.loads(pickle.dumps(term)) is term
+
+
+def test_interning_leaves_live_terms_alone():
+    one = IntTerm(1)
+    true = IntTerm(True)  # type: ignore[arg-type]
+    assert one is not true
+    assert type(one.value) is int and type(true.value) is bool
+    assert IntTerm(1) is one
+    assert IntTerm(1.0) is not one  # type: ignore[arg-type]
+
+
+def test_lowering_shares_repeated_subterms():
+    src = "f [x 1] [x 1]\ng\n    [x 1]\nend\n"
+    term = parser.parse(tokenizer.tokenize(src))
+    assert isinstance(term, ProgramTerm)
+    f, g, _ = term.top_level_exprs
+    assert isinstance(f, FunctionCallTerm) and isinstance(g, FunctionCallTerm)
+    assert f.args[0] is f.args[1]
+    assert f.args[0].head is ReferenceTerm("opo4:list")
+    # The line "[x 1]" is a call to the same list
+    assert isinstance(g.args[0], FunctionCallTerm)
+    assert g.args[0].head is f.args[0]
+
+    # Deep terms compare without walking them
+    def nested(depth: int) -> Term:
+        node: InlineExpr | Name = Name("x")
+        for _ in range(depth):
+            node = InlineExpr(Name("f"), (node,))
+        return node.to_term()
+
+    assert nested(100_000) is nested(100_000)
+
+
+def test_unused_terms_are_freed():
+    gc.collect()
+    before = interned_count()
+    term = ProgramTerm(tuple(IntTerm(i) for i in range(-1000, 0)))
+    assert interned_count() == before + 1001
+    term.display_node()
+    term.top_level_exprs[0].display_node_inline()
+    del term
+    gc.collect()
+    assert interned_count() == before
+
+
+def test_render_caches_stay_bounded():
+    terms = [
+        FunctionCallTerm(ReferenceTerm("f"), (IntTerm(i),))
+        for i in range(inline_cache.maxsize * 2)
+    ]
+    for term in terms:
+        term.display_node_inline()
+    assert len(inline_cache) == inline_cache.maxsize
+
+    term = FunctionCallTerm(ReferenceTerm("g"), (StrTerm("x"),))
+    inline_cache.reset_stats()
+    assert term.display_node_inline() == "g(x)"
+    assert term.display_node_inline() == "g(x)"
+    assert (inline_cache.hits, inline_cache.misses) == (1, 1)
+
+    # Long renderings are not kept
+    long_term = ProgramTerm(tuple(IntTerm(i) for i in range(2_000)))
+    tree_cache.clear()
+    long_term.display_node()
+    assert len(tree_cache) == 0
+
+
+def test_write_tree_streams_what_display_node_renders(tmp_path):
+    program = parser.parse_tree(tokenizer.tokenize(all_sources()[-1]))
+    term = program.to_term()
+    for node, rendered in (
+        (term, term.display_node()),
+        (program, _display_node(program)),
+    ):
+        out = io.StringIO()
+        assert node.write_tree(out) == rendered.count("\n")
+        assert out.getvalue() == rendered
+
+    path = tmp_path / "tree.txt"
+    with open(path, "w") as file:
+        term.write_tree(file, max_nodes=10)
+    assert path.read_text().splitlines()[-1].endswith("═ ...")
+    assert len(path.read_text().splitlines()) == 11
+
+
+def test_write_tree_limits():
+    term = ProgramTerm(
+        (
+            FunctionCallTerm(
+                ReferenceTerm("f"),
+                (IntTerm(1), FunctionCallTerm(ReferenceTerm("g"), (IntTerm(2),))),
+            ),
+        )
+    )
+    assert str(term) == " Program\n╚═ f\n  ╠═ 1\n  ╚═ g\n    ╚═ 2\n"
+
+    out = io.StringIO()
+    assert term.write_tree(out, max_depth=1) == 2
+    assert out.getvalue() == " Program\n╚═ f\n  ╚═ ...\n"
+
+    out = io.StringIO()
+    assert term.write_tree(out, max_nodes=3) == 3
+    assert out.getvalue() == " Program\n╚═ f\n  ╠═ 1\n  ╚═ ...\n"
+
+
+def test_arena_lowering_matches_terms():
+    for src in all_sources():
+        program = parser.parse_tree(tokenizer.tokenize(src))
+        term = program.to_term()
+        arena = TermArena()
+        view = arena.view(program.to_arena(arena))
+        assert view.to_term() is term
+        assert view.display_node() == term.display_node()
+        assert view.display_node_inline() == term.display_node_inline()
+
+        copy = TermArena()
+        assert copy.to_term(copy.add_term(term)) is term
+
+
+def test_arena_shares_leaves():
+    arena = TermArena()
+    program = parser.parse_tree(tokenizer.tokenize("[x 1] [x 1]\n[x]\n"))
+    view = arena.view(program.to_arena(arena))
+    assert arena.strings == ["x", "opo4:list"]
+    assert arena.ints == [1]
+    # Three list calls, two line calls, the program and three shared leaves
+    assert len(arena) == 9
+    assert view.render_contents()[0] == "Program"
+
+
+def test_arena_stores_shared_subterms_once():
+    term: Term = IntTerm(1)
+    for _ in range(20):
+        term = FunctionCallTerm(ReferenceTerm("sum"), (term, term))
+    arena = TermArena()
+    term_id = arena.add_term(term)
+    # Twenty calls and their two leaves, not 2 ** 20 calls
+    assert len(arena) == 22
+    assert arena.to_term(term_id) is term
+
+
+def test_arena_handles_deep_nesting():
+    node: InlineExpr | Name = Name("x")
+    for _ in range(100_000):
+        node = InlineExpr(Name("f"), (node,))
+    arena = TermArena()
+    view = arena.view(node.to_arena(arena))
+    assert view.display_node_inline() == "f(" * 100_000 + "x" + ")" * 100_000
+
+
+def test_serialized_terms_load_back():
+    terms = [parser.parse(tokenizer.tokenize(src)) for src in all_sources()]
+    terms.append(
+        FunctionCallTerm(
+            ReferenceTerm("é"), (IntTerm(-5), IntTerm(2**70), StrTerm(""))
+        )
+    )
+    for term in terms:
+        data = term_serialization.dump_term(term)
+        assert term_serialization.load_term(data) is term
+
+    # Each distinct subterm is written once, and repeats cost a byte each
+    repeated = "f [x 1] [x 1] [x 1] [x 1]\n"
+    once = "f [x 1]\n"
+    assert len(
+        term_serialization.dump_term(parser.parse(tokenizer.tokenize(repeated)))
+    ) == len(term_serialization.dump_term(parser.parse(tokenizer.tokenize(once)))) + 3
+
+
+def test_stale_or_cut_serialized_terms_are_rejected():
+    data = term_serialization.dump_term(parser.parse(tokenizer.tokenize("f x 1\n")))
+    stale = data.replace(
+        term_serialization.MAGIC + bytes((term_serialization.FORMAT_VERSION,)),
+        term_serialization.MAGIC + bytes((term_serialization.FORMAT_VERSION + 1,)),
+    )
+    for bad in (stale, data[:-1], data[:-3], b"not a term", data + b"\x00"):
+        with pytest.raises(term_serialization.TermFormatError):
+            term_serialization.load_term(bad)
+
+
+def test_serialized_terms_referring_outside_themselves_are_rejected():
+    call = FunctionCallTerm(ReferenceTerm("f"), (IntTerm(1),))
+    data = term_serialization.dump_term(call)
+    # f, then 1, then the call: head 2 back, 1 argument, 1 back
+    assert data.endswith(bytes((0, 0, 1, 2, 3, 2, 1, 1)))
+
+    for bad in (
+        data[:-1] + bytes((3,)),  # Before the first term
+        data[:-1] + bytes((0,)),  # The call itself
+        data[:-7] + bytes((1,)) + data[-6:],  # A string that is not there
+    ):
+        with pytest.raises(term_serialization.TermFormatError):
+            term_serialization.load_term(bad)
+
+
+def test_parse_cached_reuses_the_cache(tmp_path):
+    src = all_sources()[-1]
+    term = term_serialization.parse_cached(src, str(tmp_path))
+    assert term is parser.parse(tokenizer.tokenize(src))
+    (cache_file,) = tmp_path.iterdir()
+
+    cache_file.write_bytes(
+        term_serialization.dump_term(ProgramTerm((ReferenceTerm("cached"),)))
+    )
+    assert term_serialization.parse_cached(src, str(tmp_path)) is ProgramTerm(
+        (ReferenceTerm("cached"),)
+    )
+
+    cache_file.write_bytes(b"stale")
+    assert term_serialization.parse_cached(src, str(tmp_path)) is term
+
+
+def test_names_resolve_through_every_scope():
+    program = parser.parse(
+        tokenizer.tokenize(
+            "def double fn([x] sum(x x))\n"
+            "def counter\n"
+            "    fn\n"
+            "        [n]\n"
+            "        def step fn([k] sum(k n total step))\n"
+            "        step(n)\n"
+            "counter(double(3)) [total]\n"
+            "def total 5\n"
+        )
+    )
+    assert resolve_names(program).display_node_inline() == (
+        "Program("
+        "def(double@0:0 fn(opo4:list(x@0:0) sum(x@0:0 x@0:0))) "
+        "def(counter@0:1 fn(opo4:list(n@0:0) "
+        "def(step@0:1 fn(opo4:list(k@0:0) sum(k@0:0 n@1:0 total@2:2 step@1:1))) "
+        "step@0:1(n@0:0))) "
+        "counter@0:1(double@0:0(3))(opo4:list(total@0:2)) "
+        "def(total@0:2 5))"
+    )
+
+    # Scopes that resolve the same way share their terms
+    resolved = resolve_names(
+        parser.parse(tokenizer.tokenize("def f 1\nf fn([x] x f) fn([x] x f)\n"))
+    )
+    first, second = resolved.top_level_exprs[1].args
+    assert first is second
+    assert first.args[2] is SlotReferenceTerm("f", 1, 0)
+    assert resolved.top_level_exprs[0].head is BuiltinReferenceTerm(
+        "def", OPO4_BUILTINS["def"]
+    )
+
+
+def test_resolved_programs_serialize_and_store():
+    resolved = resolve_names(
+        parser.parse(
+            tokenizer.tokenize("def f fn([x] sum(x 1))\ndef g fn([y] f(f(y)))\ng(2)\n")
+        )
+    )
+    data = term_serialization.dump_term(resolved)
+    assert term_serialization.load_term(data) is resolved
+
+    arena = TermArena()
+    view = arena.view(arena.add_term(resolved))
+    assert view.to_term() is resolved
+    assert view.display_node_inline() == resolved.display_node_inline()
+    assert arena.slots == [
+        ("f", 0, 0),
+        ("x", 0, 0),
+        ("g", 0, 1),
+        ("y", 0, 0),
+        ("f", 1, 0),
+    ]
+
+
+def test_unresolved_names_are_all_reported():
+    with pytest.raises(UnresolvedNamesError) as e:
+        resolve_names(
+            parser.parse(tokenizer.tokenize("f x fn([x] y(x))\ng fn([a] b) a\n"))
+        )
+    assert e.value.names == ("f", "x", "y", "g", "b", "a")
+
+
+def test_symbol_tables_look_outward():
+    table = SymbolTable.new()
+    table.bind("a")
+    inner = table.enter_scope()
+    assert inner.bind("b") == 0 and inner.bind("b") == 0
+    assert inner.bind("a") == 1
+    assert inner.deref("a") == (0, 1)
+    assert inner.exit_scope().deref("a") == (0, 0)
+    assert inner.enter_scope().deref("b") == (1, 0)
+    assert inner.lookup("c") is None
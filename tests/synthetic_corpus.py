@@ -0,0 +1,50 @@
+"""
+Builds large, valid Orthophosphate sources for tests and benchmark scripts
+"""
+
+import random
+
+_NAMES = ("f", "x", "y", "sum", "def", "fn", "tag", "score.value", "opo4:list", "$s")
+_STRINGS = ('"hello"', '"with \\" quote"', '"minecraft:stone"')
+
+
+def _inline_expr(rng: random.Random, depth: int) -> str:
+    roll = rng.random()
+    if depth <= 0 or roll < 0.5:
+        return rng.choice(
+            (rng.choice(_NAMES), str(rng.randint(0, 1000)), rng.choice(_STRINGS))
+        )
+    args = " ".join(_inline_expr(rng, depth - 1) for _ in range(rng.randint(1, 3)))
+    if roll < 0.8:
+        return f"{rng.choice(_NAMES)}({args})"
+    return f"[{args}]"
+
+
+def _block(rng: random.Random, out: list[str], indent: int, depth: int) -> None:
+    pre = "    " * indent
+    line = " ".join(_inline_expr(rng, 2) for _ in range(rng.randint(1, 4)))
+    roll = rng.random()
+    if roll < 0.05:
+        line += " // trailing comment"
+    out.append(pre + line)
+    if roll < 0.1:
+        out.append("")
+    elif roll < 0.13:
+        out.append(pre + "# comment line")
+    elif roll < 0.15:
+        out.append(pre + "/* block\ncomment */")
+    if depth > 0 and rng.random() < 0.4:
+        for _ in range(rng.randint(1, 3)):
+            _block(rng, out, indent + 1, depth - 1)
+
+
+def generate_source(top_level_blocks: int, seed: int = 0, max_depth: int = 3) -> str:
+    """
+    A source with the given number of top-level blocks,
+    always ending with a newline
+    """
+    rng = random.Random(seed)
+    out: list[str] = []
+    for _ in range(top_level_blocks):
+        _block(rng, out, 0, max_depth)
+    return "\n".join(out) + "\n"
@@ -0,0 +1,121 @@
+"""
+Times the tokenizer engines against each other on a large synthetic source
+
+Run from the repo root: python tests/tokenizer_benchmark_script.py
+
+The DFA scanner from lexer_generator, as last measured against the
+regex it was built from (20,000 blocks; not an Engine, since it is no
+faster):
+
+    scan_with_regex     589.7 ms
+    scan_with_dfa       536.4 ms
+
+Parallel scaling as last measured, on a machine with 1 CPU, where
+tokenize_parallel can only show its overhead:
+
+    workers   tokenize_parallel   tokenize_files (200 files)
+    serial         640.9 ms            1116.2 ms
+    1              782.5 ms (0.82x)    1067.8 ms (1.05x)
+    2              844.0 ms (0.76x)     733.7 ms (1.52x)
+    4              922.1 ms (0.70x)     876.4 ms (1.27x)
+    8             1207.4 ms (0.53x)     809.1 ms (1.38x)
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+OPO4_PATH = os.path.join(
+    os.path.abspath(""),  # Repo
+    "src",  # src
+    "orthophosphate",  # orthophosphate dir in src
+)
+
+sys.path.insert(0, OPO4_PATH)
+
+from compiler.tokenizer import Tokenizer as tokenizer  # type: ignore
+from compiler.tokenizer import lexer_generator  # type: ignore
+from compiler.tokenizer.parallel import (  # type: ignore
+    tokenize_files,
+    tokenize_parallel,
+)
+from synthetic_corpus import generate_source
+
+REPEATS = 5
+WORKER_COUNTS = (1, 2, 4, 8)
+FILES = 200
+
+
+def scan_with_regex(src: str) -> None:
+    for match_object in tokenizer.TOKEN_REGEX.finditer(src):
+        match_object.lastgroup, match_object.span()
+
+
+def scan_with_dfa(src: str) -> None:
+    tables = lexer_generator.load_tables(tokenizer.DFA_TOKENS)
+    for _ in lexer_generator.dfa_scan(src, tables):
+        pass
+
+
+if __name__ == "__main__":
+    src = generate_source(20_000)
+    print(f"{len(src.splitlines())} lines, {len(src)} characters")
+
+    reference = tokenizer.tokenize(src, tokenizer.Engine.PIPELINE)
+    print(f"{len(reference)} tokens\n")
+
+    baseline: float | None = None
+    for engine in tokenizer.Engine:
+        best = min(
+            timeit.repeat(
+                lambda: tokenizer.tokenize(src, engine), number=1, repeat=REPEATS
+            )
+        )
+        baseline = best if baseline is None else baseline
+        print(f"{engine.name:<10} {best * 1000:8.1f} ms  ({baseline / best:.2f}x)")
+
+    print("\nScanners alone")
+    for scanner in (scan_with_regex, scan_with_dfa):
+        best = min(timeit.repeat(lambda: scanner(src), number=1, repeat=REPEATS))
+        print(f"{scanner.__name__:<16} {best * 1000:8.1f} ms")
+
+    print(f"\nColumnar, serial and parallel ({os.cpu_count()} CPUs)")
+    serial = min(
+        timeit.repeat(lambda: tokenizer.tokenize_columnar(src), number=1, repeat=REPEATS)
+    )
+    print(f"{'serial':<10} {serial * 1000:8.1f} ms")
+    for workers in WORKER_COUNTS:
+        best = min(
+            timeit.repeat(
+                lambda: tokenize_parallel(src, max_workers=workers),
+                number=1,
+                repeat=REPEATS,
+            )
+        )
+        print(f"{workers:<2} workers {best * 1000:8.1f} ms  ({serial / best:.2f}x)")
+
+    print(f"\n{FILES} files, serial and tokenize_files")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(FILES):
+            paths.append(os.path.join(directory, f"{i}.opo4"))
+            with open(paths[-1], "w") as file:
+                file.write(generate_source(100, seed=i))
+
+        def tokenize_each() -> None:
+            for path in paths:
+                with open(path) as file:
+                    tokenizer.tokenize_columnar(file.read())
+
+        serial = min(timeit.repeat(tokenize_each, number=1, repeat=REPEATS))
+        print(f"{'serial':<10} {serial * 1000:8.1f} ms")
+        for workers in WORKER_COUNTS:
+            best = min(
+                timeit.repeat(
+                    lambda: tokenize_files(paths, max_workers=workers),
+                    number=1,
+                    repeat=REPEATS,
+                )
+            )
+            print(f"{workers:<2} workers {best * 1000:8.1f} ms  ({serial / best:.2f}x)")
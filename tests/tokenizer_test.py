@@ -0,0 +1,327 @@
+import io
+import mmap
+import os.path
+import random
+import re
+import tempfile
+import tracemalloc
+import typing
+
+import pytest
+
+import src.orthophosphate.compiler.tokenizer.Tokenizer as tokenizer
+from src.orthophosphate.compiler.tokenizer import lexer_generator
+from src.orthophosphate.compiler.tokenizer.incremental import TextEdit, relex
+from src.orthophosphate.compiler.tokenizer.line_index import LineIndex
+from src.orthophosphate.compiler.tokenizer.parallel import (
+    tokenize_files,
+    tokenize_parallel,
+)
+from src.orthophosphate.compiler.tokenizer.token import Token, TokenType
+from src.orthophosphate.compiler.tokenizer.token_buffer import TokenBuffer, TokenView
+from synthetic_corpus import generate_source
+
+TEST_SRC_PATH = os.path.join(
+    os.path.abspath("."), "src", "orthophosphate", "compiler", "test_src_files"
+)
+
+EXAMPLE_SOURCES: tuple[str, ...] = (
+    "f(x 1 2)\n",
+    "f\n    x\n        y\n\n    z\n",
+    'say "a \\" quote" /* block\ncomment */ x\n',
+    "a -> b // trailing\n# whole line\n[x y]\n",
+    "f\n    x\n",
+    "f x",
+    "-> a\n# starts with a comment\nx\n",
+)
+
+
+def read_test_src(name: str) -> str:
+    with open(os.path.join(TEST_SRC_PATH, name)) as file:
+        return file.read()
+
+
+def all_sources() -> tuple[str, ...]:
+    return EXAMPLE_SOURCES + (read_test_src("function_experimentation.opo4"),)
+
+
+def as_pairs(tokens: typing.Iterable[Token]) -> list[tuple[object, str]]:
+    return [(t.type, t.value) for t in tokens]
+
+
+def test_streaming_matches_tokenize_across_chunk_sizes():
+    for src in all_sources():
+        expected = as_pairs(tokenizer.tokenize(src))
+        for chunk_size in (1, 2, 3, 7, 64, 1 << 16):
+            assert (
+                as_pairs(tokenizer.tokenize_stream(io.StringIO(src), chunk_size))
+                == expected
+            ), (src, chunk_size)
+
+
+def test_streaming_reads_binary_files_and_mmaps():
+    src = read_test_src("function_experimentation.opo4") + 'x "ünïcödé"\n'
+    expected = as_pairs(tokenizer.tokenize(src))
+
+    assert as_pairs(tokenizer.tokenize_stream(io.BytesIO(src.encode()), 5)) == expected
+
+    with tempfile.TemporaryFile() as file:
+        file.write(src.encode())
+        file.flush()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert as_pairs(tokenizer.tokenize_stream(mapped, 3)) == expected
+
+
+def test_fused_engine_matches_pipeline():
+    for src in all_sources() + (generate_source(500, seed=1),):
+        assert as_pairs(tokenizer.tokenize(src, tokenizer.Engine.FUSED)) == as_pairs(
+            tokenizer.tokenize(src, tokenizer.Engine.PIPELINE)
+        ), src
+
+
+def test_fused_engine_raises_the_same_errors():
+    for src in ("f\n  x\n", "f @\n", "/* x */ ~\n"):
+        errors: list[str] = []
+        for tokenize in all_tokenizers():
+            try:
+                tokenize(src)
+            except (AssertionError, ValueError) as e:
+                errors.append(f"{type(e).__name__}: {e}")
+        assert len(errors) == len(all_tokenizers()) and len(set(errors)) == 1, src
+
+
+def test_dfa_scanner_matches_the_regex():
+    tables = lexer_generator.load_tables(tokenizer.DFA_TOKENS)
+    rng = random.Random(3)
+    pieces = ("a", "1", '"', "\\", "#", "/", "*", "\n", " ", "    ", "\t", "->", ";")
+    pieces += (".", ":", "é", "\u00a0")
+    fuzzed = tuple(
+        "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+        for _ in range(3000)
+    )
+    for src in all_sources() + (generate_source(500, seed=4),) + fuzzed:
+        expected = [
+            (m.lastgroup, m.start(), m.end())
+            for m in tokenizer.TOKEN_REGEX.finditer(src)
+        ]
+        assert [
+            (tables.names[entry], start, end)
+            for entry, start, end in lexer_generator.dfa_scan(src, tables)
+        ] == expected, src
+
+
+def test_dfa_tokens_match_pipeline():
+    for src in all_sources() + (generate_source(500, seed=5),):
+        assert with_spans(dfa_tokenize(src)) == with_spans(
+            tokenizer.tokenize(src, tokenizer.Engine.PIPELINE)
+        ), src
+
+
+def test_dfa_spec_rejects_what_it_cannot_scan():
+    with pytest.raises(ValueError, match="not in the tokens"):
+        lexer_generator.longest_match_spec(
+            tokenizer.TOKENS, {r"[0-9]*": ((r"[0-9]*", 0),)}
+        )
+    for pattern in (r"a*?b", r"^a", r"a(?=b)"):
+        with pytest.raises(ValueError, match="supported"):
+            lexer_generator.longest_match_spec((("NAME", pattern),), {})
+
+
+def test_dfa_tables_survive_the_disk_cache():
+    spec = tokenizer.DFA_TOKENS
+    lexer_generator.load_tables.cache_clear()
+    first = lexer_generator.load_tables(spec)  # Writes the cache if missing
+    lexer_generator.load_tables.cache_clear()
+    assert (
+        lexer_generator.load_tables(spec) == first == lexer_generator.build_tables(spec)
+    )
+
+
+def test_columnar_buffer_matches_tokenize():
+    for src in all_sources() + (generate_source(500, seed=2),):
+        buffer = tokenizer.tokenize_columnar(src)
+        assert as_pairs(buffer) == as_pairs(tokenizer.tokenize(src)), src
+        assert as_pairs(buffer[::-1]) == as_pairs(buffer)[::-1]
+
+
+def test_columnar_buffer_is_compact():
+    src = generate_source(2_000, seed=4)
+
+    def allocated[T](make: typing.Callable[[], T]) -> tuple[T, int]:
+        tracemalloc.start()
+        try:
+            made = make()
+            return made, tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    buffer, buffer_size = allocated(lambda: tokenizer.tokenize_columnar(src))
+    _, tuple_size = allocated(lambda: tuple(tokenizer.tokenize(src)))
+    assert buffer_size * 10 < tuple_size
+
+    # Reading every token keeps none of them
+    tracemalloc.start()
+    try:
+        for _ in buffer:
+            pass
+        assert tracemalloc.get_traced_memory()[1] < 4096
+    finally:
+        tracemalloc.stop()
+
+
+def test_columnar_buffer_tokens_know_where_they_are():
+    buffer = tokenizer.tokenize_columnar("f(x)\n    y\n    z\n\ng\n")
+    newlines = [t for t in buffer if t.type is TokenType.NEWLINE]
+    assert [(t.start, t.end) for t in newlines] == [
+        (4, 5),
+        (10, 11),
+        (16, 17),
+        (19, 20),
+    ]
+    assert buffer[2].matches(TokenType.PUNC, "(") and buffer[2].start == 1
+    assert (buffer[-1].start, buffer[-1].end) == (20, 20)
+
+    name = buffer[1]
+    assert isinstance(name, TokenView) and name.require_name().value == "f"
+
+
+def as_columns(buffer: TokenBuffer) -> tuple[list[int], list[int], list[int]]:
+    return list(buffer.kinds), list(buffer.starts), list(buffer.ends)
+
+
+def test_parallel_matches_columnar():
+    sources = all_sources() + (
+        generate_source(300, seed=9),
+        'f\n    x\n"str\ny"\n/* block\nz */\ng\n    h',
+        "f\n    g\n        x\ny\n    z\n",
+    )
+    for src in sources:
+        expected = as_columns(tokenizer.tokenize_columnar(src))
+        for piece_size in (1, 5, 64):
+            assert (
+                as_columns(tokenize_parallel(src, max_workers=2, piece_size=piece_size))
+                == expected
+            ), (src, piece_size)
+
+
+def test_parallel_raises_the_first_error():
+    src = "f\nx\n" * 50 + "g @\n" + "y\n  z\n" * 50
+    with pytest.raises(ValueError) as e:
+        tokenizer.tokenize_columnar(src)
+    with pytest.raises(ValueError, match=f"^{re.escape(str(e.value))}$"):
+        tokenize_parallel(src, max_workers=2, piece_size=8)
+
+
+def test_tokenize_files_matches_columnar():
+    sources = (generate_source(200, seed=10), "f\n    x\n", "g", *all_sources())
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, src in enumerate(sources):
+            paths.append(os.path.join(directory, f"{i}.opo4"))
+            with open(paths[-1], "w") as file:
+                file.write(src)
+
+        # Small pieces, so that large files are cut and small ones batched
+        for piece_size in (None, 64):
+            buffers = tokenize_files(paths, max_workers=2, piece_size=piece_size)
+            for path, src in zip(paths, sources):
+                assert as_columns(buffers[path]) == as_columns(
+                    tokenizer.tokenize_columnar(src)
+                ), (src, piece_size)
+
+
+def test_every_engine_gives_the_same_spans():
+    for src in all_sources() + (generate_source(200, seed=3),):
+        expected = [
+            (t.start, t.end) for t in tokenizer.tokenize(src, tokenizer.Engine.PIPELINE)
+        ]
+        assert [(t.start, t.end) for t in tokenizer.tokenize(src)] == expected
+        assert [(t.start, t.end) for t in tokenizer.tokenize_stream(src, 4)] == expected
+
+        buffer = tokenizer.tokenize_columnar(src)
+        assert [buffer.span_at(i) for i in range(len(buffer))] == expected
+        assert [(t.start, t.end) for t in buffer] == expected
+        assert [(t.start, t.end) for t in buffer[::-1]] == expected[::-1]
+
+        for t in tokenizer.tokenize(src):
+            if t.type in (TokenType.NAME, TokenType.INT, TokenType.STR):
+                assert src[t.start : t.end] == t.value
+
+
+def test_line_index():
+    src = 'f\n    "two\nlines"\n\nlast'
+    index = LineIndex.of_source(src)
+    assert len(index) == 5
+    assert index.line_col(0) == (1, 0)
+    assert index.line_col(src.index('"')) == (2, 4)
+    assert index.line_col(src.index("lines")) == (3, 0)
+    assert index.line_col(len(src)) == (5, 4)
+    assert index.offset_of(5, 1) == src.index("ast")
+    assert LineIndex.of_source(io.StringIO(src)) == index
+
+
+def test_errors_after_multiline_tokens_point_at_the_right_line():
+    src = '/* one\ntwo */ x "a\nb" @\n'
+    for tokenize in all_tokenizers():
+        with pytest.raises(ValueError, match="line 3 col 3"):
+            tokenize(src)
+
+
+def dfa_tokenize(src: str) -> tuple[Token, ...]:
+    return tokenizer.final_step(
+        tokenizer.normalize_indents(
+            tokenizer.remove_blank_lines(tokenizer.dfa_raw_tokenize(src))
+        )
+    )
+
+
+def all_tokenizers() -> list[typing.Callable[[str], tuple[Token, ...]]]:
+    """
+    Every engine, and the pipeline with the DFA scanner in it
+    """
+    return [
+        *(
+            lambda src, engine=engine: tokenizer.tokenize(src, engine)
+            for engine in tokenizer.Engine
+        ),
+        dfa_tokenize,
+    ]
+
+
+def with_spans(tokens: typing.Iterable[Token]) -> list[tuple[object, str, int, int]]:
+    return [(t.type, t.value, t.start, t.end) for t in tokens]
+
+
+def test_relex_matches_tokenizing_the_edited_source():
+    rng = random.Random(5)
+    insertions = ("x", "12", " ", "    ", "\n", "\n    ", '"', "/*", "*/", "#c", "(")
+
+    src = generate_source(40, seed=7)
+    tokens: typing.Sequence[Token] = tokenizer.tokenize(src)
+    for i in range(300):
+        offset = rng.randint(0, len(src))
+        edit = TextEdit(
+            offset,
+            rng.randint(0, min(5, len(src) - offset)),
+            "".join(rng.choice(insertions) for _ in range(rng.randint(0, 3))),
+        )
+        try:
+            expected = tokenizer.tokenize(edit.apply(src))
+        except (AssertionError, ValueError):
+            continue
+
+        src, token_edit = relex(src, tokens, edit)
+        tokens = token_edit.splice(tokens) if i % 2 else token_edit.apply(tokens)
+        assert with_spans(tokens) == with_spans(expected), edit
+
+
+def test_relex_stops_once_back_in_sync():
+    src = generate_source(2000, seed=8)
+    tokens = tokenizer.tokenize(src)
+    middle = src.index("\n", len(src) // 2) + 1
+
+    new_src, token_edit = relex(src, tokens, TextEdit(middle, 0, "inserted(1 2)\n"))
+    assert len(token_edit.tokens) < 20
+    assert with_spans(token_edit.splice(tokens)) == with_spans(
+        tokenizer.tokenize(new_src)
+    )
@@ -0,0 +1,144 @@
+import pytest
+
+from src.orthophosphate.compiler.utils.copy_on_write_dict import COWDict
+from src.orthophosphate.compiler.utils.frozeniter import (
+    display,
+    frozeniter_of_iter,
+    get,
+    iter_of_frozeniter,
+    next_frozen,
+)
+
+
+class Colliding:
+    """
+    A key whose hash is the same as every other's
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __hash__(self) -> int:
+        return 7
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Colliding) and other.name == self.name
+
+
+def test_cow_dict_set_leaves_the_original():
+    empty: COWDict[str, int] = COWDict()
+    one = empty.set("a", 1)
+    two = one.set("b", 2)
+    changed = two.set("a", 3)
+
+    assert dict(empty) == {}
+    assert dict(one) == {"a": 1}
+    assert dict(two) == {"a": 1, "b": 2}
+    assert dict(changed) == {"a": 3, "b": 2}
+    assert len(changed) == 2
+    assert two.set("b", 2) is two
+
+
+def test_cow_dict_is_a_mapping():
+    bindings = COWDict({"x": 0, "y": 1})
+
+    assert bindings["y"] == 1
+    assert bindings.get("z") is None
+    assert bindings.get("z", 5) == 5
+    assert "x" in bindings and "z" not in bindings
+    assert bindings == {"x": 0, "y": 1}
+    assert sorted(bindings.items()) == [("x", 0), ("y", 1)]
+    with pytest.raises(KeyError):
+        bindings["z"]
+
+
+def test_cow_dict_matches_dict():
+    # Enough keys that the trie is several levels deep
+    expected: dict[int, int] = {}
+    bindings: COWDict[int, int] = COWDict()
+    versions = []
+    for i in range(5000):
+        key = (i * 7919) % 3001 - 1500
+        expected[key] = i
+        bindings = bindings.set(key, i)
+        versions.append((dict(expected), bindings))
+
+    for snapshot, version in versions[::250]:
+        assert len(version) == len(snapshot)
+        assert dict(version) == snapshot
+        assert all(version[k] == v for k, v in snapshot.items())
+
+
+def test_cow_dict_update_and_transient():
+    base = COWDict({i: i for i in range(100)})
+    updated = base.update((i, -i) for i in range(50, 200))
+
+    assert dict(base) == {i: i for i in range(100)}
+    assert dict(updated) == {i: i if i < 50 else -i for i in range(200)}
+
+    builder = updated.transient()
+    for i in range(1000):
+        builder[str(i)] = i
+    built = builder.persistent()
+    assert len(built) == 1200
+    assert dict(updated) == {i: i if i < 50 else -i for i in range(200)}
+    with pytest.raises(ValueError):
+        builder["late"] = 0
+
+    # Nodes built by the builder are shared now, so copied by set
+    again = built.set("0", -1)
+    assert built["0"] == 0 and again["0"] == -1
+
+
+def test_cow_dict_hash_collisions():
+    a, b, c = Colliding("a"), Colliding("b"), Colliding("c")
+    first = COWDict({a: 1, b: 2})
+    second = first.set(c, 3).set(a, 4)
+
+    assert dict(first) == {a: 1, b: 2}
+    assert dict(second) == {a: 4, b: 2, c: 3}
+    assert Colliding("d") not in second
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_frozeniter_replays_from_any_position(chunk_size: int):
+    start = frozeniter_of_iter(range(10), chunk_size)
+    positions = []
+    position = start
+    while position is not None:
+        positions.append(position)
+        position = next_frozen(position)
+
+    assert [get(p) for p in positions] == list(range(10))
+    # Going back to a position gives the same elements again
+    assert [get(p) for p in positions] == list(range(10))
+    for i, p in enumerate(positions):
+        assert list(iter_of_frozeniter(p)) == list(range(i, 10))
+    assert get(None) is None
+    with pytest.raises(ValueError):
+        next_frozen(None)
+
+
+def test_frozeniter_pulls_in_chunks():
+    pulled: list[int] = []
+
+    def source():
+        for i in range(10):
+            pulled.append(i)
+            yield i
+
+    position = frozeniter_of_iter(source(), 4)
+    assert pulled == [0, 1, 2, 3]
+    for _ in range(4):
+        position = next_frozen(position)
+    assert get(position) == 4 and pulled == list(range(8))
+    assert frozeniter_of_iter([]) is None
+
+
+def test_frozeniter_display():
+    start = frozeniter_of_iter("abcde", 2)
+
+    assert display(start, open_lazies=0) == "a : b : ... (Unevaluated)"
+    assert display(start) == "a : b : c : d : ... (Unevaluated)"
+    assert display(start, open_lazies=5) == "a : b : c : d : e : NIL"
+    assert display(start, maxsize=3, open_lazies=5) == "a : b : c : ..."